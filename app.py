@@ -1,36 +1,113 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, flash, g, stream_with_context
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 import os
+import re
+import signal
+import sys
 from datetime import datetime
-from database.models import Database, User, Post, Poke, Notification, Invite
+from database.models import DB_PATH, get_db, user_cache, write_behind, poke_limiter, User, Post, Poke, Message, Conversation, Notification, Activity, Invite
+from database.timeline import Timeline
+from database.friends import FriendGraph, contains
+from database.passwords import HasherBusy, hasher
+from database import backup, retention
+from database.ratelimit import TokenBucket
+from media.pipeline import UploadPipeline
+from media.storage import get_storage
+from realtime.delivery import ChatBusy, ChatFailed, pipeline as chat
+from realtime.presence import HEARTBEAT as PRESENCE_HEARTBEAT, presence
+from realtime.pubsub import SQLitePubSubManager
+from realtime.workers import serve
+from monitoring import instrument
+from web import caching
+from web.caching import conditional_json, fragment_cache, post_card
 import json
-import cloudinary
-import cloudinary.uploader
+import click
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production-2024')
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['UPLOAD_URL'] = '/static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name = os.environ.get('CLOUDINARY_CLOUD_NAME'),
-    api_key = os.environ.get('CLOUDINARY_API_KEY'),
-    api_secret = os.environ.get('CLOUDINARY_API_SECRET'),
-    secure = True
-)
-
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
-db = Database()
+# Reverse proxies in front of the app (Heroku's router, nginx, a load
+# balancer) whose X-Forwarded-For / -Proto headers are trusted; without
+# them every request would come from the proxy's address.
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 1 if os.environ.get('DYNO') else 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+# Cloudinary when it is configured, otherwise files under UPLOAD_FOLDER.
+app.config['UPLOAD_BACKEND'] = os.environ.get('UPLOAD_BACKEND', 'cloudinary' if os.environ.get('CLOUDINARY_CLOUD_NAME') else 'local')
+
+# Worker processes, for the built-in pre-fork server and gunicorn alike.
+app.config['WEB_CONCURRENCY'] = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Rooms live in each process's memory, so several workers need a message
+# queue: 'sqlite' or sqlite:////path/to/queue.db for one host, any URL
+# Flask-SocketIO understands (redis://, amqp://, kafka://) otherwise.
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE', 'sqlite' if app.config['WEB_CONCURRENCY'] > 1 else '')
+# 'threading' for Werkzeug and gunicorn's gthread worker, 'gevent' for its gevent worker.
+app.config['SOCKETIO_ASYNC_MODE'] = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+
+socketio = SocketIO()
+
+def socketio_options(config):
+    options = {'cors_allowed_origins': '*', 'async_mode': config['SOCKETIO_ASYNC_MODE']}
+    queue = config['SOCKETIO_MESSAGE_QUEUE']
+    if queue == 'sqlite' or queue.startswith('sqlite:///'):
+        path = queue[len('sqlite:///'):] or os.path.splitext(DB_PATH)[0] + '-socketio.db'
+        options['client_manager'] = SQLitePubSubManager(path)
+    elif queue:
+        options['message_queue'] = queue
+    if config['WEB_CONCURRENCY'] > 1:
+        # Long-polling needs sticky sessions, which several workers can't give.
+        options['transports'] = ['websocket']
+    return options
+
+def create_app(config=None):
+    # Opening SQLite, the upload storage and the message queue happens here
+    # rather than at import, so importing the module stays side-effect free.
+    if 'socketio' in app.extensions:
+        return app
+    app.config.update(config or {})
+    get_db()
+    options = socketio_options(app.config)
+    socketio.init_app(app, **options)
+    app.config['SOCKET_CLIENT_OPTIONS'] = {'transports': options['transports']} if 'transports' in options else {}
+    app.extensions['uploads'] = UploadPipeline(get_storage(app.config, app.root_path))
+    caching.init_app(app)
+    instrument.init_app(app, get_db().pool, component_stats)
+    retention.scheduler.start()
+    backup.scheduler.start()
+    # Each worker only sees its own sockets; with several they share a table.
+    presence.start(shared=app.config['WEB_CONCURRENCY'] > 1)
+    return app
+
+def shutdown():
+    # Run by every server entry point as a worker goes away: flush the
+    # notifications and activity rows still queued on the write-behind
+    # writer, stop the password hashing processes and take this worker's
+    # users out of the shared presence table.
+    write_behind.stop()
+    hasher.shutdown()
+    presence.stop()
+
+def component_stats():
+    return {'users': user_cache.stats(), 'write_behind': write_behind.stats(), 'uploads': app.extensions['uploads'].stats(),
+            'db_pool': get_db().pool.stats(), 'poke_limiter': poke_limiter.stats(), 'fragments': fragment_cache.stats(),
+            'passwords': hasher.stats(), 'login_throttle': login_throttle.stats(), 'address_throttle': address_throttle.stats(),
+            'retention': retention.scheduler.stats(), 'backup': backup.scheduler.stats(),
+            'chat': chat.stats(), 'presence': presence.stats()}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
 def get_current_user():
-    if 'user_id' in session:
-        return User.get_by_id(session['user_id'])
-    return None
+    if 'user_id' not in session:
+        return None
+    # Memoised per request; User.get_by_id itself is backed by the process cache.
+    if 'current_user' not in g:
+        g.current_user = User.get_by_id(session['user_id'])
+    return g.current_user
 
 def time_ago(timestamp):
     if isinstance(timestamp, str):
@@ -54,6 +131,75 @@ def time_ago(timestamp):
 
 app.jinja_env.filters['time_ago'] = time_ago
 
+def media_url(value, folder=''):
+    # Stored images are absolute URLs from the storage backend; older rows
+    # may hold a bare filename under static/uploads.
+    if not value or value.startswith(('http://', 'https://', '/')):
+        return value
+    return url_for('static', filename=f'uploads/{folder}{value}')
+
+app.jinja_env.filters['media_url'] = media_url
+
+@app.context_processor
+def socket_client_options():
+    return {'socket_options': app.config.get('SOCKET_CLIENT_OPTIONS', {}), 'presence_heartbeat_ms': int(PRESENCE_HEARTBEAT * 1000)}
+
+def upload_callbacks(user_id, kind, target_id):
+    # Runs on an upload worker: patch the row, then tell the uploader's tabs.
+    def on_done(url):
+        if kind == 'post':
+            Post.set_image(target_id, url)
+        else:
+            User.update(target_id, profile_pic=url)
+        socketio.emit('upload_complete', {'kind': kind, 'id': target_id, 'url': url}, room=f'user_{user_id}')
+    def on_error():
+        socketio.emit('upload_failed', {'kind': kind, 'id': target_id}, room=f'user_{user_id}')
+    return on_done, on_error
+
+FEED_PAGE_SIZE = 20
+INBOX_PAGE_SIZE = 20
+MESSAGE_PAGE_SIZE = 50
+COMMENT_PAGE_SIZE = 50
+MAX_MESSAGE_LENGTH = 5000
+MAX_RELATIONSHIP_IDS = 300
+MAX_PRESENCE_IDS = 300
+
+# Token buckets on /login and /register. The per-username bucket is the
+# real login limit: a burst of AUTH_BURST attempts, then AUTH_RATE per
+# minute. The per-address one is a looser backstop against one client
+# trying many usernames, loose because many users can share an address
+# (offices, carrier NAT).
+AUTH_BURST = int(os.environ.get('AUTH_BURST', 10))
+AUTH_RATE = float(os.environ.get('AUTH_RATE', 10))
+AUTH_IP_BURST = int(os.environ.get('AUTH_IP_BURST', 100))
+AUTH_IP_RATE = float(os.environ.get('AUTH_IP_RATE', 60))
+login_throttle = TokenBucket(rate=AUTH_RATE / 60, capacity=AUTH_BURST)
+address_throttle = TokenBucket(rate=AUTH_IP_RATE / 60, capacity=AUTH_IP_BURST)
+
+def throttled(*charges):
+    # Charges every (bucket, key), so a username being guessed from many
+    # addresses is slowed as well as one address trying many usernames. Over
+    # the limit it flashes a notice and returns the seconds to wait,
+    # otherwise None.
+    limited = [(bucket, key) for bucket, key in charges if not bucket.take(key)]
+    if not limited:
+        return None
+    retry_after = max(bucket.retry_after(key) for bucket, key in limited)
+    flash('⏳ Too many attempts. Please wait a minute and try again.', 'error')
+    return retry_after
+
+def parse_feed_cursor(value):
+    try:
+        created_at, post_id = value.rsplit(',', 1)
+        return created_at, int(post_id)
+    except (AttributeError, ValueError):
+        return None
+
+def feed_cursor(posts, limit):
+    if len(posts) < limit:
+        return None
+    return f"{posts[-1]['created_at']},{posts[-1]['id']}"
+
 @app.route('/')
 def index():
     if 'user_id' not in session:
@@ -69,7 +215,14 @@ def register():
         password = request.form['password']
         full_name = request.form['full_name']
         invite = request.form.get('invite_code')
-        user_id = User.create(username, email, password, full_name, invite)
+        retry_after = throttled((address_throttle, ('register', request.remote_addr)))
+        if retry_after is not None:
+            return render_template('register.html', invite_code=invite_code), 429, {'Retry-After': str(int(retry_after) + 1)}
+        try:
+            user_id = User.create(username, email, password, full_name, invite)
+        except HasherBusy:
+            flash('⏳ We are busy right now. Please try again in a moment.', 'error')
+            return render_template('register.html', invite_code=invite_code), 503, {'Retry-After': '5'}
         if user_id:
             flash('🎉 Registration successful! Please login.', 'success')
             return redirect(url_for('login'))
@@ -82,7 +235,14 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        user = User.verify_password(username, password)
+        retry_after = throttled((login_throttle, username.lower()), (address_throttle, ('login', request.remote_addr)))
+        if retry_after is not None:
+            return render_template('login.html'), 429, {'Retry-After': str(int(retry_after) + 1)}
+        try:
+            user = User.verify_password(username, password)
+        except HasherBusy:
+            flash('⏳ We are busy right now. Please try again in a moment.', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '5'}
         if user:
             session['user_id'] = user['id']
             session['username'] = user['username']
@@ -103,23 +263,35 @@ def home():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     user = get_current_user()
-    posts = Post.get_feed(session['user_id'])
+    posts = Timeline.get_feed(session['user_id'], limit=FEED_PAGE_SIZE)
     notifications_count = Notification.get_unread_count(session['user_id'])
     pokes = Poke.get_recent_pokes(session['user_id'], limit=5)
-    return render_template('home.html', user=user, posts=posts, notifications_count=notifications_count, pokes=pokes)
+    return render_template('home.html', user=user, posts=posts, notifications_count=notifications_count, pokes=pokes, next_cursor=feed_cursor(posts, FEED_PAGE_SIZE))
+
+@app.route('/api/feed')
+def feed_api():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    limit = min(max(request.args.get('limit', FEED_PAGE_SIZE, type=int), 1), 50)
+    before = parse_feed_cursor(request.args.get('before'))
+    posts = Timeline.get_feed(session['user_id'], limit=limit, before=before)
+    user = get_current_user()
+    html = ''.join(post_card(post, user) for post in posts)
+    return jsonify({'posts': posts, 'html': html, 'next_cursor': feed_cursor(posts, limit)})
 
 @app.route('/profile/<username>')
 def profile(username):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     current_user = get_current_user()
-    profile_user = User.get_by_username(username)
+    profile_user = current_user if current_user and current_user['username'] == username else User.get_by_username(username)
     if not profile_user:
         flash('❌ User not found!', 'error')
         return redirect(url_for('home'))
-    wall_posts = Post.get_wall_posts(profile_user['id'])
+    wall_posts = Post.get_wall_posts(profile_user['id'], viewer_id=session['user_id'])
     poke_count = profile_user.get('poke_count', 0)
-    return render_template('profile.html', user=current_user, profile_user=profile_user, wall_posts=wall_posts, poke_count=poke_count)
+    relationship = relationships(session['user_id'], [profile_user['id']])[profile_user['id']]
+    return render_template('profile.html', user=current_user, profile_user=profile_user, wall_posts=wall_posts, poke_count=poke_count, relationship=relationship)
 
 @app.route('/profile/<username>/edit', methods=['GET', 'POST'])
 def edit_profile(username):
@@ -132,17 +304,13 @@ def edit_profile(username):
     if request.method == 'POST':
         full_name = request.form.get('full_name')
         bio = request.form.get('bio', '')
-        profile_pic = user['profile_pic']
-        if 'profile_pic' in request.files:
-            file = request.files['profile_pic']
-            if file and file.filename and allowed_file(file.filename):
-                try:
-                    upload_result = cloudinary.uploader.upload(file, folder="socialhub/profiles", transformation=[{'width': 400, 'height': 400, 'crop': 'fill'}])
-                    profile_pic = upload_result['secure_url']
-                except Exception as e:
-                    flash('❌ Profile picture upload failed', 'error')
-        User.update(session['user_id'], full_name=full_name, bio=bio, profile_pic=profile_pic)
-        flash('✅ Profile updated successfully!', 'success')
+        User.update(session['user_id'], full_name=full_name, bio=bio)
+        file = request.files.get('profile_pic')
+        if file and file.filename and allowed_file(file.filename):
+            app.extensions['uploads'].submit(file, 'profile', *upload_callbacks(session['user_id'], 'profile', session['user_id']))
+            flash('✅ Profile updated! Your new picture is processing.', 'success')
+        else:
+            flash('✅ Profile updated successfully!', 'success')
         return redirect(url_for('profile', username=username))
     return render_template('edit_profile.html', user=user)
 
@@ -154,17 +322,12 @@ def create_post():
     wall_owner_id = request.form.get('wall_owner_id')
     if wall_owner_id:
         wall_owner_id = int(wall_owner_id)
-    image = None
-    if 'image' in request.files:
-        file = request.files['image']
-        if file and file.filename and allowed_file(file.filename):
-            try:
-                upload_result = cloudinary.uploader.upload(file, folder="socialhub/posts", transformation=[{'width': 1200, 'height': 1200, 'crop': 'limit'}])
-                image = upload_result['secure_url']
-            except Exception as e:
-                return jsonify({'error': 'Image upload failed'}), 500
-    post_id = Post.create(session['user_id'], content, image, wall_owner_id, None)
-    return jsonify({'success': True, 'post_id': post_id})
+    post_id = Post.create(session['user_id'], content, None, wall_owner_id, None)
+    file = request.files.get('image')
+    image_pending = bool(file and file.filename and allowed_file(file.filename))
+    if image_pending:
+        app.extensions['uploads'].submit(file, 'post', *upload_callbacks(session['user_id'], 'post', post_id))
+    return jsonify({'success': True, 'post_id': post_id, 'image_pending': image_pending})
 
 @app.route('/post/<int:post_id>/like', methods=['POST'])
 def like_post(post_id):
@@ -183,8 +346,9 @@ def comment_post(post_id):
 
 @app.route('/post/<int:post_id>/comments', methods=['GET'])
 def get_comments(post_id):
-    comments = Post.get_comments(post_id)
-    return jsonify(comments)
+    limit = min(max(request.args.get('limit', COMMENT_PAGE_SIZE, type=int), 1), 100)
+    comments = Post.get_comments(post_id, limit=limit, after=parse_feed_cursor(request.args.get('after')))
+    return conditional_json({'comments': comments, 'next_cursor': feed_cursor(comments, limit)})
 
 @app.route('/poke/<int:user_id>', methods=['POST'])
 def poke_user(user_id):
@@ -216,7 +380,7 @@ def notifications():
 def mark_notification_read(notif_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
-    Notification.mark_read(notif_id)
+    Notification.mark_read(notif_id, session['user_id'])
     return jsonify({'success': True})
 
 @app.route('/notifications/mark-all-read', methods=['POST'])
@@ -233,6 +397,12 @@ def notifications_count():
     count = Notification.get_unread_count(session['user_id'])
     return jsonify({'count': count})
 
+@app.route('/api/cache/stats')
+def cache_stats():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    return jsonify(component_stats())
+
 @app.route('/invite', methods=['GET', 'POST'])
 def invite_friends():
     if 'user_id' not in session:
@@ -257,7 +427,15 @@ def search():
     query = request.args.get('q', '')
     results = User.search(query) if query else []
     user = get_current_user()
-    return render_template('search.html', user=user, results=results, query=query)
+    return render_template('search.html', user=user, results=results, query=query,
+                           relationships=relationships(session['user_id'], [result['id'] for result in results]))
+
+@app.route('/api/search/suggest')
+def search_suggest():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    query = request.args.get('q', '').strip()
+    return jsonify(User.suggest(query) if query else [])
 
 @app.route('/friend/request/<int:user_id>', methods=['POST'])
 def send_friend_request(user_id):
@@ -266,140 +444,366 @@ def send_friend_request(user_id):
     
     if user_id == session['user_id']:
         return jsonify({'success': False, 'message': 'Cannot add yourself'})
+    if not User.get_by_id(user_id):
+        return jsonify({'success': False, 'message': 'User not found'}), 404
     
-    db = Database()
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # Check if already friends or request exists
-    cursor.execute('''SELECT id, status FROM friendships 
-                     WHERE (user_id = ? AND friend_id = ?) OR (user_id = ? AND friend_id = ?)''',
-                   (session['user_id'], user_id, user_id, session['user_id']))
-    existing = cursor.fetchone()
-    
-    if existing:
-        if existing['status'] == 'accepted':
-            conn.close()
-            return jsonify({'success': False, 'message': 'Already friends'})
-        else:
-            conn.close()
-            return jsonify({'success': False, 'message': 'Request already sent'})
+    result = FriendGraph.request(session['user_id'], user_id)
+    if result == 'friends':
+        return jsonify({'success': False, 'status': 'friends', 'message': 'Already friends'})
+    if result == 'pending_sent':
+        return jsonify({'success': False, 'status': 'pending_sent', 'message': 'Request already sent'})
+    if result == 'accepted':
+        # They had already asked: asking back accepts
+        friend_added(session['user_id'], user_id)
+        return jsonify({'success': True, 'status': 'friends', 'message': '✅ Friend request accepted!'})
     
-    # Create friend request
-    cursor.execute('''INSERT INTO friendships (user_id, friend_id, status) 
-                     VALUES (?, ?, 'pending')''', (session['user_id'], user_id))
+    # Notification and activity rows are written behind the request
+    Notification.add(user_id, 'friend_request', 'sent you a friend request', from_user_id=session['user_id'])
+    Activity.log(session['user_id'], 'friend_request', {'friend_id': user_id})
     
-    # Create notification
-    cursor.execute('''INSERT INTO notifications (user_id, type, content, from_user_id)
-                     VALUES (?, 'friend_request', 'sent you a friend request', ?)''',
-                   (user_id, session['user_id']))
-    
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'success': True, 'message': '✅ Friend request sent!'})
+    return jsonify({'success': True, 'status': 'pending_sent', 'message': '✅ Friend request sent!'})
 
 @app.route('/friend/accept/<int:request_id>', methods=['POST'])
 def accept_friend_request(request_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    db = Database()
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''UPDATE friendships SET status = 'accepted' 
-                     WHERE id = ? AND friend_id = ?''', (request_id, session['user_id']))
-    conn.commit()
-    conn.close()
-    
+    requester_id = FriendGraph.accept(session['user_id'], request_id)
+    if requester_id is None:
+        return jsonify({'success': False, 'message': 'Friend request not found'}), 404
+    friend_added(session['user_id'], requester_id)
     return jsonify({'success': True, 'message': '✅ Friend request accepted!'})
 
+@app.route('/friend/remove/<int:user_id>', methods=['POST'])
+def remove_friend(user_id):
+    # Unfriend, cancel a sent request or decline a received one
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    removed = FriendGraph.remove(session['user_id'], user_id)
+    if removed == 'accepted':
+        Timeline.invalidate(user_id, session['user_id'])
+    return jsonify({'success': removed is not None, 'status': 'none'})
+
+def friend_added(user_id, friend_id):
+    # New friend: both precomputed timelines are missing each other's posts
+    Timeline.invalidate(friend_id, user_id)
+    Activity.log(user_id, 'friend_accept', {'friend_id': friend_id})
+
 @app.route('/friend/status/<int:user_id>', methods=['GET'])
 def get_friend_status(user_id):
     if 'user_id' not in session:
         return jsonify({'status': 'not_logged_in'})
     
-    if user_id == session['user_id']:
-        return jsonify({'status': 'self'})
-    
-    db = Database()
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''SELECT status, user_id FROM friendships 
-                     WHERE (user_id = ? AND friend_id = ?) OR (user_id = ? AND friend_id = ?)''',
-                   (session['user_id'], user_id, user_id, session['user_id']))
-    friendship = cursor.fetchone()
-    conn.close()
-    
-    if not friendship:
-        return jsonify({'status': 'none'})
-    
-    if friendship['status'] == 'accepted':
-        return jsonify({'status': 'friends'})
-    elif friendship['user_id'] == session['user_id']:
-        return jsonify({'status': 'pending_sent'})
-    else:
-        return jsonify({'status': 'pending_received'})
+    status = FriendGraph.status(session['user_id'], user_id)
+    if status == 'self':
+        return jsonify({'status': status})
+    return jsonify({'status': status, 'mutual_friends': FriendGraph.mutual_counts(session['user_id'], [user_id])[user_id]})
+
+def relationships(user_id, user_ids):
+    # Friend status (with request direction) and last poke towards each user,
+    # from the cached adjacency plus one indexed pokes query, so pages can
+    # inline them instead of calling /friend/status per card.
+    statuses = FriendGraph.statuses(user_id, user_ids)
+    pokes = Poke.last_poked(user_id, [other_id for other_id in user_ids if other_id != user_id])
+    return {other_id: {'status': statuses[other_id], 'last_poke_at': pokes[other_id]['last_poke_at'] if other_id in pokes else None,
+                       'poked_recently': other_id in pokes and pokes[other_id]['recent']} for other_id in user_ids}
+
+@app.route('/api/relationships')
+def relationships_api():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    try:
+        user_ids = list(dict.fromkeys(int(value) for value in request.args.get('ids', '').split(',') if value.strip()))
+    except ValueError:
+        return jsonify({'error': 'ids must be comma-separated user ids'}), 400
+    if len(user_ids) > MAX_RELATIONSHIP_IDS:
+        return jsonify({'error': f'At most {MAX_RELATIONSHIP_IDS} ids per request'}), 400
+    return jsonify(relationships(session['user_id'], user_ids))
+
+@app.route('/api/presence')
+def presence_api():
+    # Which of the given users are online; only friends are ever reported.
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    try:
+        user_ids = list(dict.fromkeys(int(value) for value in request.args.get('ids', '').split(',') if value.strip()))
+    except ValueError:
+        return jsonify({'error': 'ids must be comma-separated user ids'}), 400
+    if len(user_ids) > MAX_PRESENCE_IDS:
+        return jsonify({'error': f'At most {MAX_PRESENCE_IDS} ids per request'}), 400
+    friends = FriendGraph.friends(session['user_id'])
+    return jsonify({'online': presence.online_among(user_id for user_id in user_ids if contains(friends, user_id))})
+
+@app.route('/api/export')
+def export_account():
+    # Streamed as it is read, so a large account never sits in memory.
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    response = Response(stream_with_context(backup.export_user(session['user_id'])), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f"attachment; filename=socialhub-{session['username']}.ndjson"
+    return response
+
+@app.route('/api/friends/suggestions')
+def friend_suggestions():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    suggestions = []
+    for user_id, mutual in FriendGraph.suggestions(session['user_id'], limit):
+        user = User.get_by_id(user_id)
+        if user:
+            suggestions.append({'id': user_id, 'username': user['username'], 'full_name': user['full_name'], 'profile_pic': user['profile_pic'], 'mutual_friends': mutual})
+    return jsonify(suggestions)
 
 @app.route('/messages')
 def messages():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     user = get_current_user()
-    return render_template('messages.html', user=user)
+    to = request.args.get('to', type=int)
+    chat_user = User.get_by_id(to) if to and to != user['id'] else None
+    if chat_user:
+        chat_user = dict(chat_user, online=FriendGraph.status(user['id'], to) == 'friends' and presence.is_online(to))
+    return render_template('messages.html', user=user, chat_user=chat_user, inbox=inbox_page(user['id']))
+
+def inbox_page(user_id, before=None):
+    conversations = Conversation.get_inbox(user_id, INBOX_PAGE_SIZE, before)
+    related = relationships(user_id, [conversation['other_id'] for conversation in conversations])
+    for conversation in conversations:
+        conversation['relationship'] = related[conversation['other_id']]
+        conversation['online'] = conversation['relationship']['status'] == 'friends' and presence.is_online(conversation['other_id'])
+    next_cursor = conversations[-1]['last_message_id'] if len(conversations) == INBOX_PAGE_SIZE else None
+    return {'conversations': conversations, 'next_cursor': next_cursor}
 
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, username, full_name, profile_pic FROM users WHERE id != ? LIMIT 50', (session['user_id'],))
-    users = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(users)
+    return conditional_json(inbox_page(session['user_id'], request.args.get('before', type=int)))
 
 @app.route('/api/messages/<int:friend_id>', methods=['GET'])
 def get_messages_api(friend_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''SELECT m.*, u.username, u.full_name, u.profile_pic FROM messages m
-        JOIN users u ON m.sender_id = u.id
-        WHERE (m.sender_id = ? AND m.receiver_id = ?) OR (m.sender_id = ? AND m.receiver_id = ?)
-        ORDER BY m.created_at ASC LIMIT 100''', (session['user_id'], friend_id, friend_id, session['user_id']))
-    messages = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(messages)
+    messages = Message.get_thread(session['user_id'], friend_id, MESSAGE_PAGE_SIZE, request.args.get('before', type=int))
+    next_cursor = messages[0]['id'] if len(messages) == MESSAGE_PAGE_SIZE else None
+    return conditional_json({'messages': messages, 'next_cursor': next_cursor})
+
+@app.route('/api/messages/<int:friend_id>/read', methods=['POST'])
+def mark_messages_read(friend_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    return jsonify({'success': True, 'marked': Conversation.mark_read(session['user_id'], friend_id)})
+
+def push_notification(notification):
+    # The row is written either way; nobody connected means nothing to push.
+    if not presence.is_online(notification['user_id']):
+        return
+    sender = User.get_by_id(notification['from_user_id']) if notification['from_user_id'] else None
+    # Counted, not cached: another worker may have read or added some since.
+    payload = dict(notification, count=Notification.get_unread_count(notification['user_id'], fresh=True), from_user=sender['full_name'] if sender else None)
+    event = 'new_poke' if notification['type'] == 'poke' else 'new_notification'
+    socketio.emit(event, payload, room=f"user_{notification['user_id']}")
+
+Notification.listeners.append(push_notification)
+
+# Pages tag pending messages with an id of their own making; it ends up in
+# an HTML attribute and a selector, so only word characters and dashes.
+CLIENT_ID = re.compile(r'[\w-]{1,64}')
+
+def chat_room(user_id, other_id):
+    return f'chat_{min(user_id, other_id)}_{max(user_id, other_id)}'
+
+def notify_messages(messages):
+    # One "sent you a message" check per pair in the batch, not per message.
+    for receiver_id, sender_id in dict.fromkeys((message['receiver_id'], message['sender_id']) for message in messages):
+        Notification.notify_once(receiver_id, 'message', 'sent you a message', sender_id)
+
+def push_read_receipts(receipts):
+    for reader_id, other_id, count in receipts:
+        # "Seen" is shown to the other side only.
+        if not presence.is_online(other_id):
+            continue
+        socketio.emit('messages_read', {'reader_id': reader_id, 'other_id': other_id, 'count': count}, room=chat_room(reader_id, other_id))
+
+def push_presence(changes):
+    # Only friends who are online themselves hear about it.
+    for user_id, online in changes.items():
+        for friend_id in presence.online_among(FriendGraph.friends(user_id)):
+            socketio.emit('presence', {'user_id': user_id, 'online': online}, room=f'user_{friend_id}')
+
+chat.message_listeners.append(notify_messages)
+chat.read_listeners.append(push_read_receipts)
+presence.listeners.append(push_presence)
 
 @socketio.on('connect')
 def handle_connect():
     if 'user_id' in session:
         join_room(f'user_{session["user_id"]}')
+        presence.connect_socket(request.sid, session['user_id'])
+        # Kept for the life of the socket, so messages carry the sender's
+        # name and picture without a lookup each.
+        user = User.get_by_id(session['user_id'])
+        if user:
+            session['chat_profile'] = {'username': user['username'], 'full_name': user['full_name'], 'profile_pic': user['profile_pic']}
+        emit('notification_count', {'count': Notification.get_unread_count(session['user_id'])})
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    presence.disconnect_socket(request.sid)
+
+@socketio.on('heartbeat')
+def handle_heartbeat():
+    if 'user_id' in session:
+        presence.heartbeat(request.sid, session['user_id'])
 
 @socketio.on('join')
 def on_join(data):
-    join_room(data['room'])
+    # Only a conversation the user is part of, with someone who exists.
+    if 'user_id' not in session:
+        return {'error': 'unauthenticated'}
+    room = str((data or {}).get('room', ''))
+    parts = room.split('_')
+    if len(parts) != 3 or parts[0] != 'chat' or not parts[1].isdigit() or not parts[2].isdigit():
+        return {'error': 'invalid_room'}
+    user_a, user_b = int(parts[1]), int(parts[2])
+    if user_a >= user_b or session['user_id'] not in (user_a, user_b):
+        return {'error': 'forbidden'}
+    if not User.get_by_id(user_b if session['user_id'] == user_a else user_a):
+        return {'error': 'not_found'}
+    join_room(room)
+    return {'room': room}
 
 @socketio.on('send_message')
 def handle_message(data):
+    # Acked with the stored message id once its batch has committed. The
+    # sending socket's copy also carries its client_id, so that tab can swap
+    # its pending bubble for the real one; nobody else ever sees it.
+    if 'user_id' not in session or 'chat_profile' not in session:
+        return {'error': 'unauthenticated'}
+    data = data or {}
+    client_id = data.get('client_id')
+    if client_id is not None and not (isinstance(client_id, str) and CLIENT_ID.fullmatch(client_id)):
+        return {'error': 'invalid'}
+    content = data.get('message')
+    try:
+        receiver_id = int(data['receiver_id'])
+    except (KeyError, TypeError, ValueError):
+        return {'error': 'invalid', 'client_id': client_id}
+    if not isinstance(content, str) or not content.strip() or len(content) > MAX_MESSAGE_LENGTH or receiver_id == session['user_id']:
+        return {'error': 'invalid', 'client_id': client_id}
+    room = chat_room(session['user_id'], receiver_id)
+    if room not in rooms():
+        return {'error': 'not_joined', 'client_id': client_id}
+    try:
+        message = chat.send(session['user_id'], receiver_id, content)
+    except ChatBusy:
+        return {'error': 'busy', 'client_id': client_id}
+    except ChatFailed:
+        return {'error': 'failed', 'client_id': client_id}
+    payload = dict(message, **session['chat_profile'], timestamp=datetime.now().strftime('%H:%M'))
+    emit('receive_message', payload, room=room, skip_sid=request.sid)
+    emit('receive_message', dict(payload, client_id=client_id))
+    return {'id': message['id'], 'client_id': client_id}
+
+@socketio.on('mark_read')
+def handle_mark_read(data):
+    # Applied with the next chat batch; the room hears messages_read after.
     if 'user_id' not in session:
-        return
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, ?)', (session['user_id'], data['receiver_id'], data['message']))
-    conn.commit()
-    message_id = cursor.lastrowid
-    cursor.execute('SELECT username, full_name, profile_pic FROM users WHERE id = ?', (session['user_id'],))
-    sender = dict(cursor.fetchone())
+        return {'error': 'unauthenticated'}
+    try:
+        other_id = int((data or {})['other_id'])
+        chat.mark_read(session['user_id'], other_id)
+    except (KeyError, TypeError, ValueError):
+        return {'error': 'invalid'}
+    except ChatBusy:
+        return {'error': 'busy'}
+    return {'queued': True}
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    repaired = Post.reconcile_counters()
+    print(f'Repaired counters on {repaired} posts')
+
+@app.cli.command('timelines-rebuild')
+def timelines_rebuild_command():
+    rebuilt = Timeline.rebuild()
+    print(f'Rebuilt {rebuilt} timelines')
+
+@app.cli.command('timelines-trim')
+def timelines_trim_command():
+    trimmed = Timeline.trim()
+    print(f'Trimmed {trimmed} timelines')
+
+@app.cli.command('retention-run')
+@click.option('--dry-run', is_flag=True, help='count what would be removed without touching it')
+def retention_run_command(dry_run):
+    report = retention.run(dry_run=dry_run)
+    for table, stats in report['tables'].items():
+        verb = 'would remove' if dry_run else ('archived' if stats['action'] == 'archive' else 'deleted')
+        print(f"{table}: {verb} {stats['rows']} rows older than {stats['cutoff']} in {stats['seconds']}s")
+    if 'compact' in report:
+        compact = report['compact']
+        print(f"compact: freed {compact['freed_pages']} pages, {compact['free_pages']} still free in {compact['seconds']}s" +
+              ('' if compact['incremental'] else ' (auto_vacuum is off; run retention-compact --full once)'))
+
+@app.cli.command('retention-compact')
+@click.option('--full', is_flag=True, help='VACUUM into incremental auto_vacuum mode; rewrites the whole file')
+def retention_compact_command(full):
+    conn = get_db().get_connection()
+    if full:
+        retention.enable_incremental_vacuum(conn)
+    compact = retention.compact(conn)
     conn.close()
-    room = f"chat_{min(session['user_id'], data['receiver_id'])}_{max(session['user_id'], data['receiver_id'])}"
-    emit('receive_message', {'id': message_id, 'sender_id': session['user_id'], 'receiver_id': data['receiver_id'], 'content': data['message'], 'username': sender['username'], 'full_name': sender['full_name'], 'profile_pic': sender['profile_pic'], 'timestamp': datetime.now().strftime('%H:%M')}, room=room, include_self=True)
+    print(f"freed {compact['freed_pages']} pages, {compact['free_pages']} still free")
+
+@app.cli.command('backup-run')
+def backup_run_command():
+    lock = backup.BackupLock()
+    if not lock.acquire():
+        raise click.ClickException('another backup is running')
+    try:
+        report = backup.snapshot()
+    finally:
+        lock.release()
+    print(f"{report['path']}: {report['bytes']} bytes in {report['steps']} steps, {report['seconds']}s; rotated out {report['rotated']}")
+
+@app.cli.command('backup-check')
+@click.argument('path', required=False)
+@click.option('--full', is_flag=True, help='PRAGMA integrity_check instead of quick_check')
+def backup_check_command(path, full):
+    path = path or next(iter(backup.snapshots()), None)
+    if path is None:
+        raise click.ClickException(f'no snapshots in {backup.BACKUP_DIR}')
+    ok, problems = backup.check(path, 'full' if full else 'quick')
+    print(f"{path}: {'ok' if ok else 'DAMAGED'}")
+    if not ok:
+        print('\n'.join(problems[:20]))
+        raise SystemExit(1)
+
+@app.cli.command('export-user')
+@click.argument('username')
+@click.option('--output', type=click.File('w'), default='-', help='file to write, stdout by default')
+def export_user_command(username, output):
+    user = User.get_by_username(username)
+    if user is None:
+        raise click.ClickException(f'no user {username}')
+    for line in backup.export_user(user['id']):
+        output.write(line)
 
 if __name__ == '__main__':
+    # Development server; production runs gunicorn -c gunicorn.conf.py.
+    create_app()
     port = int(os.environ.get('PORT', 5000))
     print("🚀 Starting SocialHub V2")
-    socketio.run(app, host='0.0.0.0', port=port, debug=False, allow_unsafe_werkzeug=True)
+    if app.config['WEB_CONCURRENCY'] > 1:
+        serve(app, '0.0.0.0', port, app.config['WEB_CONCURRENCY'], on_exit=shutdown)
+    else:
+        # SIGTERM would otherwise end the process without unwinding, skipping
+        # the flush below.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            socketio.run(app, host='0.0.0.0', port=port, debug=False, allow_unsafe_werkzeug=True)
+        finally:
+            shutdown()
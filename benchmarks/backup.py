@@ -0,0 +1,103 @@
+# Request latency while a snapshot of a large database is taken from a
+# background thread: readers load /home and a writer keeps posting while
+# the backup runs, first as one unthrottled backup step, then paged and
+# throttled the way database.backup runs it by default.
+#
+#   python -m benchmarks.backup [size_mb] [readers]
+#
+# The database is freshly written, so most of it is still in the page
+# cache; on a cold cache the copy itself takes longer, not the requests.
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.timeline import percentile
+
+USERS = 50
+ROW_BYTES = 2000
+
+def fill(path, size_mb):
+    # Bulk posts straight through sqlite3 until the file reaches size_mb.
+    conn = sqlite3.connect(path)
+    filler = 'x' * ROW_BYTES
+    written = 0
+    while os.path.getsize(path) < size_mb * 2**20:
+        conn.executemany("INSERT INTO posts (user_id, wall_owner_id, content, created_at) VALUES (?, ?, ?, datetime('now', '-1 day'))",
+                         ((i % USERS + 1, i % USERS + 1, filler) for i in range(written, written + 50000)))
+        conn.commit()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        written += 50000
+    conn.close()
+
+def traffic(app, readers, cookie, stop):
+    pages, writes = [], []
+
+    def read():
+        client = app.test_client(use_cookies=False)
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get('/home', headers={'Cookie': f'session={cookie}'})
+            pages.append(time.perf_counter() - started)
+
+    def write():
+        client = app.test_client(use_cookies=False)
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.post('/post/create', data={'content': 'written during the backup'}, headers={'Cookie': f'session={cookie}'})
+            writes.append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=read) for _ in range(readers)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    return threads, pages, writes
+
+def measure(app, readers, cookie, seconds=None, backup=None):
+    # Traffic for `seconds`, or for as long as backup() takes.
+    stop = threading.Event()
+    threads, pages, writes = traffic(app, readers, cookie, stop)
+    started = time.perf_counter()
+    report = backup() if backup else time.sleep(seconds)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return elapsed, pages, writes, report
+
+def line(label, elapsed, pages, writes):
+    return (f'{label:>22}: {elapsed:6.1f}s | /home p50 {percentile(pages, 50) * 1000:6.1f} p99 {percentile(pages, 99) * 1000:7.1f} ms | '
+            f'post p50 {percentile(writes, 50) * 1000:6.1f} p99 {percentile(writes, 99) * 1000:7.1f} ms ({len(writes)} writes)')
+
+def main(size_mb=2048, readers=4):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'backup.db')
+        os.environ['DATABASE_PATH'] = path
+        import app as app_module
+        from database import backup
+        from database.models import User
+        app = app_module.create_app()
+        app.logger.disabled = True
+        logging.getLogger('monitoring.sql').setLevel(logging.CRITICAL)
+        for i in range(USERS):
+            User.create(f'user{i}', f'user{i}@example.com', 'secret', f'User {i}')
+        started = time.perf_counter()
+        fill(path, size_mb)
+        print(f'{os.path.getsize(path) / 2**30:.2f} GiB database written in {time.perf_counter() - started:.0f}s, {os.cpu_count()} CPUs, {readers} readers + 1 writer')
+        cookie = app.session_interface.get_signing_serializer(app).dumps({'user_id': 1, 'username': 'user0'})
+        measure(app, readers, cookie, 1)
+
+        elapsed, pages, writes, _ = measure(app, readers, cookie, 10)
+        print(line('no backup', elapsed, pages, writes))
+        for label, pages_per_step, pause in (('one step', -1, 0), (f'{backup.PAGES} pages/step', backup.PAGES, backup.PAUSE)):
+            directory = os.path.join(tmp, label.replace(' ', '-').replace('/', '-'))
+            elapsed, pages, writes, report = measure(app, readers, cookie, backup=lambda: backup.snapshot(directory, pages_per_step, pause))
+            wal = os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0
+            print(line(label, elapsed, pages, writes) + f" | {report['steps']} steps, check {report['seconds'] - report['copy_seconds']:.1f}s, wal {wal / 2**20:.0f} MiB")
+            os.remove(report['path'])
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
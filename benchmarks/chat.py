@@ -0,0 +1,90 @@
+# Sustained chat throughput through the delivery pipeline: many simulated
+# clients each send messages back to back, waiting for every ack, while
+# their partners receive them and send read receipts. Run once with one
+# commit per message (CHAT_BATCH_SIZE=1) and once with group commit.
+#
+#   python -m benchmarks.chat [pairs] [messages_per_client]
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from benchmarks.realtime import ROOT, SocketClient, chat_room, free_port, login, start_server
+from benchmarks.timeline import percentile
+
+def run(env, pairs, per_client):
+    port = free_port()
+    server = start_server(port, env)
+    try:
+        cookies = {user_id: login(port, f'user{user_id}') for user_id in range(1, pairs * 2 + 1)}
+        clients = {user_id: SocketClient(port, cookie) for user_id, cookie in cookies.items()}
+        for user_id, client in clients.items():
+            partner = user_id + 1 if user_id % 2 else user_id - 1
+            client.emit('join', {'room': chat_room(user_id, partner)}, ack=True)
+        acks, errors = [], []
+
+        def talk(user_id):
+            # Both sides of a pair talk, so receipts and messages interleave.
+            client = clients[user_id]
+            partner = user_id + 1 if user_id % 2 else user_id - 1
+            for i in range(per_client):
+                started = time.perf_counter()
+                ack = client.emit('send_message', {'receiver_id': partner, 'message': f'{user_id}:{i}', 'client_id': f'{user_id}-{i}'}, ack=True)
+                if not ack or 'id' not in ack:
+                    errors.append(ack)
+                    continue
+                acks.append(time.perf_counter() - started)
+                if i % 10 == 9:
+                    client.emit('mark_read', {'other_id': partner})
+
+        threads = [threading.Thread(target=talk, args=(user_id,)) for user_id in clients]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        received = sum(len(client.received('receive_message', per_client * 2, 2)) for client in clients.values())
+        for client in clients.values():
+            client.close()
+        request = urllib.request.Request(f'http://127.0.0.1:{port}/api/cache/stats', headers={'Cookie': cookies[1]})
+        stats = json.load(urllib.request.urlopen(request))['chat']
+        return acks, errors, received, elapsed, stats
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(pairs=25, per_client=40):
+    with tempfile.TemporaryDirectory() as tmp:
+        sys.path.insert(0, ROOT)
+        total = pairs * 2 * per_client
+        print(f'{pairs * 2} clients x {per_client} messages, {os.cpu_count()} CPUs')
+        for label, settings in (('per message', {'CHAT_BATCH_SIZE': '1', 'CHAT_FLUSH_MS': '0'}), ('group commit', {})):
+            path = os.path.join(tmp, f"chat-{settings.get('CHAT_BATCH_SIZE', 'batched')}.db")
+            env = dict(os.environ, DATABASE_PATH=path, SECRET_KEY='benchmark', UPLOAD_BACKEND='local', AUTH_BURST='1000000', AUTH_IP_BURST='1000000', PASSWORD_HASH_WORKERS='0', **settings)
+            prepare(env, pairs)
+            acks, errors, received, elapsed, stats = run(env, pairs, per_client)
+            conn = sqlite3.connect(path)
+            stored = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+            unread = conn.execute('SELECT SUM(unread_a + unread_b) FROM conversations').fetchone()[0]
+            conn.close()
+            # Each message reaches both ends of the room, the sender's own copy included.
+            print(f'{label:>12}: {len(acks) / elapsed:7.1f} msgs/s | ack p50 {percentile(acks, 50) * 1000:6.1f} p99 {percentile(acks, 99) * 1000:6.1f} ms | '
+                  f'{stored}/{total} stored, {received}/{total * 2} delivered, {len(errors)} errors, {unread} unread left | '
+                  f"{stats['batches']} commits, largest batch {stats['largest_batch']}")
+
+def prepare(env, pairs):
+    # Users are created in a child process so this one never opens the
+    # benchmark database with the pool's module-level path.
+    script = ('from database.models import User\n'
+              f'for i in range(1, {pairs * 2 + 1}):\n'
+              "    User.create(f'user{i}', f'user{i}@example.com', 'secret', f'User {i}')\n")
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, check=True)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
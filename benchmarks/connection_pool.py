@@ -0,0 +1,52 @@
+# Per-request DB overhead: the old "Database() per call" pattern vs the pool.
+# A /home render makes four model calls, so one "request" here is four calls.
+#
+#   python -m benchmarks.connection_pool [requests]
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from database.models import Database, SCHEMA
+
+CALLS_PER_REQUEST = 4
+QUERY = 'SELECT COUNT(*) FROM notifications WHERE user_id = ? AND read = 0'
+
+def legacy_call(db_path):
+    conn = sqlite3.connect(db_path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute(QUERY, (1,)).fetchone()
+    conn.close()
+
+def pooled_call(db):
+    conn = db.get_connection()
+    conn.execute(QUERY, (1,)).fetchone()
+    conn.close()
+
+def measure(fn, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        for _ in range(CALLS_PER_REQUEST):
+            fn()
+    return (time.perf_counter() - start) / requests * 1e6
+
+def main(requests=2000):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db = Database(db_path)
+        legacy = measure(lambda: legacy_call(db_path), requests)
+        pooled = measure(lambda: pooled_call(db), requests)
+        db.pool.close_all()
+    print(f'requests: {requests} ({CALLS_PER_REQUEST} DB calls each)')
+    print(f'legacy Database() per call: {legacy:9.1f} us/request')
+    print(f'pooled connection:          {pooled:9.1f} us/request')
+    print(f'speedup:                    {legacy / pooled:9.1f}x')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
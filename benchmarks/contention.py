@@ -0,0 +1,148 @@
+# Many threads hammering POST /post/<id>/like and POST /poke/<id> for a few
+# colliding users, with the old check-then-write paths for comparison. The
+# current paths must leave every count exact; exits 1 if they don't.
+#
+#   python -m benchmarks.contention [threads] [requests_per_thread]
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+USERS = 8
+
+# The pre-fix paths, except that a failed statement rolls back and returns
+# the connection; otherwise one IntegrityError leaks a connection holding
+# the write lock and every later request just times out.
+def legacy_toggle_like(post_id, user_id):
+    from database.models import get_db
+    conn = get_db().get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM likes WHERE post_id = ? AND user_id = ?', (post_id, user_id))
+        if cursor.fetchone():
+            cursor.execute('DELETE FROM likes WHERE post_id = ? AND user_id = ?', (post_id, user_id))
+            cursor.execute('UPDATE posts SET likes_count = likes_count - 1 WHERE id = ?', (post_id,))
+            action = 'unliked'
+        else:
+            cursor.execute('INSERT INTO likes (post_id, user_id) VALUES (?, ?)', (post_id, user_id))
+            cursor.execute('UPDATE posts SET likes_count = likes_count + 1 WHERE id = ?', (post_id,))
+            action = 'liked'
+        cursor.execute('SELECT likes_count FROM posts WHERE id = ?', (post_id,))
+        row = cursor.fetchone()
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return {'action': action, 'count': row['likes_count'] if row else 0}
+
+def legacy_send_poke(poker_id, poked_id):
+    from database.models import get_db, User
+    conn = get_db().get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM pokes WHERE poker_id = ? AND poked_id = ? AND created_at > datetime('now', '-1 hour')", (poker_id, poked_id))
+        if cursor.fetchone():
+            return False
+        cursor.execute('INSERT INTO pokes (poker_id, poked_id) VALUES (?, ?)', (poker_id, poked_id))
+        cursor.execute('UPDATE users SET poke_count = poke_count + 1 WHERE id = ?', (poked_id,))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    User.invalidate(poked_id)
+    return True
+
+def hammer(app, cookies, post_id, target_id, threads, requests):
+    # Each request is a like toggle or a poke by one of a handful of users,
+    # so the same (user, post) and (poker, poked) pairs collide constantly.
+    toggles = {user_id: 0 for user_id in cookies}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client(use_cookies=False)
+        for _ in range(requests):
+            user_id = rng.choice(list(cookies))
+            headers = {'Cookie': f'session={cookies[user_id]}'}
+            if rng.random() < 0.5:
+                response = client.post(f'/post/{post_id}/like', headers=headers)
+                with lock:
+                    if response.status_code == 200:
+                        toggles[user_id] += 1
+                    else:
+                        errors.append(response.status_code)
+            else:
+                response = client.post(f'/poke/{target_id}', headers=headers)
+                if response.status_code != 200:
+                    with lock:
+                        errors.append(response.status_code)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return toggles, errors, time.perf_counter() - start
+
+def check(conn, post_id, target_id, toggles):
+    likes = conn.execute('SELECT COUNT(*) FROM likes WHERE post_id = ?', (post_id,)).fetchone()[0]
+    likes_count = conn.execute('SELECT likes_count FROM posts WHERE id = ?', (post_id,)).fetchone()[0]
+    # A toggle that returned 200 flipped the like, so odd counts end liked.
+    expected_likes = sum(count % 2 for count in toggles.values())
+    pokes = conn.execute('SELECT COUNT(*) FROM pokes WHERE poked_id = ?', (target_id,)).fetchone()[0]
+    poke_count = conn.execute('SELECT poke_count FROM users WHERE id = ?', (target_id,)).fetchone()[0]
+    pokers = len(toggles)
+    problems = []
+    if likes != expected_likes:
+        problems.append(f'{likes} like rows, expected {expected_likes}')
+    if likes_count != likes:
+        problems.append(f'likes_count {likes_count} != {likes} rows')
+    if pokes != pokers:
+        problems.append(f'{pokes} pokes, expected {pokers}')
+    if poke_count != pokes:
+        problems.append(f'poke_count {poke_count} != {pokes} rows')
+    return problems
+
+def main(threads=8, requests=50):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_PATH'] = os.path.join(tmp, 'contention.db')
+        import app as app_module
+        from database.models import Post, Poke, User
+        app = app_module.create_app()
+        # Failed requests are expected in the legacy run; count them quietly.
+        app.logger.disabled = True
+        for name in ('monitoring.sql', 'database.writer'):
+            logging.getLogger(name).setLevel(logging.CRITICAL)
+        serializer = app.session_interface.get_signing_serializer(app)
+        user_ids = [User.create(f'user{i}', f'user{i}@example.com', 'secret', f'User {i}') for i in range(USERS + 2)]
+        cookies = {user_id: serializer.dumps({'user_id': user_id}) for user_id in user_ids[:USERS]}
+        current = (Post.toggle_like, Poke.send_poke)
+        failed = False
+        print(f'{threads} threads x {requests} requests, {USERS} users')
+        for label, (toggle_like, send_poke), target_id in (('check-then-write', (legacy_toggle_like, legacy_send_poke), user_ids[-2]),
+                                                          ('atomic', current, user_ids[-1])):
+            Post.toggle_like, Poke.send_poke = staticmethod(toggle_like), staticmethod(send_poke)
+            post_id = Post.create(target_id, f'{label} post')
+            toggles, errors, elapsed = hammer(app, cookies, post_id, target_id, threads, requests)
+            app_module.write_behind.flush()
+            conn = app_module.get_db().get_connection()
+            problems = check(conn, post_id, target_id, toggles)
+            conn.close()
+            total = threads * requests
+            print(f'{label:>16}: {total / elapsed:8.0f} req/s | {len(errors):4d} errors | ' + ('; '.join(problems) or 'counts exact'))
+            failed = bool(problems or errors) and toggle_like is current[0]
+        Post.toggle_like, Poke.send_poke = (staticmethod(fn) for fn in current)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:3])))
@@ -0,0 +1,199 @@
+# Synthetic social graph for benchmarks and local load tests. Friendships
+# follow preferential attachment, so degrees are power-law distributed; the
+# busiest users also post, like and chat the most.
+#
+#   python -m benchmarks.generate --users 5000 [--db database/socialhub.db] [--reset]
+#
+# Every account's password is GENERATED_PASSWORD. Rows are bulk-loaded into
+# the baseline tables, then the migrations run and backfill their derived
+# state (indexes, post counters, the search index, conversations).
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+from werkzeug.security import generate_password_hash
+
+from database.passwords import METHOD
+
+GENERATED_PASSWORD = 'password'
+SYLLABLES = ['an', 'ber', 'cha', 'dan', 'el', 'fi', 'go', 'han', 'is', 'jo', 'ka', 'li', 'mar', 'no', 'ol', 'pe', 'ra', 'sam', 'ti', 'vel', 'wen', 'yu', 'zo']
+WORDS = ['coffee', 'weekend', 'hiking', 'new', 'photo', 'friends', 'concert', 'trip', 'dinner', 'finally', 'great', 'day', 'work', 'beach',
+         'game', 'tonight', 'birthday', 'book', 'movie', 'city', 'run', 'morning', 'project', 'happy', 'tired', 'lunch', 'music', 'home']
+PENDING_SHARE = 0.05
+
+def name(rng, parts):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(parts))
+
+def sentence(rng, low, high):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+    return text[0].upper() + text[1:]
+
+def timestamp(seconds):
+    # Same format as SQLite's CURRENT_TIMESTAMP, so keyset cursors compare correctly.
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def heavy_tail(rng, mean):
+    # Pareto(1.5) shifted to start at zero has mean 2; scale it to the target.
+    return int((rng.paretovariate(1.5) - 1) * mean / 2)
+
+def friendships(rng, users, mean_degree):
+    # Barabasi-Albert: each newcomer befriends m existing users picked in
+    # proportion to their degree, giving a P(k) ~ k^-3 tail.
+    m = max(1, min(mean_degree // 2, users - 1))
+    edges = set()
+    targets = []
+    for user in range(2, m + 2):
+        for other in range(1, user):
+            edges.add((other, user))
+            targets += (other, user)
+    for user in range(m + 2, users + 1):
+        chosen = set()
+        while len(chosen) < m:
+            chosen.add(rng.choice(targets))
+        for other in chosen:
+            edges.add((other, user))
+            targets += (other, user)
+    return edges
+
+def populate(conn, args):
+    rng = random.Random(args.seed)
+    now = time.time()
+    since = now - args.days * 86400
+    password_hash = generate_password_hash(GENERATED_PASSWORD, METHOD)
+    counts = {}
+
+    users = []
+    for i in range(1, args.users + 1):
+        first, last = name(rng, 2).title(), name(rng, 3).title()
+        users.append((f'{first.lower()}{i}', f'user{i}@example.com', password_hash, f'{first} {last}', sentence(rng, 3, 8),
+                      f'https://ui-avatars.com/api/?name={first}+{last}&size=200', f'INV{i:08d}', timestamp(since - rng.random() * 86400)))
+    conn.executemany('INSERT INTO users (username, email, password_hash, full_name, bio, profile_pic, invite_code, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', users)
+    counts['users'] = len(users)
+
+    edges = friendships(rng, args.users, args.friends)
+    friends = {user: [] for user in range(1, args.users + 1)}
+    rows = []
+    for a, b in edges:
+        if rng.random() < PENDING_SHARE:
+            rows.append((a, b, 'pending', timestamp(rng.uniform(since, now))))
+            continue
+        friends[a].append(b)
+        friends[b].append(a)
+        rows.append((a, b, 'accepted', timestamp(rng.uniform(since, now))) if rng.random() < 0.5 else (b, a, 'accepted', timestamp(rng.uniform(since, now))))
+    conn.executemany('INSERT INTO friendships (user_id, friend_id, status, created_at) VALUES (?, ?, ?, ?)', rows)
+    counts['friendships'] = len(rows)
+
+    # Activity scales with degree: well-connected users post and chat more.
+    ids = list(friends)
+    weights = [len(friends[user]) + 1 for user in ids]
+
+    def audience(author, size):
+        pool = friends[author]
+        picked = set(rng.sample(pool, min(size, len(pool))))
+        while len(picked) < min(size, args.users - 1):
+            other = rng.randint(1, args.users)
+            if other != author:
+                picked.add(other)
+        return picked
+
+    posts = []
+    for author in rng.choices(ids, weights, k=int(args.users * args.posts)):
+        wall = rng.choice(friends[author]) if friends[author] and rng.random() < 0.1 else None
+        posts.append((author, wall, sentence(rng, 4, 30), rng.uniform(since, now)))
+    posts.sort(key=lambda post: post[3])
+    conn.executemany('INSERT INTO posts (user_id, wall_owner_id, content, created_at) VALUES (?, ?, ?, ?)',
+                     ((author, wall, content, timestamp(created)) for author, wall, content, created in posts))
+    counts['posts'] = len(posts)
+
+    likes, comments = [], []
+    for post_id, (author, _, _, created) in enumerate(posts, 1):
+        for user in audience(author, heavy_tail(rng, args.likes)):
+            likes.append((post_id, user, timestamp(rng.uniform(created, now))))
+        for _ in range(int(rng.expovariate(1 / args.comments)) if args.comments else 0):
+            commenter = rng.choice(friends[author] + [author])
+            comments.append((post_id, commenter, sentence(rng, 2, 15), rng.uniform(created, now)))
+    comments.sort(key=lambda comment: comment[3])
+    conn.executemany('INSERT INTO likes (post_id, user_id, created_at) VALUES (?, ?, ?)', likes)
+    conn.executemany('INSERT INTO comments (post_id, user_id, content, created_at) VALUES (?, ?, ?, ?)',
+                     ((post_id, user, content, timestamp(created)) for post_id, user, content, created in comments))
+    counts['likes'] = len(likes)
+    counts['comments'] = len(comments)
+
+    pairs = [(a, b) for a in ids for b in friends[a] if a < b]
+    messages = []
+    for a, b in rng.sample(pairs, min(len(pairs), args.users * args.conversations // 2)):
+        sent = rng.uniform(since, now)
+        sender, receiver = (a, b) if rng.random() < 0.5 else (b, a)
+        for _ in range(1 + heavy_tail(rng, args.messages)):
+            if rng.random() < 0.4:
+                sender, receiver = receiver, sender
+            if sent > now:
+                break
+            messages.append((sender, receiver, sentence(rng, 1, 20), sent))
+            sent += rng.expovariate(1 / 600)
+    messages.sort(key=lambda message: message[3])
+    conn.executemany('INSERT INTO messages (sender_id, receiver_id, content, read, created_at) VALUES (?, ?, ?, ?, ?)',
+                     ((sender, receiver, content, int(sent < now - 86400), timestamp(sent)) for sender, receiver, content, sent in messages))
+    counts['messages'] = len(messages)
+
+    pokes = []
+    for poker in rng.choices(ids, weights, k=int(args.users * args.pokes)):
+        if friends[poker]:
+            pokes.append((poker, rng.choice(friends[poker]), rng.uniform(since, now)))
+    pokes.sort(key=lambda poke: poke[2])
+    # The app never marks pokes read, so neither does the generator.
+    conn.executemany('INSERT INTO pokes (poker_id, poked_id, created_at) VALUES (?, ?, ?)',
+                     ((poker, poked, timestamp(created)) for poker, poked, created in pokes))
+    conn.executemany("INSERT INTO notifications (user_id, type, content, from_user_id, read, created_at) VALUES (?, 'poke', 'poked you!', ?, ?, ?)",
+                     ((poked, poker, int(created < now - 86400), timestamp(created)) for poker, poked, created in pokes))
+    conn.execute('UPDATE users SET poke_count = (SELECT COUNT(*) FROM pokes WHERE poked_id = users.id)')
+    counts['pokes'] = len(pokes)
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic SocialHub dataset.')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', 'database/socialhub.db'))
+    parser.add_argument('--reset', action='store_true', help='replace an existing database file')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--friends', type=int, default=20, help='mean friends per user')
+    parser.add_argument('--posts', type=float, default=10, help='posts per user')
+    parser.add_argument('--likes', type=float, default=5, help='mean likes per post')
+    parser.add_argument('--comments', type=float, default=1.5, help='mean comments per post')
+    parser.add_argument('--conversations', type=int, default=4, help='conversations per user')
+    parser.add_argument('--messages', type=float, default=20, help='mean messages per conversation')
+    parser.add_argument('--pokes', type=int, default=2, help='pokes per user')
+    parser.add_argument('--days', type=float, default=90, help='history to spread activity over')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        if not args.reset:
+            sys.exit(f'{args.db} already exists; pass --reset to replace it')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    os.environ['DATABASE_PATH'] = args.db
+    from database.migrations import migrate
+    from database.models import SCHEMA
+
+    os.makedirs(os.path.dirname(args.db) or '.', exist_ok=True)
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.db)
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    counts = populate(conn, args)
+    conn.commit()
+    migrate(conn)
+    conn.close()
+    print(f'{args.db}: ' + ', '.join(f'{count} {table}' for table, count in counts.items()) + f' in {time.perf_counter() - started:.1f}s')
+    return counts
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# Scripted user sessions through the Flask and Socket.IO test clients,
+# reporting throughput and p50/p95/p99 per endpoint. Results are written as
+# JSON keyed by commit so runs can be compared.
+#
+#   python -m benchmarks.generate --users 5000 --db /tmp/load.db
+#   python -m benchmarks.load --db /tmp/load.db [--sessions 200] [--concurrency 4] [--out results.json]
+#   python -m benchmarks.load --compare before.json after.json
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.generate import GENERATED_PASSWORD
+from benchmarks.timeline import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLES = ('users', 'friendships', 'posts', 'likes', 'comments', 'messages', 'pokes')
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def call(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        failed = False
+        try:
+            response = fn(*args, **kwargs)
+            # HTTP responses fail on status; Socket.IO acks carry an 'error' key.
+            failed = getattr(response, 'status_code', 200) >= 400 or (isinstance(response, dict) and 'error' in response)
+            return response
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.samples.setdefault(name, []).append(elapsed)
+                if failed:
+                    self.errors[name] = self.errors.get(name, 0) + 1
+
+def session_script(app, socketio, recorder, user, friends, rng, address):
+    # One visit: log in, read the feed, look someone up, react, chat, leave.
+    # Each session comes from its own address, as real visitors do, so the
+    # per-address login throttle doesn't turn the run into 429s.
+    client = app.test_client()
+    client.environ_base['REMOTE_ADDR'] = address
+    response = recorder.call('POST /login', client.post, '/login', data={'username': user['username'], 'password': GENERATED_PASSWORD})
+    if response.status_code != 302:
+        recorder.errors['POST /login'] = recorder.errors.get('POST /login', 0) + 1
+        return
+    recorder.call('GET /home', client.get, '/home')
+    recorder.call('GET /api/notifications/count', client.get, '/api/notifications/count')
+    page = recorder.call('GET /api/feed', client.get, '/api/feed').get_json()
+    posts = page['posts']
+    if page['next_cursor']:
+        posts += recorder.call('GET /api/feed?before', client.get, '/api/feed', query_string={'before': page['next_cursor']}).get_json()['posts']
+
+    query = user['username'][:3]
+    recorder.call('GET /api/search/suggest', client.get, '/api/search/suggest', query_string={'q': query})
+    recorder.call('GET /search', client.get, '/search', query_string={'q': query})
+    friend = rng.choice(friends) if friends else None
+    if friend:
+        recorder.call('GET /profile/<username>', client.get, f"/profile/{friend['username']}")
+
+    if posts:
+        post = rng.choice(posts)
+        recorder.call('POST /post/<id>/like', client.post, f"/post/{post['id']}/like")
+        recorder.call('GET /post/<id>/comments', client.get, f"/post/{post['id']}/comments")
+        if rng.random() < 0.3:
+            recorder.call('POST /post/<id>/comment', client.post, f"/post/{post['id']}/comment", json={'content': 'Nice one'})
+
+    inbox = recorder.call('GET /api/conversations', client.get, '/api/conversations').get_json()['conversations']
+    other = inbox[0]['other_id'] if inbox else friend and friend['id']
+    if other:
+        recorder.call('GET /api/messages/<id>', client.get, f'/api/messages/{other}')
+        recorder.call('POST /api/messages/<id>/read', client.post, f'/api/messages/{other}/read')
+        socket = recorder.call('WS connect', socketio.test_client, app, flask_test_client=client)
+        # send_message is refused unless the socket joined the pair's room.
+        room = f"chat_{min(user['id'], other)}_{max(user['id'], other)}"
+        recorder.call('WS join', socket.emit, 'join', {'room': room}, callback=True)
+        recorder.call('WS send_message', socket.emit, 'send_message', {'receiver_id': other, 'message': 'hey, are you around?'}, callback=True)
+        socket.get_received()
+        socket.disconnect()
+    if friend and rng.random() < 0.2:
+        recorder.call('POST /poke/<id>', client.post, f"/poke/{friend['id']}")
+    recorder.call('GET /logout', client.get, '/logout')
+
+def load_visitors(conn, count, rng):
+    max_id = conn.execute('SELECT MAX(id) FROM users').fetchone()[0]
+    if not max_id:
+        sys.exit('database has no users; run python -m benchmarks.generate first')
+    visitors = []
+    for user_id in rng.sample(range(1, max_id + 1), min(count, max_id)):
+        user = conn.execute('SELECT id, username FROM users WHERE id = ?', (user_id,)).fetchone()
+        friends = conn.execute("""SELECT u.id, u.username FROM users u JOIN (
+            SELECT user_b AS id FROM friendships WHERE user_a = ? AND status = 'accepted'
+            UNION SELECT user_a FROM friendships WHERE user_b = ? AND status = 'accepted') f ON f.id = u.id""", (user_id, user_id)).fetchall()
+        visitors.append((dict(user), [dict(friend) for friend in friends]))
+    return visitors
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def summarize(recorder, duration):
+    endpoints = {}
+    for name, samples in sorted(recorder.samples.items()):
+        endpoints[name] = {'count': len(samples), 'errors': recorder.errors.get(name, 0), 'rps': round(len(samples) / duration, 1),
+                           'mean_ms': round(sum(samples) / len(samples), 2), 'p50_ms': round(percentile(samples, 50), 2),
+                           'p95_ms': round(percentile(samples, 95), 2), 'p99_ms': round(percentile(samples, 99), 2), 'max_ms': round(max(samples), 2)}
+    return endpoints
+
+def print_table(endpoints):
+    print(f"{'endpoint':<30} {'count':>6} {'err':>4} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, row in endpoints.items():
+        print(f"{name:<30} {row['count']:>6} {row['errors']:>4} {row['rps']:>8.1f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before['commit']} -> {after['commit']} (p50 / p95 / p99 ms, change)")
+    for name, row in after['endpoints'].items():
+        old = before['endpoints'].get(name)
+        if old is None:
+            print(f'{name:<30} new')
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            change = (row[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            cells.append(f'{old[key]:7.2f} -> {row[key]:7.2f} ({change:+5.1f}%)')
+        print(f'{name:<30} ' + ' | '.join(cells))
+    print(f"throughput {before['throughput_rps']} -> {after['throughput_rps']} req/s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Drive scripted user sessions and report per-endpoint latency.')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', 'database/socialhub.db'))
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', help='JSON results path (default benchmarks/results/load-<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='diff two result files and exit')
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # DATABASE_PATH is read at import time.
+    os.environ['DATABASE_PATH'] = args.db
+    import app as app_module
+    app = app_module.create_app()
+    rng = random.Random(args.seed)
+    conn = app_module.get_db().get_connection()
+    visitors = load_visitors(conn, args.sessions, rng)
+    dataset = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in TABLES}
+    conn.close()
+
+    recorder = Recorder()
+    def run(index):
+        user, friends = visitors[index % len(visitors)]
+        session_script(app, app_module.socketio, recorder, user, friends, random.Random(args.seed + index), f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(run, range(args.sessions)))
+    duration = time.perf_counter() - started
+    app_module.write_behind.flush()
+
+    endpoints = summarize(recorder, duration)
+    requests = sum(row['count'] for row in endpoints.values())
+    commit = git_commit()
+    result = {'commit': commit, 'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'python': platform.python_version(),
+              'cpus': os.cpu_count(), 'config': {'sessions': args.sessions, 'concurrency': args.concurrency, 'seed': args.seed},
+              'dataset': dataset, 'duration_s': round(duration, 2), 'requests': requests, 'throughput_rps': round(requests / duration, 1),
+              'endpoints': endpoints}
+    print_table(endpoints)
+    print(f"{requests} requests in {duration:.1f}s, {result['throughput_rps']} req/s")
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', f'load-{commit}.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'wrote {out}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Login throughput and /home latency during a login burst, with password
+# hashing on the request threads and on the hashing process pool.
+#
+#   python -m benchmarks.logins [login_threads] [seconds]
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.timeline import percentile
+
+USERS = 20
+
+def burst(app, login_threads, seconds, cookie):
+    # login_threads clients log in back to back from their own addresses
+    # while one reader keeps loading /home.
+    logins, pages = [], []
+    stop = threading.Event()
+
+    def login(index):
+        client = app.test_client(use_cookies=False)
+        client.environ_base['REMOTE_ADDR'] = f'10.0.0.{index}'
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = client.post('/login', data={'username': f'user{index % USERS}', 'password': 'secret'})
+            if response.status_code == 302:
+                logins.append(time.perf_counter() - started)
+
+    def read():
+        client = app.test_client(use_cookies=False)
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get('/home', headers={'Cookie': f'session={cookie}'})
+            pages.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=login, args=(index,)) for index in range(login_threads)] + [threading.Thread(target=read)]
+    for thread in workers:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return logins, pages
+
+def main(login_threads=8, seconds=10):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_PATH'] = os.path.join(tmp, 'logins.db')
+        # Every login thread has its own address; keep the per-username
+        # buckets out of the way too.
+        os.environ.setdefault('AUTH_BURST', '1000000')
+        os.environ.setdefault('AUTH_IP_BURST', '1000000')
+        import app as app_module
+        from database.models import Post, User
+        from database.passwords import hasher
+        app = app_module.create_app()
+        app.logger.disabled = True
+        logging.getLogger('monitoring.sql').setLevel(logging.CRITICAL)
+        user_ids = [User.create(f'user{i}', f'user{i}@example.com', 'secret', f'User {i}') for i in range(USERS)]
+        for user_id in user_ids:
+            Post.create(user_id, f'post by {user_id}')
+        cookie = app.session_interface.get_signing_serializer(app).dumps({'user_id': user_ids[0], 'username': 'user0'})
+        pool_workers = hasher.workers or 1
+        print(f'{login_threads} login threads for {seconds}s, {os.cpu_count()} CPUs, {hasher.method}')
+        for label, workers in (('inline', 0), (f'pool x{pool_workers}', pool_workers)):
+            hasher.workers = workers
+            burst(app, 1, 1, cookie)
+            logins, pages = burst(app, login_threads, seconds, cookie)
+            print(f'{label:>10}: {len(logins) / seconds:6.1f} logins/s (p50 {percentile(logins, 50) * 1000:6.0f} ms) | '
+                  f'/home p50 {percentile(pages, 50) * 1000:6.1f} p95 {percentile(pages, 95) * 1000:6.1f} p99 {percentile(pages, 99) * 1000:6.1f} ms')
+        hasher.shutdown()
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,91 @@
+# Runs the main user flows through the Flask test client against a scratch
+# database, captures every statement the models and routes execute, and
+# checks with EXPLAIN QUERY PLAN that none of them falls back to a full
+# table scan. Exits non-zero on regressions.
+#
+#   python -m benchmarks.query_plans
+import os
+import re
+import sys
+import tempfile
+
+# Statements that still scan, matched on their SQL, with the reason.
+KNOWN_SCANS = {
+    r'username LIKE': "User.search fallback when SQLite lacks FTS5",
+}
+SKIP = re.compile(r'^\s*(PRAGMA|BEGIN|COMMIT|ROLLBACK|CREATE|INSERT INTO schema_version|SELECT MAX\(version\))', re.I)
+# Trigger bodies and FTS5's own shadow-table statements also reach the trace hook.
+INTERNAL = re.compile(r"^\s*--|'main'\.'\w+_(config|data|idx|docsize|content)'")
+TABLE_SCAN = re.compile(r'\bSCAN (\w+)(?: AS \w+)?$')
+
+def capture_statements(app_module):
+    statements = []
+    app = app_module.create_app()
+    app.logger.disabled = True
+    db = app_module.get_db()
+    db.pool.close_all()
+    db.pool.on_connect.append(lambda conn: conn.set_trace_callback(statements.append))
+    client = app.test_client()
+    other = app.test_client()
+    for name in ('alice', 'bob'):
+        client.post('/register', data={'username': name, 'email': f'{name}@example.com', 'password': 'secret', 'full_name': name.title()})
+    other.post('/login', data={'username': 'bob', 'password': 'secret'})
+    client.post('/login', data={'username': 'alice', 'password': 'secret'})
+    client.post('/post/create', data={'content': 'hello'})
+    client.post('/post/create', data={'content': 'on your wall', 'wall_owner_id': '2'})
+    client.post('/post/1/like')
+    client.post('/post/1/comment', json={'content': 'nice'})
+    client.post('/poke/2')
+    client.post('/friend/request/2')
+    other.post('/friend/accept/1')
+    chat = app_module.socketio.test_client(app, flask_test_client=client)
+    chat.emit('join', {'room': 'chat_1_2'})
+    chat.emit('send_message', {'receiver_id': 2, 'message': 'hi bob'})
+    other.post('/api/messages/1/read')
+    for path in ('/home', '/profile/bob', '/post/1/comments', '/notifications', '/pokes', '/invite', '/search?q=bo', '/search?q=alic', '/api/search/suggest?q=ali',
+                 '/friend/status/2', '/api/relationships?ids=1,2,3', '/api/conversations', '/api/conversations?before=9', '/api/messages/2', '/api/messages/2?before=9', '/api/notifications/count'):
+        client.get(path)
+    client.get('/api/export').get_data()
+    client.post('/notifications/mark-all-read')
+    app_module.write_behind.flush()
+    return statements
+
+CTE = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)$')
+
+def table_scans(conn, sql):
+    plan = [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+    # Scanning a WITH clause's own result is not a table scan.
+    ctes = {m.group(1) for m in map(CTE.match, plan) if m}
+    scans = []
+    for detail in plan:
+        match = TABLE_SCAN.search(detail)
+        if match and match.group(1) not in ctes:
+            scans.append(detail)
+    return scans
+
+def main():
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'plans.db')
+    import app as app_module
+    statements = capture_statements(app_module)
+    conn = app_module.get_db().get_connection()
+    conn.set_trace_callback(None)
+    failures = 0
+    seen = set()
+    for sql in statements:
+        if SKIP.match(sql) or INTERNAL.search(sql) or sql in seen:
+            continue
+        seen.add(sql)
+        scans = table_scans(conn, sql)
+        known = [reason for pattern, reason in KNOWN_SCANS.items() if re.search(pattern, sql)]
+        bad = scans if not known else []
+        status = 'FAIL' if bad else ('known' if scans else 'ok')
+        print(f'[{status:5}] {" ".join(sql.split())[:110]}')
+        for detail in scans:
+            print(f'          {detail}' + (f'  ({known[0]})' if known else ''))
+        failures += bool(bad)
+    conn.close()
+    print(f'{len(seen)} statements checked, {failures} with table scans')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
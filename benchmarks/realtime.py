@@ -0,0 +1,184 @@
+# Cross-worker Socket.IO delivery through the SQLite message queue.
+#
+# 1. Two single-worker servers on different ports: a send_message on worker
+#    A must reach a client connected to worker B (and doesn't without a queue).
+# 2. One port served by WEB_CONCURRENCY workers: every message between many
+#    client pairs is delivered, whichever worker each client landed on.
+#
+#   python -m benchmarks.realtime [workers] [pairs] [messages_per_pair]
+import http.cookiejar
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import simple_websocket
+
+from benchmarks.timeline import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class SocketClient:
+    # Minimal Engine.IO v4 / Socket.IO v5 client over the websocket transport.
+    def __init__(self, port, cookie):
+        self.ws = simple_websocket.Client.connect(f'ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket', headers={'Cookie': cookie})
+        self.ws.receive()  # engine.io open packet
+        self.ws.send('40')
+        self.events = queue.Queue()
+        self.acks = {}
+        self.ack_id = 0
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+        threading.Thread(target=self._read, daemon=True).start()
+        self.connected.wait(5)
+
+    def _read(self):
+        while True:
+            try:
+                packet = self.ws.receive()
+            except simple_websocket.ConnectionClosed:
+                return
+            if packet == '2':
+                self.ws.send('3')
+            elif packet.startswith('40'):
+                self.connected.set()
+            elif packet.startswith('42'):
+                name, *args = json.loads(packet[2:])
+                self.events.put((time.perf_counter(), name, args[0] if args else None))
+            elif packet.startswith('43'):
+                start = packet.index('[')
+                done, result = self.acks.pop(int(packet[2:start]))
+                result.extend(json.loads(packet[start:]))
+                done.set()
+
+    def emit(self, event, data, ack=False):
+        # With ack=True, waits for the server's reply and returns its first argument.
+        if not ack:
+            self.ws.send('42' + json.dumps([event, data]))
+            return
+        with self.lock:
+            self.ack_id += 1
+            ack_id = self.ack_id
+            done, result = self.acks[ack_id] = (threading.Event(), [])
+        self.ws.send(f'42{ack_id}' + json.dumps([event, data]))
+        done.wait(5)
+        return result[0] if result else None
+
+    def received(self, name, count, timeout):
+        # Up to `count` events called `name`, waiting at most `timeout` seconds.
+        deadline = time.monotonic() + timeout
+        events = []
+        while len(events) < count and (remaining := deadline - time.monotonic()) > 0:
+            try:
+                at, event, data = self.events.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event == name:
+                events.append((at, data))
+        return events
+
+    def close(self):
+        self.ws.close()
+
+def login(port, username):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    opener.open(f'http://127.0.0.1:{port}/login', urllib.parse.urlencode({'username': username, 'password': 'secret'}).encode()).read()
+    return '; '.join(f'{cookie.name}={cookie.value}' for cookie in jar)
+
+def start_server(port, env, workers=1):
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=dict(env, PORT=str(port), WEB_CONCURRENCY=str(workers)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f'server on port {port} did not start')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def chat_room(a, b):
+    return f'chat_{min(a, b)}_{max(a, b)}'
+
+def two_workers(env, queue_url):
+    env = dict(env, SOCKETIO_MESSAGE_QUEUE=queue_url)
+    port_a, port_b = free_port(), free_port()
+    servers = [start_server(port_a, env), start_server(port_b, env)]
+    try:
+        alice = SocketClient(port_a, login(port_a, 'user1'))
+        bob = SocketClient(port_b, login(port_b, 'user2'))
+        for client in (alice, bob):
+            client.emit('join', {'room': chat_room(1, 2)}, ack=True)
+        sent = time.perf_counter()
+        alice.emit('send_message', {'receiver_id': 2, 'message': 'hello from worker A'})
+        received = [(at - sent) * 1000 for at, data in bob.received('receive_message', 1, 2)]
+        alice.close()
+        bob.close()
+        return received
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+def one_port(env, workers, pairs, per_pair):
+    port = free_port()
+    server = start_server(port, dict(env, SOCKETIO_MESSAGE_QUEUE='sqlite'), workers)
+    try:
+        clients = {user_id: SocketClient(port, login(port, f'user{user_id}')) for user_id in range(1, pairs * 2 + 1)}
+        for sender_id in range(1, pairs * 2, 2):
+            for user_id in (sender_id, sender_id + 1):
+                clients[user_id].emit('join', {'room': chat_room(sender_id, sender_id + 1)}, ack=True)
+        sent_at = {}
+        start = time.perf_counter()
+        for i in range(per_pair):
+            for sender_id in range(1, pairs * 2, 2):
+                content = f'{sender_id}:{i}'
+                sent_at[content] = time.perf_counter()
+                clients[sender_id].emit('send_message', {'receiver_id': sender_id + 1, 'message': content})
+        latencies = []
+        for receiver_id in range(2, pairs * 2 + 1, 2):
+            for at, data in clients[receiver_id].received('receive_message', per_pair, 10):
+                latencies.append((at - sent_at[data['content']]) * 1000)
+        elapsed = time.perf_counter() - start
+        for client in clients.values():
+            client.close()
+        return latencies, elapsed
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(workers=4, pairs=20, per_pair=10):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(tmp, 'realtime.db'), SECRET_KEY='benchmark', UPLOAD_BACKEND='local')
+        os.environ.update(DATABASE_PATH=env['DATABASE_PATH'])
+        sys.path.insert(0, ROOT)
+        from database.models import User
+        for user_id in range(1, pairs * 2 + 1):
+            User.create(f'user{user_id}', f'user{user_id}@example.com', 'secret', f'User {user_id}')
+
+        without = two_workers(env, '')
+        print(f'worker A -> worker B without a queue: {len(without)}/1 delivered')
+        latency = two_workers(env, 'sqlite')
+        print(f'worker A -> worker B via sqlite queue: {len(latency)}/1 delivered' + (f' in {latency[0]:.1f} ms' if latency else ''))
+
+        latencies, elapsed = one_port(env, workers, pairs, per_pair)
+        total = pairs * per_pair
+        print(f'{workers} workers on one port, {pairs * 2} clients: {len(latencies)}/{total} delivered in {elapsed:.2f}s'
+              + (f', p50 {percentile(latencies, 50):.1f} ms p99 {percentile(latencies, 99):.1f} ms' if latencies else ''))
+        if not latency or without or len(latencies) != total:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:4]))
@@ -0,0 +1,47 @@
+# User search: the old LIKE '%q%' scan vs the FTS5 trigram index.
+#
+#   python -m benchmarks.search [users]
+import os
+import random
+import sys
+import tempfile
+import time
+
+SYLLABLES = ['an', 'ber', 'cha', 'dan', 'el', 'fi', 'go', 'han', 'is', 'jo', 'ka', 'li', 'mar', 'no', 'ol', 'pe', 'ra', 'sam', 'ti', 'vel', 'wen', 'yu', 'zo']
+QUERIES = ['mar', 'sam', 'jones', 'velka', 'danber', 'oltiwen', 'zzz']
+LIKE_SQL = 'SELECT id, username, full_name, profile_pic, bio FROM users WHERE username LIKE ? OR full_name LIKE ? LIMIT ?'
+
+def name(rng, parts):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(parts))
+
+def populate(conn, users):
+    rng = random.Random(1)
+    rows = []
+    for i in range(users):
+        first, last = name(rng, 2).title(), name(rng, 3).title()
+        rows.append((f'{first.lower()}{i}', f'user{i}@example.com', '-', f'{first} {last}', f'I like {name(rng, 2)} and {name(rng, 2)}'))
+    conn.executemany('INSERT INTO users (username, email, password_hash, full_name, bio) VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main(users=100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_PATH'] = os.path.join(tmp, 'search.db')
+        from database.models import get_db, User
+        db = get_db()
+        conn = db.get_connection()
+        populate(conn, users)
+        print(f'{users} users, FTS5 available: {db.fts}')
+        for query in QUERIES:
+            like = timed(lambda: conn.execute(LIKE_SQL, (f'%{query}%', f'%{query}%', 20)).fetchall())
+            fts = timed(lambda: User.search(query))
+            print(f'{query!r:>12}: LIKE {like:8.2f} ms | FTS5 {fts:7.2f} ms | {like / fts:6.1f}x')
+        conn.close()
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,103 @@
+# Startup time and /home throughput of the Werkzeug dev server (python
+# app.py) against gunicorn with gthread and gevent workers.
+#
+#   python -m benchmarks.server [seconds] [clients]
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.realtime import ROOT, free_port
+from benchmarks.timeline import USERS, percentile, populate
+
+WORKERS = os.cpu_count() or 1
+LAUNCHERS = [
+    ('werkzeug (python app.py)', [sys.executable, 'app.py'], {}),
+    (f'gunicorn gthread {WORKERS}x16', [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], {'WEB_CONCURRENCY': str(WORKERS), 'THREADS': '16'}),
+    (f'gunicorn gevent {WORKERS}', [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], {'WEB_CONCURRENCY': str(WORKERS), 'WORKER_CLASS': 'gevent'}),
+]
+
+def session_cookies(count):
+    from app import app
+    serializer = app.session_interface.get_signing_serializer(app)
+    return [f'session={serializer.dumps({"user_id": user_id, "username": f"user{user_id}"})}' for user_id in range(1, count + 1)]
+
+def start(command, env, port):
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=dict(env, PORT=str(port)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while time.perf_counter() - started < 30:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/login')
+            if conn.getresponse().status == 200:
+                return process, time.perf_counter() - started
+        except OSError:
+            time.sleep(0.02)
+    process.kill()
+    raise RuntimeError(f'{command} did not start')
+
+def load(port, cookies, seconds, clients):
+    samples = [[] for _ in range(clients)]
+    errors = []
+    deadline = time.perf_counter() + seconds
+
+    def client(i):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        headers = {'Cookie': cookies[i % len(cookies)]}
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', '/home', headers=headers)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                errors.append(1)
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            if response.status != 200:
+                errors.append(response.status)
+            samples[i].append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = [sample for per_client in samples for sample in per_client]
+    return len(latencies) / seconds, latencies, len(errors)
+
+def stop(process):
+    started = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    return time.perf_counter() - started
+
+def main(seconds=10, clients=16):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(tmp, 'server.db'), SECRET_KEY='benchmark', UPLOAD_BACKEND='local')
+        os.environ.update(DATABASE_PATH=env['DATABASE_PATH'], SECRET_KEY=env['SECRET_KEY'])
+        sys.path.insert(0, ROOT)
+        from database.models import get_db
+        conn = get_db().get_connection()
+        populate(conn, 20000)
+        conn.close()
+        cookies = session_cookies(min(USERS, 200))
+        for name, command, overrides in LAUNCHERS:
+            port = free_port()
+            process, startup = start(command, dict(env, **overrides), port)
+            rps, latencies, errors = load(port, cookies, seconds, clients)
+            shutdown = stop(process)
+            print(f'{name:26} startup {startup * 1000:6.0f} ms | {rps:7.1f} req/s  p50 {percentile(latencies, 50):6.1f} ms  p99 {percentile(latencies, 99):6.1f} ms'
+                  f'  errors {errors} | shutdown {shutdown:.2f}s')
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
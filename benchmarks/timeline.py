@@ -0,0 +1,73 @@
+# /home latency with the fan-out-on-read feed query vs precomputed timelines
+# at increasing post volumes.
+#
+#   python -m benchmarks.timeline [10000,100000,1000000]
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+USERS = 2000
+FRIENDS_PER_USER = 30
+READERS = 50
+REQUESTS = 300
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def populate(conn, posts):
+    rng = random.Random(42)
+    conn.executemany('INSERT INTO users (username, email, password_hash, full_name) VALUES (?, ?, ?, ?)',
+                     ((f'user{i}', f'user{i}@example.com', '-', f'User {i}') for i in range(USERS)))
+    edges = set()
+    while len(edges) < USERS * FRIENDS_PER_USER // 2:
+        a, b = rng.sample(range(1, USERS + 1), 2)
+        edges.add((min(a, b), max(a, b)))
+    conn.executemany("INSERT INTO friendships (user_a, user_b, requester_id, status) VALUES (?, ?, ?, 'accepted')", ((a, b, a) for a, b in edges))
+    start = time.time() - posts
+    conn.executemany("INSERT INTO posts (user_id, content, created_at) VALUES (?, ?, datetime(?, 'unixepoch'))",
+                     ((rng.randint(1, USERS), f'post {i}', start + i) for i in range(posts)))
+    conn.commit()
+
+def measure(client, readers):
+    samples = []
+    for i in range(REQUESTS):
+        with client.session_transaction() as sess:
+            sess['user_id'] = readers[i % len(readers)]
+        start = time.perf_counter()
+        client.get('/home')
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentile(samples, 50), percentile(samples, 99)
+
+def run(posts, tmp):
+    # DATABASE_PATH is read at import time, so each size runs in its own process.
+    os.environ['DATABASE_PATH'] = os.path.join(tmp, f'timeline_{posts}.db')
+    from database import timeline
+    import app as app_module
+    app = app_module.create_app()
+    conn = app_module.get_db().get_connection()
+    populate(conn, posts)
+    conn.close()
+    client = app.test_client()
+    readers = random.Random(7).sample(range(1, USERS + 1), READERS)
+    timeline.FANOUT_ENABLED = False
+    query = measure(client, readers)
+    timeline.FANOUT_ENABLED = True
+    for reader in readers:
+        timeline.Timeline.get_feed(reader)
+    precomputed = measure(client, readers)
+    print(f'{posts:>9} posts | query p50 {query[0]:6.2f} ms  p99 {query[1]:6.2f} ms | timeline p50 {precomputed[0]:6.2f} ms  p99 {precomputed[1]:6.2f} ms')
+
+def main(sizes):
+    if len(sizes) == 1:
+        with tempfile.TemporaryDirectory() as tmp:
+            run(sizes[0], tmp)
+        return
+    for posts in sizes:
+        subprocess.run([sys.executable, '-m', 'benchmarks.timeline', str(posts)], check=True)
+
+if __name__ == '__main__':
+    main([int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '10000,100000,1000000').split(',')])
@@ -0,0 +1,218 @@
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from database.models import DB_PATH, USER_COLUMNS, get_db
+
+logger = logging.getLogger(__name__)
+
+# Snapshots are copied with SQLite's online backup API, PAGES pages per
+# step with PAUSE seconds between steps, so request threads keep the disk
+# and the CPU. The copy reads from one read transaction held for the whole
+# run: in WAL mode writers carry on unblocked, and the backup never has to
+# restart because a page changed under it.
+BACKUP_DIR = os.environ.get('BACKUP_DIR') or os.path.join(os.path.dirname(DB_PATH), 'backups')
+PAGES = int(os.environ.get('BACKUP_PAGES', 1024))
+PAUSE = float(os.environ.get('BACKUP_PAUSE_MS', 5)) / 1000
+# Snapshots kept; older ones are deleted after each successful run.
+KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+# 'quick' (PRAGMA quick_check) or 'full' (PRAGMA integrity_check).
+CHECK = os.environ.get('BACKUP_CHECK', 'quick')
+# Seconds between background snapshots; 0 leaves it to the CLI / cron.
+INTERVAL = float(os.environ.get('BACKUP_INTERVAL', 0))
+
+PREFIX = 'socialhub-'
+SUFFIX = '.db'
+# Rows per query while exporting, so a big account never holds a
+# connection or builds a list for long.
+EXPORT_BATCH = 500
+
+class BackupFailed(Exception):
+    pass
+
+def snapshots(directory=BACKUP_DIR):
+    # Finished snapshots, newest first.
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted((os.path.join(directory, name) for name in names if name.startswith(PREFIX) and name.endswith(SUFFIX)), reverse=True)
+
+def check(path, mode=CHECK):
+    conn = sqlite3.connect(path)
+    try:
+        rows = [row[0] for row in conn.execute('PRAGMA integrity_check' if mode == 'full' else 'PRAGMA quick_check')]
+    finally:
+        conn.close()
+    return rows == ['ok'], rows
+
+def rotate(directory=BACKUP_DIR, keep=KEEP):
+    removed = []
+    for path in snapshots(directory)[keep:]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+def snapshot(directory=BACKUP_DIR, pages=PAGES, pause=PAUSE, keep=KEEP, source=None):
+    # Copies the live database to <directory>/socialhub-<utc time>.db via a
+    # .partial file that is only renamed once it passes the integrity check.
+    # Returns a report dict; raises BackupFailed if the copy is damaged.
+    os.makedirs(directory, exist_ok=True)
+    name = f"{PREFIX}{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}{SUFFIX}"
+    path = os.path.join(directory, name)
+    partial = path + '.partial'
+    started = time.perf_counter()
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if pause:
+            time.sleep(pause)
+
+    # Its own connection, not a pooled one: it stays open for the whole copy.
+    src = sqlite3.connect(source or get_db().db_path)
+    dst = sqlite3.connect(partial)
+    try:
+        src.execute('BEGIN')
+        src.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        src.backup(dst, pages=pages, progress=progress)
+        src.rollback()
+        # The copy inherits WAL mode; a snapshot should be one self-contained file.
+        dst.execute('PRAGMA journal_mode = DELETE')
+    except BaseException:
+        dst.close()
+        os.remove(partial)
+        raise
+    finally:
+        src.close()
+    dst.close()
+    copied = time.perf_counter() - started
+    ok, problems = check(partial)
+    if not ok:
+        os.replace(partial, path + '.corrupt')
+        raise BackupFailed(f'{name} failed {CHECK} check: {problems[:5]}')
+    os.replace(partial, path)
+    removed = rotate(directory, keep)
+    return {'path': path, 'bytes': os.path.getsize(path), 'steps': steps, 'copy_seconds': round(copied, 3),
+            'seconds': round(time.perf_counter() - started, 3), 'rotated': len(removed)}
+
+class BackupLock:
+    # Only one process snapshots at a time; with several workers each runs
+    # a scheduler and the others simply skip their turn.
+    def __init__(self, directory=BACKUP_DIR):
+        self.path = os.path.join(directory, '.lock')
+        self.file = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'a')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+            return False
+        return True
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+class BackupScheduler:
+    # Background thread taking a snapshot every `interval` seconds, unless
+    # another process took one since.
+    def __init__(self, interval=INTERVAL, directory=BACKUP_DIR):
+        self.interval = interval
+        self.directory = directory
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_seconds = 0.0
+        self.last_bytes = 0
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='backup', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        latest = snapshots(self.directory)
+        if latest and time.time() - os.path.getmtime(latest[0]) < self.interval * 0.9:
+            self.skipped += 1
+            return None
+        lock = BackupLock(self.directory)
+        if not lock.acquire():
+            self.skipped += 1
+            return None
+        try:
+            report = snapshot(self.directory)
+        except Exception:
+            self.failures += 1
+            logger.exception('backup failed')
+            return None
+        finally:
+            lock.release()
+        self.runs += 1
+        self.last_seconds = report['seconds']
+        self.last_bytes = report['bytes']
+        logger.info('backup: %s', report)
+        return report
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {'interval': self.interval, 'runs': self.runs, 'failures': self.failures, 'skipped': self.skipped,
+                'last_seconds': self.last_seconds, 'last_bytes': self.last_bytes}
+
+scheduler = BackupScheduler()
+
+def _batches(sql, params, key, start):
+    # Keyset pages of `sql`, which must take the key columns last and
+    # return rows ordered by them; each page on a fresh connection.
+    last = start
+    while True:
+        conn = get_db().get_connection()
+        try:
+            rows = [dict(row) for row in conn.execute(sql, (*params, *last, EXPORT_BATCH)).fetchall()]
+        finally:
+            conn.close()
+        yield from rows
+        if len(rows) < EXPORT_BATCH:
+            return
+        last = tuple(rows[-1][column] for column in key)
+
+def export_user(user_id):
+    # NDJSON lines for one account: the profile, then its posts oldest
+    # first, then each conversation's messages in both directions. Never
+    # holds more than one batch in memory.
+    conn = get_db().get_connection()
+    try:
+        user = conn.execute(f'SELECT {USER_COLUMNS} FROM users WHERE id = ?', (user_id,)).fetchone()
+        partners = [row[0] for row in conn.execute('SELECT user_b FROM conversations WHERE user_a = ? UNION ALL SELECT user_a FROM conversations WHERE user_b = ?', (user_id, user_id))]
+    finally:
+        conn.close()
+    if user is None:
+        return
+    yield json.dumps(dict(user, type='user'), default=str) + '\n'
+    for post in _batches('SELECT * FROM posts WHERE user_id = ? AND (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?', (user_id,), ('created_at', 'id'), ('', 0)):
+        yield json.dumps(dict(post, type='post'), default=str) + '\n'
+    for other_id in partners:
+        for sender_id, receiver_id in ((user_id, other_id), (other_id, user_id)):
+            for message in _batches('SELECT * FROM messages WHERE sender_id = ? AND receiver_id = ? AND id > ? ORDER BY id LIMIT ?', (sender_id, receiver_id), ('id',), (0,)):
+                yield json.dumps(dict(message, type='message'), default=str) + '\n'
@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    # Bounded LRU with per-entry expiry, safe to share between request threads.
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def incr(self, key, delta=1):
+        # Adjusts a cached number in place; a missing entry stays missing.
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (max(entry[0] + delta, 0), entry[1])
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,172 @@
+import os
+from array import array
+from bisect import bisect_left
+from collections import Counter, namedtuple
+
+from database.cache import TTLCache
+from database.models import get_db
+
+# Per-user adjacency: sorted user ids of accepted friends, of pending
+# requests the user sent and of pending requests they received. Entries are
+# dropped on every change to one of the user's edges and re-read after the
+# TTL, so edges changed by other processes converge.
+Adjacency = namedtuple('Adjacency', 'friends outgoing incoming')
+friend_cache = TTLCache(maxsize=int(os.environ.get('FRIEND_CACHE_SIZE', 16384)), ttl=int(os.environ.get('FRIEND_CACHE_TTL', 300)))
+
+# Friends with more friends than this are skipped when ranking suggestions:
+# sharing a very popular friend says little about knowing each other.
+SUGGEST_HUB_LIMIT = int(os.environ.get('FRIEND_SUGGEST_HUB_LIMIT', 1000))
+BATCH_SIZE = 400
+
+def contains(ids, user_id):
+    i = bisect_left(ids, user_id)
+    return i < len(ids) and ids[i] == user_id
+
+def pair(user_id, other_id):
+    return min(user_id, other_id), max(user_id, other_id)
+
+class FriendGraph:
+    @staticmethod
+    def adjacency(user_id):
+        return FriendGraph.adjacency_of([user_id])[user_id]
+
+    @staticmethod
+    def adjacency_of(user_ids):
+        found = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            entry = friend_cache.get(user_id)
+            if entry is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = entry
+        if missing:
+            edges = {user_id: ([], [], []) for user_id in missing}
+            conn = get_db().get_connection()
+            cursor = conn.cursor()
+            for start in range(0, len(missing), BATCH_SIZE):
+                batch = missing[start:start + BATCH_SIZE]
+                marks = ','.join('?' * len(batch))
+                cursor.execute(f'SELECT user_a AS user_id, user_b AS other_id, requester_id, status FROM friendships WHERE user_a IN ({marks}) '
+                               f'UNION ALL SELECT user_b, user_a, requester_id, status FROM friendships WHERE user_b IN ({marks})', batch + batch)
+                for row in cursor.fetchall():
+                    friends, outgoing, incoming = edges[row['user_id']]
+                    if row['status'] == 'accepted':
+                        friends.append(row['other_id'])
+                    elif row['requester_id'] == row['user_id']:
+                        outgoing.append(row['other_id'])
+                    else:
+                        incoming.append(row['other_id'])
+            conn.close()
+            for user_id, lists in edges.items():
+                entry = Adjacency(*(array('l', sorted(ids)) for ids in lists))
+                friend_cache.set(user_id, entry)
+                found[user_id] = entry
+        return found
+
+    @staticmethod
+    def friends(user_id):
+        return FriendGraph.adjacency(user_id).friends
+
+    @staticmethod
+    def friends_of(user_ids):
+        return {user_id: entry.friends for user_id, entry in FriendGraph.adjacency_of(user_ids).items()}
+
+    @staticmethod
+    def status(user_id, other_id):
+        return FriendGraph.statuses(user_id, [other_id])[other_id]
+
+    @staticmethod
+    def statuses(user_id, other_ids):
+        # One adjacency read answers any number of lookups for the same user.
+        entry = FriendGraph.adjacency(user_id)
+        result = {}
+        for other_id in other_ids:
+            if other_id == user_id:
+                result[other_id] = 'self'
+            elif contains(entry.friends, other_id):
+                result[other_id] = 'friends'
+            elif contains(entry.outgoing, other_id):
+                result[other_id] = 'pending_sent'
+            elif contains(entry.incoming, other_id):
+                result[other_id] = 'pending_received'
+            else:
+                result[other_id] = 'none'
+        return result
+
+    @staticmethod
+    def mutual_counts(user_id, other_ids):
+        mine = set(FriendGraph.friends(user_id))
+        return {other_id: len(mine.intersection(friends)) for other_id, friends in FriendGraph.friends_of(other_ids).items()}
+
+    @staticmethod
+    def suggestions(user_id, limit=10):
+        # Friends of friends ranked by how many friends they share with the
+        # user; returns [(user_id, mutual_count)].
+        entry = FriendGraph.adjacency(user_id)
+        known = {user_id, *entry.friends, *entry.outgoing, *entry.incoming}
+        counts = Counter()
+        for friends in FriendGraph.friends_of(entry.friends).values():
+            if len(friends) <= SUGGEST_HUB_LIMIT:
+                counts.update(other_id for other_id in friends if other_id not in known)
+        return counts.most_common(limit)
+
+    @staticmethod
+    def request(user_id, other_id):
+        # Returns 'sent', 'accepted' when the other user had already asked,
+        # or the existing state: 'friends' or 'pending_sent'.
+        user_a, user_b = pair(user_id, other_id)
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO friendships (user_a, user_b, requester_id) VALUES (?, ?, ?) ON CONFLICT (user_a, user_b) DO NOTHING', (user_a, user_b, user_id))
+        if cursor.rowcount:
+            result = 'sent'
+        else:
+            cursor.execute("UPDATE friendships SET status = 'accepted' WHERE user_a = ? AND user_b = ? AND requester_id = ? AND status = 'pending'", (user_a, user_b, other_id))
+            if cursor.rowcount:
+                result = 'accepted'
+            else:
+                cursor.execute('SELECT status FROM friendships WHERE user_a = ? AND user_b = ?', (user_a, user_b))
+                result = 'friends' if cursor.fetchone()['status'] == 'accepted' else 'pending_sent'
+        conn.commit()
+        conn.close()
+        FriendGraph.invalidate(user_id, other_id)
+        return result
+
+    @staticmethod
+    def accept(user_id, request_id):
+        # Accepts a pending request addressed to user_id; returns the
+        # requester's id, or None if there was no such request.
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT requester_id FROM friendships WHERE id = ? AND ? IN (user_a, user_b) AND requester_id != ? AND status = 'pending'", (request_id, user_id, user_id))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("UPDATE friendships SET status = 'accepted' WHERE id = ?", (request_id,))
+        conn.commit()
+        conn.close()
+        if not row:
+            return None
+        FriendGraph.invalidate(user_id, row['requester_id'])
+        return row['requester_id']
+
+    @staticmethod
+    def remove(user_id, other_id):
+        # Unfriend, cancel a sent request or decline a received one; returns
+        # the removed edge's status, or None.
+        user_a, user_b = pair(user_id, other_id)
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT status FROM friendships WHERE user_a = ? AND user_b = ?', (user_a, user_b))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute('DELETE FROM friendships WHERE user_a = ? AND user_b = ?', (user_a, user_b))
+        conn.commit()
+        conn.close()
+        FriendGraph.invalidate(user_id, other_id)
+        return row['status'] if row else None
+
+    @staticmethod
+    def invalidate(*user_ids):
+        for user_id in user_ids:
+            friend_cache.delete(user_id)
@@ -0,0 +1,132 @@
+import sqlite3
+
+# Ordered schema upgrades applied on top of the baseline tables in
+# models.SCHEMA. Each step runs once per database, inside its own
+# transaction, and is recorded in schema_version. Steps are lists of SQL
+# statements or callables taking the connection; append new ones at the end
+# and never edit a step that has already shipped.
+MIGRATIONS = [
+    (1, 'hot query indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_wall_owner ON posts (wall_owner_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_user ON posts (user_id, wall_owner_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_comments_post ON comments (post_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_friendships_user ON friendships (user_id, friend_id)',
+        'CREATE INDEX IF NOT EXISTS idx_friendships_friend ON friendships (friend_id, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages (sender_id, receiver_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_pokes_poked ON pokes (poked_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_pokes_pair ON pokes (poker_id, poked_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications (user_id, read)',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_invites_inviter ON invites (inviter_id, created_at)',
+    ]),
+    (2, 'denormalized post counters', [
+        lambda conn: column_exists(conn, 'posts', 'comments_count') or conn.execute('ALTER TABLE posts ADD COLUMN comments_count INTEGER DEFAULT 0'),
+        'UPDATE posts SET likes_count = (SELECT COUNT(*) FROM likes WHERE post_id = posts.id), comments_count = (SELECT COUNT(*) FROM comments WHERE post_id = posts.id)',
+    ]),
+    (3, 'feed keyset index', [
+        'CREATE INDEX IF NOT EXISTS idx_posts_author ON posts (user_id, created_at)',
+    ]),
+    (4, 'fan-out timelines', [
+        'CREATE TABLE IF NOT EXISTS timelines (user_id INTEGER NOT NULL, post_id INTEGER NOT NULL, created_at TIMESTAMP NOT NULL, PRIMARY KEY (user_id, created_at, post_id)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS timeline_state (user_id INTEGER PRIMARY KEY, floor_created_at TIMESTAMP, floor_post_id INTEGER, built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)',
+        'CREATE TABLE IF NOT EXISTS timeline_pull_authors (user_id INTEGER PRIMARY KEY)',
+    ]),
+    (5, 'activity index', [
+        'CREATE INDEX IF NOT EXISTS idx_activities_user ON activities (user_id, created_at)',
+    ]),
+    (6, 'user search index', [
+        lambda conn: create_user_search_index(conn),
+    ]),
+    (7, 'conversations', [
+        'CREATE TABLE IF NOT EXISTS conversations (user_a INTEGER NOT NULL, user_b INTEGER NOT NULL, last_message_id INTEGER NOT NULL, last_sender_id INTEGER NOT NULL, last_message TEXT NOT NULL, last_message_at TIMESTAMP NOT NULL, unread_a INTEGER NOT NULL DEFAULT 0, unread_b INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (user_a, user_b), CHECK (user_a < user_b))',
+        'CREATE INDEX IF NOT EXISTS idx_conversations_a ON conversations (user_a, last_message_id)',
+        'CREATE INDEX IF NOT EXISTS idx_conversations_b ON conversations (user_b, last_message_id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (sender_id, receiver_id, id)',
+        'DROP INDEX IF EXISTS idx_messages_pair',
+        '''INSERT OR IGNORE INTO conversations (user_a, user_b, last_message_id, last_sender_id, last_message, last_message_at)
+           SELECT MIN(sender_id, receiver_id), MAX(sender_id, receiver_id), id, sender_id, substr(content, 1, 200), created_at FROM messages
+           WHERE id IN (SELECT MAX(id) FROM messages WHERE sender_id != receiver_id GROUP BY MIN(sender_id, receiver_id), MAX(sender_id, receiver_id))''',
+        '''UPDATE conversations SET
+           unread_a = (SELECT COUNT(*) FROM messages WHERE sender_id = conversations.user_b AND receiver_id = conversations.user_a AND read = 0),
+           unread_b = (SELECT COUNT(*) FROM messages WHERE sender_id = conversations.user_a AND receiver_id = conversations.user_b AND read = 0)''',
+    ]),
+    (8, 'canonical friendships', [
+        # One row per pair, (user_a, user_b) ordered like conversations, with
+        # the direction of a pending request kept in requester_id. Duplicate
+        # pairs collapse to the accepted row, else the oldest request.
+        '''CREATE TABLE friendships_pairs (id INTEGER PRIMARY KEY AUTOINCREMENT, user_a INTEGER NOT NULL, user_b INTEGER NOT NULL, requester_id INTEGER NOT NULL, status TEXT NOT NULL DEFAULT 'pending', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           UNIQUE (user_a, user_b), CHECK (user_a < user_b), FOREIGN KEY (user_a) REFERENCES users(id), FOREIGN KEY (user_b) REFERENCES users(id))''',
+        '''INSERT INTO friendships_pairs (id, user_a, user_b, requester_id, status, created_at)
+           SELECT id, user_a, user_b, user_id, status, created_at FROM (
+               SELECT id, MIN(user_id, friend_id) AS user_a, MAX(user_id, friend_id) AS user_b, user_id, status, created_at,
+                      ROW_NUMBER() OVER (PARTITION BY MIN(user_id, friend_id), MAX(user_id, friend_id) ORDER BY status = 'accepted' DESC, id) AS n
+               FROM friendships WHERE user_id != friend_id)
+           WHERE n = 1''',
+        'DROP TABLE friendships',
+        'ALTER TABLE friendships_pairs RENAME TO friendships',
+        'CREATE INDEX IF NOT EXISTS idx_friendships_a ON friendships (user_a, status, user_b)',
+        'CREATE INDEX IF NOT EXISTS idx_friendships_b ON friendships (user_b, status, user_a)',
+    ]),
+    (9, 'retention indexes', [
+        # database.retention walks each table oldest first.
+        'CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_pokes_created ON pokes (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at)',
+    ]),
+    (10, 'presence', [
+        # Online users per worker process, for realtime.presence with
+        # several workers; rows of a worker that stops heartbeating expire.
+        'CREATE TABLE IF NOT EXISTS presence (worker TEXT NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (worker, user_id)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS presence_workers (worker TEXT PRIMARY KEY, seen_at REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS idx_presence_workers_seen ON presence_workers (seen_at)',
+    ]),
+]
+
+USER_FTS_TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN INSERT INTO users_fts (rowid, username, full_name, bio) VALUES (new.id, new.username, new.full_name, new.bio); END',
+    "CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN INSERT INTO users_fts (users_fts, rowid, username, full_name, bio) VALUES ('delete', old.id, old.username, old.full_name, old.bio); END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, full_name, bio ON users BEGIN INSERT INTO users_fts (users_fts, rowid, username, full_name, bio) VALUES ('delete', old.id, old.username, old.full_name, old.bio); INSERT INTO users_fts (rowid, username, full_name, bio) VALUES (new.id, new.username, new.full_name, new.bio); END",
+)
+
+def create_user_search_index(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(username, full_name, bio, content='users', content_rowid='id', tokenize='trigram')")
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5 or the trigram tokenizer: User.search keeps using LIKE.
+        return
+    for statement in USER_FTS_TRIGGERS:
+        conn.execute(statement)
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+def current_version(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info({table})'))
+
+def migrate(conn):
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+        # BEGIN IMMEDIATE serialises concurrent starters; re-check once we hold the lock.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
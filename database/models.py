@@ -1,43 +1,101 @@
-from datetime import datetime
+from datetime import datetime, timezone
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+from database.pool import get_pool
+from database.migrations import migrate
+from database.passwords import hasher
+from database.cache import TTLCache
+from database.ratelimit import SlidingWindow
+from database.writer import WriteBehindQueue
+import json
+
+DB_PATH = os.environ.get('DATABASE_PATH', 'database/socialhub.db')
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, full_name TEXT NOT NULL, bio TEXT, profile_pic TEXT DEFAULT 'https://ui-avatars.com/api/?name=User&size=200', cover_photo TEXT DEFAULT 'default_cover.jpg', poke_count INTEGER DEFAULT 0, invite_code TEXT UNIQUE, invited_by INTEGER, premium BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (invited_by) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, wall_owner_id INTEGER, content TEXT NOT NULL, image TEXT, tagged_users TEXT, privacy TEXT DEFAULT 'public', likes_count INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(id), FOREIGN KEY (wall_owner_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS comments (id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL, content TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (post_id) REFERENCES posts(id), FOREIGN KEY (user_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS likes (id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(post_id, user_id), FOREIGN KEY (post_id) REFERENCES posts(id), FOREIGN KEY (user_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS friendships (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, friend_id INTEGER NOT NULL, status TEXT DEFAULT 'pending', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(id), FOREIGN KEY (friend_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, sender_id INTEGER NOT NULL, receiver_id INTEGER NOT NULL, content TEXT NOT NULL, read BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (sender_id) REFERENCES users(id), FOREIGN KEY (receiver_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS pokes (id INTEGER PRIMARY KEY AUTOINCREMENT, poker_id INTEGER NOT NULL, poked_id INTEGER NOT NULL, read BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (poker_id) REFERENCES users(id), FOREIGN KEY (poked_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS photo_tags (id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL, x_position REAL, y_position REAL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (post_id) REFERENCES posts(id), FOREIGN KEY (user_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS notifications (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, type TEXT NOT NULL, content TEXT NOT NULL, related_id INTEGER, from_user_id INTEGER, read BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(id), FOREIGN KEY (from_user_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS invites (id INTEGER PRIMARY KEY AUTOINCREMENT, inviter_id INTEGER NOT NULL, invitee_email TEXT NOT NULL, invite_code TEXT UNIQUE NOT NULL, status TEXT DEFAULT 'pending', bonus_unlocked BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (inviter_id) REFERENCES users(id))""",
+    """CREATE TABLE IF NOT EXISTS activities (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, activity_type TEXT NOT NULL, activity_data TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(id))""",
+)
+
+# Accepted friends of a user plus the user themself; binds (user_id, user_id, user_id).
+FRIEND_IDS_CTE = "friends(id) AS (SELECT user_b FROM friendships WHERE user_a = ? AND status = 'accepted' UNION SELECT user_a FROM friendships WHERE user_b = ? AND status = 'accepted' UNION SELECT ?)"
+FEED_COLUMNS = 'p.*, u.username, u.full_name, u.profile_pic, wo.username as wall_owner_username, wo.full_name as wall_owner_name, EXISTS(SELECT 1 FROM likes WHERE post_id = p.id AND user_id = ?) as user_liked'
+
+# Latest comments shown under each post in feeds and on walls.
+COMMENT_PREVIEWS = 3
+# Posts per preview statement; SQLite allows 500 compound SELECT terms.
+PREVIEW_BATCH_SIZE = 200
+COMMENT_COLUMNS = 'c.*, u.username, u.full_name, u.profile_pic'
+
+# Profile rows without password_hash, which is only read by verify_password.
+USER_COLUMNS = 'id, username, email, full_name, bio, profile_pic, cover_photo, poke_count, invite_code, invited_by, premium, created_at'
+
+# Process-wide user row cache: ('id', id) -> row and ('username', name) -> id.
+# Usernames never change, so only the id entry needs invalidating.
+user_cache = TTLCache(maxsize=int(os.environ.get('USER_CACHE_SIZE', 4096)), ttl=int(os.environ.get('USER_CACHE_TTL', 60)))
+
+# Unread notification counts, kept in step with this process's writes. Other
+# workers' writes and reads only show up once the entry expires, so the TTL
+# is short; pushed counts skip the cache altogether.
+unread_cache = TTLCache(maxsize=int(os.environ.get('UNREAD_CACHE_SIZE', 8192)), ttl=int(os.environ.get('UNREAD_CACHE_TTL', 10)))
+
+# Recent typeahead results keyed by normalised query.
+suggest_cache = TTLCache(maxsize=int(os.environ.get('SUGGEST_CACHE_SIZE', 1024)), ttl=int(os.environ.get('SUGGEST_CACHE_TTL', 30)))
+
+_initialized = {}
+_init_lock = threading.Lock()
 
 class Database:
-    def __init__(self, db_path='database/socialhub.db'):
-        os.makedirs('database', exist_ok=True)
+    def __init__(self, db_path=DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
         self.db_path = db_path
-        self.init_db()
+        self.pool = get_pool(db_path)
+        with _init_lock:
+            if db_path not in _initialized:
+                self.init_db()
+                _initialized[db_path] = self.fts
+            self.fts = _initialized[db_path]
     
     def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.pool.acquire()
     
     def init_db(self):
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute("""CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, full_name TEXT NOT NULL, bio TEXT, profile_pic TEXT DEFAULT 'https://ui-avatars.com/api/?name=User&size=200', cover_photo TEXT DEFAULT 'default_cover.jpg', poke_count INTEGER DEFAULT 0, invite_code TEXT UNIQUE, invited_by INTEGER, premium BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (invited_by) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, wall_owner_id INTEGER, content TEXT NOT NULL, image TEXT, tagged_users TEXT, privacy TEXT DEFAULT 'public', likes_count INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(id), FOREIGN KEY (wall_owner_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS comments (id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL, content TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (post_id) REFERENCES posts(id), FOREIGN KEY (user_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS likes (id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(post_id, user_id), FOREIGN KEY (post_id) REFERENCES posts(id), FOREIGN KEY (user_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS friendships (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, friend_id INTEGER NOT NULL, status TEXT DEFAULT 'pending', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(id), FOREIGN KEY (friend_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, sender_id INTEGER NOT NULL, receiver_id INTEGER NOT NULL, content TEXT NOT NULL, read BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (sender_id) REFERENCES users(id), FOREIGN KEY (receiver_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS pokes (id INTEGER PRIMARY KEY AUTOINCREMENT, poker_id INTEGER NOT NULL, poked_id INTEGER NOT NULL, read BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (poker_id) REFERENCES users(id), FOREIGN KEY (poked_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS photo_tags (id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL, x_position REAL, y_position REAL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (post_id) REFERENCES posts(id), FOREIGN KEY (user_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS notifications (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, type TEXT NOT NULL, content TEXT NOT NULL, related_id INTEGER, from_user_id INTEGER, read BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(id), FOREIGN KEY (from_user_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS invites (id INTEGER PRIMARY KEY AUTOINCREMENT, inviter_id INTEGER NOT NULL, invitee_email TEXT NOT NULL, invite_code TEXT UNIQUE NOT NULL, status TEXT DEFAULT 'pending', bonus_unlocked BOOLEAN DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (inviter_id) REFERENCES users(id))""")
-        cursor.execute("""CREATE TABLE IF NOT EXISTS activities (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, activity_type TEXT NOT NULL, activity_data TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(id))""")
+        for statement in SCHEMA:
+            cursor.execute(statement)
         conn.commit()
+        migrate(conn)
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+        self.fts = cursor.fetchone() is not None
         conn.close()
 
+_db = None
+
+def get_db():
+    global _db
+    if _db is None:
+        _db = Database()
+    return _db
+
+# Notification and activity rows are group-committed off the request thread.
+write_behind = WriteBehindQueue(lambda: get_db().get_connection())
+
 class User:
     @staticmethod
     def create(username, email, password, full_name, invite_code=None):
-        db = Database()
-        conn = db.get_connection()
+        password_hash = hasher.hash(password)
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        password_hash = generate_password_hash(password)
         import secrets
         user_invite_code = secrets.token_urlsafe(8)
         invited_by = None
@@ -53,10 +111,13 @@ class User:
             if invite_code and invited_by:
                 cursor.execute('UPDATE invites SET status = "accepted", bonus_unlocked = 1 WHERE invite_code = ?', (invite_code,))
                 cursor.execute('UPDATE users SET premium = 1 WHERE id = ?', (invited_by,))
-                cursor.execute('INSERT INTO notifications (user_id, type, content, from_user_id) VALUES (?, ?, ?, ?)', (invited_by, 'invite_accepted', 'Someone joined!', user_id))
-            cursor.execute('INSERT INTO notifications (user_id, type, content) VALUES (?, ?, ?)', (user_id, 'welcome', 'Welcome!'))
             conn.commit()
             conn.close()
+            if invited_by:
+                User.invalidate(invited_by)
+                Notification.add(invited_by, 'invite_accepted', 'Someone joined!', from_user_id=user_id)
+            Notification.add(user_id, 'welcome', 'Welcome!')
+            Activity.log(user_id, 'joined', {'invited_by': invited_by})
             return user_id
         except:
             conn.close()
@@ -64,45 +125,98 @@ class User:
     
     @staticmethod
     def get_by_username(username):
-        db = Database()
-        conn = db.get_connection()
+        user_id = user_cache.get(('username', username))
+        if user_id is not None:
+            return User.get_by_id(user_id)
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
+        cursor.execute(f'SELECT {USER_COLUMNS} FROM users WHERE username = ?', (username,))
         user = cursor.fetchone()
         conn.close()
-        return dict(user) if user else None
+        if not user:
+            return None
+        user = dict(user)
+        user_cache.set(('username', username), user['id'])
+        user_cache.set(('id', user['id']), user)
+        return dict(user)
     
     @staticmethod
     def get_by_id(user_id):
-        db = Database()
-        conn = db.get_connection()
+        user = user_cache.get(('id', user_id))
+        if user is not None:
+            return dict(user)
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+        cursor.execute(f'SELECT {USER_COLUMNS} FROM users WHERE id = ?', (user_id,))
         user = cursor.fetchone()
         conn.close()
-        return dict(user) if user else None
+        if not user:
+            return None
+        user = dict(user)
+        user_cache.set(('id', user_id), user)
+        return dict(user)
+    
+    @staticmethod
+    def invalidate(user_id):
+        user_cache.delete(('id', user_id))
     
     @staticmethod
     def verify_password(username, password):
-        user = User.get_by_username(username)
-        if user and check_password_hash(user['password_hash'], password):
-            return user
-        return None
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, password_hash FROM users WHERE username = ?', (username,))
+        row = cursor.fetchone()
+        conn.close()
+        if not row or not hasher.verify(row['password_hash'], password):
+            return None
+        if hasher.needs_rehash(row['password_hash']):
+            # Hashed under older settings; store it under the current ones.
+            conn = get_db().get_connection()
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (hasher.hash(password), row['id']))
+            conn.commit()
+            conn.close()
+        return User.get_by_id(row['id'])
     
     @staticmethod
     def search(query, limit=20):
-        db = Database()
+        # The trigram index only matches terms of three or more characters;
+        # shorter queries fall back to a username prefix range.
+        terms = [term for term in query.split() if len(term) >= 3]
+        db = get_db()
         conn = db.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT id, username, full_name, profile_pic, bio FROM users WHERE username LIKE ? OR full_name LIKE ? LIMIT ?', (f'%{query}%', f'%{query}%', limit))
+        if terms and db.fts:
+            match = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+            # Ranked inside the FTS query (username, then name, then bio), so
+            # the best matches are kept, not the first ones in rowid order.
+            cursor.execute('''
+                SELECT u.id, u.username, u.full_name, u.profile_pic, u.bio
+                FROM (SELECT rowid, bm25(users_fts, 10.0, 5.0, 1.0) AS score FROM users_fts WHERE users_fts MATCH ?
+                      ORDER BY bm25(users_fts, 10.0, 5.0, 1.0) LIMIT ?) m
+                JOIN users u ON u.id = m.rowid
+                ORDER BY m.score
+            ''', (match, limit))
+        elif terms:
+            cursor.execute('SELECT id, username, full_name, profile_pic, bio FROM users WHERE username LIKE ? OR full_name LIKE ? LIMIT ?', (f'%{query}%', f'%{query}%', limit))
+        else:
+            prefix = query.strip()
+            cursor.execute('SELECT id, username, full_name, profile_pic, bio FROM users WHERE username >= ? AND username < ? ORDER BY username LIMIT ?', (prefix, prefix + '\uffff', limit))
         users = [dict(row) for row in cursor.fetchall()]
         conn.close()
         return users
     
+    @staticmethod
+    def suggest(query, limit=8):
+        key = (' '.join(query.lower().split()), limit)
+        users = suggest_cache.get(key)
+        if users is None:
+            users = [{k: user[k] for k in ('id', 'username', 'full_name', 'profile_pic')} for user in User.search(query, limit)]
+            suggest_cache.set(key, users)
+        return users
+    
     @staticmethod
     def update(user_id, full_name=None, bio=None, profile_pic=None):
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         updates = []
         values = []
@@ -120,110 +234,360 @@ class User:
             cursor.execute(f"UPDATE users SET {', '.join(updates)} WHERE id = ?", values)
             conn.commit()
         conn.close()
+        User.invalidate(user_id)
 
 class Post:
     @staticmethod
     def create(user_id, content, image=None, wall_owner_id=None, tagged_users=None):
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         cursor.execute('INSERT INTO posts (user_id, content, image, wall_owner_id, tagged_users) VALUES (?, ?, ?, ?, ?)', (user_id, content, image, wall_owner_id, tagged_users))
-        conn.commit()
         post_id = cursor.lastrowid
+        from database.timeline import Timeline
+        Timeline.fan_out(cursor, post_id, user_id, wall_owner_id)
+        conn.commit()
         conn.close()
+        Activity.log(user_id, 'post', {'post_id': post_id, 'wall_owner_id': wall_owner_id})
         return post_id
     
     @staticmethod
-    def get_feed(user_id, limit=50):
-        db = Database()
-        conn = db.get_connection()
+    def set_image(post_id, image):
+        conn = get_db().get_connection()
+        conn.execute('UPDATE posts SET image = ? WHERE id = ?', (image, post_id))
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def get_by_ids(post_ids, viewer_id):
+        if not post_ids:
+            return []
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT p.*, u.username, u.full_name, u.profile_pic, wo.username as wall_owner_username, wo.full_name as wall_owner_name, (SELECT COUNT(*) FROM likes WHERE post_id = p.id) as likes_count, (SELECT COUNT(*) FROM comments WHERE post_id = p.id) as comments_count, EXISTS(SELECT 1 FROM likes WHERE post_id = p.id AND user_id = ?) as user_liked FROM posts p JOIN users u ON p.user_id = u.id LEFT JOIN users wo ON p.wall_owner_id = wo.id ORDER BY p.created_at DESC LIMIT ?', (user_id, limit))
+        placeholders = ','.join('?' * len(post_ids))
+        cursor.execute(f'SELECT {FEED_COLUMNS} FROM posts p JOIN users u ON p.user_id = u.id LEFT JOIN users wo ON p.wall_owner_id = wo.id WHERE p.id IN ({placeholders})', [viewer_id, *post_ids])
+        posts = {row['id']: dict(row) for row in cursor.fetchall()}
+        Post.attach_comment_previews(cursor, posts.values())
+        conn.close()
+        return [posts[post_id] for post_id in post_ids if post_id in posts]
+    
+    @staticmethod
+    def get_feed(user_id, limit=20, before=None):
+        # Keyset pagination: "before" is the (created_at, id) of the last post
+        # on the previous page, so every page is an index range read.
+        params = [user_id, user_id, user_id, user_id, user_id]
+        cursor_clause = ''
+        if before:
+            cursor_clause = ' AND (p.created_at, p.id) < (?, ?)'
+            params.extend(before)
+        params.append(limit)
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"WITH {FRIEND_IDS_CTE} SELECT {FEED_COLUMNS} FROM posts p JOIN users u ON p.user_id = u.id LEFT JOIN users wo ON p.wall_owner_id = wo.id WHERE (p.user_id IN friends OR p.wall_owner_id = ?){cursor_clause} ORDER BY p.created_at DESC, p.id DESC LIMIT ?", params)
         posts = [dict(row) for row in cursor.fetchall()]
+        Post.attach_comment_previews(cursor, posts)
         conn.close()
         return posts
     
     @staticmethod
-    def get_wall_posts(wall_owner_id, limit=20):
-        db = Database()
-        conn = db.get_connection()
+    def get_wall_posts(wall_owner_id, limit=20, viewer_id=None):
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT p.*, u.username, u.full_name, u.profile_pic, (SELECT COUNT(*) FROM likes WHERE post_id = p.id) as likes_count, (SELECT COUNT(*) FROM comments WHERE post_id = p.id) as comments_count FROM posts p JOIN users u ON p.user_id = u.id WHERE p.wall_owner_id = ? OR (p.user_id = ? AND p.wall_owner_id IS NULL) ORDER BY p.created_at DESC LIMIT ?', (wall_owner_id, wall_owner_id, limit))
+        cursor.execute(f'SELECT {FEED_COLUMNS} FROM posts p JOIN users u ON p.user_id = u.id LEFT JOIN users wo ON p.wall_owner_id = wo.id WHERE p.wall_owner_id = ? OR (p.user_id = ? AND p.wall_owner_id IS NULL) ORDER BY p.created_at DESC LIMIT ?', (viewer_id, wall_owner_id, wall_owner_id, limit))
         posts = [dict(row) for row in cursor.fetchall()]
+        Post.attach_comment_previews(cursor, posts)
         conn.close()
         return posts
     
+    @staticmethod
+    def attach_comment_previews(cursor, posts, limit=COMMENT_PREVIEWS):
+        # Sets post['comment_previews'] to the latest comments, oldest first,
+        # for a whole page of posts in one statement. Each post gets its own
+        # LIMITed branch, so a post with 100k comments still reads three
+        # index entries (a ROW_NUMBER() window would rank all of them).
+        posts = {post['id']: post for post in posts}
+        for post in posts.values():
+            post['comment_previews'] = []
+        post_ids = list(posts)
+        for start in range(0, len(post_ids), PREVIEW_BATCH_SIZE):
+            batch = post_ids[start:start + PREVIEW_BATCH_SIZE]
+            branch = f'SELECT * FROM (SELECT {COMMENT_COLUMNS} FROM comments c JOIN users u ON c.user_id = u.id WHERE c.post_id = ? ORDER BY c.created_at DESC, c.id DESC LIMIT ?)'
+            cursor.execute(' UNION ALL '.join([branch] * len(batch)), [param for post_id in batch for param in (post_id, limit)])
+            for row in reversed(cursor.fetchall()):
+                posts[row['post_id']]['comment_previews'].append(dict(row))
+    
     @staticmethod
     def toggle_like(post_id, user_id):
-        db = Database()
-        conn = db.get_connection()
+        # The write lock is taken before looking at the like, so concurrent
+        # toggles serialise instead of racing on the UNIQUE(post_id, user_id).
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT id FROM likes WHERE post_id = ? AND user_id = ?', (post_id, user_id))
-        if cursor.fetchone():
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
             cursor.execute('DELETE FROM likes WHERE post_id = ? AND user_id = ?', (post_id, user_id))
-            action = 'unliked'
-        else:
-            cursor.execute('INSERT INTO likes (post_id, user_id) VALUES (?, ?)', (post_id, user_id))
-            action = 'liked'
-        conn.commit()
-        cursor.execute('SELECT COUNT(*) as count FROM likes WHERE post_id = ?', (post_id,))
-        count = cursor.fetchone()['count']
-        conn.close()
-        return {'action': action, 'count': count}
+            if cursor.rowcount:
+                cursor.execute('UPDATE posts SET likes_count = likes_count - 1 WHERE id = ?', (post_id,))
+                action = 'unliked'
+            else:
+                cursor.execute('INSERT INTO likes (post_id, user_id) VALUES (?, ?)', (post_id, user_id))
+                cursor.execute('UPDATE posts SET likes_count = likes_count + 1 WHERE id = ?', (post_id,))
+                action = 'liked'
+            cursor.execute('SELECT likes_count FROM posts WHERE id = ?', (post_id,))
+            row = cursor.fetchone()
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if action == 'liked':
+            Activity.log(user_id, 'like', {'post_id': post_id})
+        return {'action': action, 'count': row['likes_count'] if row else 0}
     
     @staticmethod
     def add_comment(post_id, user_id, content):
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         cursor.execute('INSERT INTO comments (post_id, user_id, content) VALUES (?, ?, ?)', (post_id, user_id, content))
-        conn.commit()
         comment_id = cursor.lastrowid
+        cursor.execute('UPDATE posts SET comments_count = comments_count + 1 WHERE id = ?', (post_id,))
+        conn.commit()
         conn.close()
+        Activity.log(user_id, 'comment', {'post_id': post_id, 'comment_id': comment_id})
         return comment_id
     
     @staticmethod
-    def get_comments(post_id):
-        db = Database()
-        conn = db.get_connection()
+    def reconcile_counters(batch_size=500):
+        # Repairs likes_count/comments_count drift in small id-range batches
+        # so the write lock is never held for long.
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        last_id = 0
+        repaired = 0
+        while True:
+            cursor.execute('SELECT MAX(id) as max_id FROM (SELECT id FROM posts WHERE id > ? ORDER BY id LIMIT ?)', (last_id, batch_size))
+            max_id = cursor.fetchone()['max_id']
+            if max_id is None:
+                break
+            cursor.execute('UPDATE posts SET likes_count = (SELECT COUNT(*) FROM likes WHERE post_id = posts.id), comments_count = (SELECT COUNT(*) FROM comments WHERE post_id = posts.id) WHERE id > ? AND id <= ? AND (likes_count IS NOT (SELECT COUNT(*) FROM likes WHERE post_id = posts.id) OR comments_count IS NOT (SELECT COUNT(*) FROM comments WHERE post_id = posts.id))', (last_id, max_id))
+            repaired += cursor.rowcount
+            conn.commit()
+            last_id = max_id
+        conn.close()
+        return repaired
+    
+    @staticmethod
+    def get_comments(post_id, limit=50, after=None):
+        # Oldest first; "after" is the (created_at, id) of the last comment
+        # on the previous page.
+        params = [post_id]
+        cursor_clause = ''
+        if after:
+            cursor_clause = ' AND (c.created_at, c.id) > (?, ?)'
+            params.extend(after)
+        params.append(limit)
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT c.*, u.username, u.full_name, u.profile_pic FROM comments c JOIN users u ON c.user_id = u.id WHERE c.post_id = ? ORDER BY c.created_at ASC', (post_id,))
+        cursor.execute(f'SELECT {COMMENT_COLUMNS} FROM comments c JOIN users u ON c.user_id = u.id WHERE c.post_id = ?{cursor_clause} ORDER BY c.created_at, c.id LIMIT ?', params)
         comments = [dict(row) for row in cursor.fetchall()]
         conn.close()
         return comments
 
+# A user can poke the same person again once this much time has passed.
+POKE_WINDOW = 3600
+POKE_COOLDOWN = f'-{POKE_WINDOW} seconds'
+
+# Recent (poker, poked) pairs seen by this process, so repeat pokes are
+# refused without touching SQLite. The pokes index stays authoritative.
+poke_limiter = SlidingWindow(limit=1, window=POKE_WINDOW, maxsize=int(os.environ.get('POKE_LIMITER_SIZE', 65536)))
+
 class Poke:
     @staticmethod
     def send_poke(poker_id, poked_id):
-        db = Database()
-        conn = db.get_connection()
+        key = (poker_id, poked_id)
+        if not poke_limiter.allowed(key):
+            return False
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT id FROM pokes WHERE poker_id = ? AND poked_id = ? AND created_at > datetime('now', '-1 hour')", (poker_id, poked_id))
-        if cursor.fetchone():
+        # Check and insert under the write lock so two concurrent pokes can't
+        # both see "no recent poke".
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute("SELECT MAX(created_at) as created_at FROM pokes WHERE poker_id = ? AND poked_id = ? AND created_at > datetime('now', ?)", (poker_id, poked_id, POKE_COOLDOWN))
+            recent = cursor.fetchone()['created_at']
+            if recent is None:
+                cursor.execute('INSERT INTO pokes (poker_id, poked_id) VALUES (?, ?)', (poker_id, poked_id))
+                cursor.execute('UPDATE users SET poke_count = poke_count + 1 WHERE id = ?', (poked_id,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
             conn.close()
+        if recent is not None:
+            # Poked from another process (or before a restart): remember it here.
+            poke_limiter.record(key, datetime.strptime(recent, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
             return False
-        cursor.execute('INSERT INTO pokes (poker_id, poked_id) VALUES (?, ?)', (poker_id, poked_id))
-        cursor.execute('UPDATE users SET poke_count = poke_count + 1 WHERE id = ?', (poked_id,))
-        cursor.execute('INSERT INTO notifications (user_id, type, content, from_user_id) VALUES (?, ?, ?, ?)', (poked_id, 'poke', 'poked you!', poker_id))
-        conn.commit()
-        conn.close()
+        poke_limiter.record(key)
+        User.invalidate(poked_id)
+        Notification.add(poked_id, 'poke', 'poked you!', from_user_id=poker_id)
+        Activity.log(poker_id, 'poke', {'poked_id': poked_id})
         return True
     
+    @staticmethod
+    def last_poked(poker_id, poked_ids):
+        # {poked_id: {'last_poke_at', 'recent'}} for people poker_id has poked,
+        # where recent means a new poke would still be refused.
+        if not poked_ids:
+            return {}
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        marks = ','.join('?' * len(poked_ids))
+        cursor.execute(f"SELECT poked_id, MAX(created_at) as last_poke_at, MAX(created_at) > datetime('now', ?) as recent FROM pokes WHERE poker_id = ? AND poked_id IN ({marks}) GROUP BY poked_id",
+                       (POKE_COOLDOWN, poker_id, *poked_ids))
+        pokes = {row['poked_id']: {'last_poke_at': row['last_poke_at'], 'recent': bool(row['recent'])} for row in cursor.fetchall()}
+        conn.close()
+        return pokes
+    
     @staticmethod
     def get_recent_pokes(user_id, limit=10):
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT p.*, u.username, u.full_name, u.profile_pic FROM pokes p JOIN users u ON p.poker_id = u.id WHERE p.poked_id = ? ORDER BY p.created_at DESC LIMIT ?', (user_id, limit))
         pokes = [dict(row) for row in cursor.fetchall()]
         conn.close()
         return pokes
 
+class Message:
+    @staticmethod
+    def send(sender_id, receiver_id, content):
+        conn = get_db().get_connection()
+        message = Message.write_batch(conn.cursor(), [(sender_id, receiver_id, content)])[0]
+        conn.commit()
+        conn.close()
+        return message
+    
+    @staticmethod
+    def write_batch(cursor, messages):
+        # Inserts (sender_id, receiver_id, content) tuples and brings their
+        # conversation rows up to date, inside the caller's transaction so the
+        # inbox never disagrees with the thread. Each pair's row is written
+        # once per batch, with the unread counts added up.
+        written = []
+        pairs = {}
+        for sender_id, receiver_id, content in messages:
+            cursor.execute('INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, ?) RETURNING *', (sender_id, receiver_id, content))
+            message = dict(cursor.fetchone())
+            written.append(message)
+            user_a, user_b = min(sender_id, receiver_id), max(sender_id, receiver_id)
+            unread_a, unread_b = pairs.get((user_a, user_b), (None, 0, 0))[1:]
+            pairs[(user_a, user_b)] = (message, unread_a + (receiver_id == user_a), unread_b + (receiver_id == user_b))
+        for (user_a, user_b), (message, unread_a, unread_b) in pairs.items():
+            cursor.execute('''
+                INSERT INTO conversations (user_a, user_b, last_message_id, last_sender_id, last_message, last_message_at, unread_a, unread_b)
+                VALUES (?, ?, ?, ?, substr(?, 1, 200), ?, ?, ?)
+                ON CONFLICT (user_a, user_b) DO UPDATE SET
+                    last_message_id = excluded.last_message_id, last_sender_id = excluded.last_sender_id,
+                    last_message = excluded.last_message, last_message_at = excluded.last_message_at,
+                    unread_a = unread_a + excluded.unread_a, unread_b = unread_b + excluded.unread_b
+            ''', (user_a, user_b, message['id'], message['sender_id'], message['content'], message['created_at'], unread_a, unread_b))
+        return written
+    
+    @staticmethod
+    def get_thread(user_id, other_id, limit=50, before=None):
+        # Newest page first from each direction of the pair, merged; "before"
+        # is the oldest message id already shown. Returned oldest first.
+        cursor_clause = ' AND id < ?' if before else ''
+        side = f'SELECT * FROM (SELECT * FROM messages WHERE sender_id = ? AND receiver_id = ?{cursor_clause} ORDER BY id DESC LIMIT ?)'
+        params = []
+        for sender_id, receiver_id in ((user_id, other_id), (other_id, user_id)):
+            params.extend([sender_id, receiver_id, *([before] if before else []), limit])
+        params.append(limit)
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT m.*, u.username, u.full_name, u.profile_pic FROM ({side} UNION ALL {side}) m JOIN users u ON m.sender_id = u.id ORDER BY m.id DESC LIMIT ?', params)
+        messages = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        messages.reverse()
+        return messages
+
+class Conversation:
+    @staticmethod
+    def get_inbox(user_id, limit=20, before=None):
+        # A user is user_a or user_b of each pair, so both indexed sides are
+        # read newest first and merged; "before" is a last_message_id.
+        cursor_clause = ' AND last_message_id < ?' if before else ''
+        sides = []
+        params = []
+        for me, other in (('a', 'b'), ('b', 'a')):
+            sides.append(f'SELECT * FROM (SELECT user_{other} AS other_id, unread_{me} AS unread, last_message_id, last_sender_id, last_message, last_message_at FROM conversations WHERE user_{me} = ?{cursor_clause} ORDER BY last_message_id DESC LIMIT ?)')
+            params.extend([user_id, *([before] if before else []), limit])
+        params.append(limit)
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT c.*, u.id, u.username, u.full_name, u.profile_pic FROM ({sides[0]} UNION ALL {sides[1]}) c JOIN users u ON c.other_id = u.id ORDER BY c.last_message_id DESC LIMIT ?', params)
+        conversations = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return conversations
+    
+    @staticmethod
+    def mark_read(user_id, other_id):
+        conn = get_db().get_connection()
+        marked = Conversation.apply_reads(conn.cursor(), [(user_id, other_id)])[0]
+        conn.commit()
+        conn.close()
+        return marked
+    
+    @staticmethod
+    def apply_reads(cursor, receipts):
+        # (reader_id, other_id) pairs, inside the caller's transaction; returns
+        # how many messages each one marked read. Only the newest "unread"
+        # messages from the other side can be unread, so each update touches
+        # that many rows instead of the whole thread.
+        marked = []
+        for user_id, other_id in receipts:
+            me = 'a' if user_id < other_id else 'b'
+            user_a, user_b = min(user_id, other_id), max(user_id, other_id)
+            cursor.execute(f'SELECT unread_{me} AS unread FROM conversations WHERE user_a = ? AND user_b = ?', (user_a, user_b))
+            row = cursor.fetchone()
+            if row and row['unread']:
+                cursor.execute('UPDATE messages SET read = 1 WHERE id IN (SELECT id FROM messages WHERE sender_id = ? AND receiver_id = ? ORDER BY id DESC LIMIT ?)', (other_id, user_id, row['unread']))
+                cursor.execute(f'UPDATE conversations SET unread_{me} = 0 WHERE user_a = ? AND user_b = ?', (user_a, user_b))
+            marked.append(row['unread'] if row else 0)
+        return marked
+
 class Notification:
+    # Called with each notification dict after its write has committed;
+    # app.py registers the Socket.IO push here.
+    listeners = []
+    
+    @staticmethod
+    def add(user_id, type, content, from_user_id=None, related_id=None):
+        # Queued on the write-behind writer; published once its batch commits.
+        notification = {'user_id': user_id, 'type': type, 'content': content, 'related_id': related_id, 'from_user_id': from_user_id}
+        write_behind.submit('INSERT INTO notifications (user_id, type, content, related_id, from_user_id) VALUES (?, ?, ?, ?, ?)', (user_id, type, content, related_id, from_user_id),
+                            lambda notification_id: Notification.publish(dict(notification, id=notification_id)))
+    
+    @staticmethod
+    def publish(notification):
+        unread_cache.incr(notification['user_id'])
+        for listener in Notification.listeners:
+            listener(notification)
+    
+    @staticmethod
+    def notify_once(user_id, type, content, from_user_id):
+        # Adds a notification unless an unread one of the same type from the
+        # same user already exists, e.g. one "sent you a message" per sender.
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM notifications WHERE user_id = ? AND read = 0 AND type = ? AND from_user_id = ? LIMIT 1', (user_id, type, from_user_id))
+        exists = cursor.fetchone()
+        conn.close()
+        if not exists:
+            Notification.add(user_id, type, content, from_user_id=from_user_id)
+    
     @staticmethod
     def get_recent(user_id, limit=20):
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT n.*, u.username, u.full_name, u.profile_pic FROM notifications n LEFT JOIN users u ON n.from_user_id = u.id WHERE n.user_id = ? ORDER BY n.created_at DESC LIMIT ?', (user_id, limit))
         notifications = [dict(row) for row in cursor.fetchall()]
@@ -231,39 +595,58 @@ class Notification:
         return notifications
     
     @staticmethod
-    def get_unread_count(user_id):
-        db = Database()
-        conn = db.get_connection()
+    def get_unread_count(user_id, fresh=False):
+        # fresh=True always counts (one index range) and refreshes the cache.
+        count = None if fresh else unread_cache.get(user_id)
+        if count is not None:
+            return count
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT COUNT(*) as count FROM notifications WHERE user_id = ? AND read = 0', (user_id,))
         count = cursor.fetchone()['count']
         conn.close()
+        unread_cache.set(user_id, count)
         return count
     
     @staticmethod
-    def mark_read(notification_id):
-        db = Database()
-        conn = db.get_connection()
+    def mark_read(notification_id, user_id):
+        conn = get_db().get_connection()
         cursor = conn.cursor()
-        cursor.execute('UPDATE notifications SET read = 1 WHERE id = ?', (notification_id,))
+        cursor.execute('UPDATE notifications SET read = 1 WHERE id = ? AND user_id = ? AND read = 0', (notification_id, user_id))
+        changed = cursor.rowcount
         conn.commit()
         conn.close()
+        if changed:
+            unread_cache.incr(user_id, -1)
     
     @staticmethod
     def mark_all_read(user_id):
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         cursor.execute('UPDATE notifications SET read = 1 WHERE user_id = ?', (user_id,))
         conn.commit()
         conn.close()
+        unread_cache.set(user_id, 0)
+
+class Activity:
+    @staticmethod
+    def log(user_id, activity_type, data=None):
+        write_behind.submit('INSERT INTO activities (user_id, activity_type, activity_data) VALUES (?, ?, ?)', (user_id, activity_type, json.dumps(data) if data is not None else None))
+    
+    @staticmethod
+    def get_recent(user_id, limit=20):
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM activities WHERE user_id = ? ORDER BY created_at DESC LIMIT ?', (user_id, limit))
+        activities = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return activities
 
 class Invite:
     @staticmethod
     def create(inviter_id, invitee_email):
         import secrets
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         invite_code = secrets.token_urlsafe(12)
         try:
@@ -277,8 +660,7 @@ class Invite:
     
     @staticmethod
     def get_user_invites(user_id):
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM invites WHERE inviter_id = ? ORDER BY created_at DESC', (user_id,))
         invites = [dict(row) for row in cursor.fetchall()]
@@ -287,8 +669,7 @@ class Invite:
     
     @staticmethod
     def count_successful(user_id):
-        db = Database()
-        conn = db.get_connection()
+        conn = get_db().get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT COUNT(*) as count FROM invites WHERE inviter_id = ? AND status = "accepted"', (user_id,))
         count = cursor.fetchone()['count']
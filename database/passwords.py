@@ -0,0 +1,102 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+# Werkzeug method string; raising the work factor here upgrades stored
+# hashes as their owners next log in.
+METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+# Processes doing the hashing; 0 hashes on the calling thread.
+WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+# Requests allowed to wait for a worker before new ones are turned away.
+MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', max(WORKERS, 1) * 8))
+TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+class HasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    # Key stretching is deliberately expensive, so it runs in a small
+    # process pool: a burst of logins queues for a few cores instead of
+    # taking CPU from every request thread. Callers block until their hash
+    # is done and get HasherBusy when too many are already waiting.
+    def __init__(self, method=METHOD, workers=WORKERS, max_pending=MAX_PENDING, timeout=TIMEOUT):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self.hashed = 0
+        self.verified = 0
+        self.rejected = 0
+        # A pool inherited across fork has no live processes behind it.
+        os.register_at_fork(after_in_child=self._forget_executor)
+
+    def _forget_executor(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        try:
+            with self._lock:
+                if self._executor is None:
+                    # spawn: forking a process full of threads and SQLite
+                    # connections is not safe.
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                executor = self._executor
+            return executor.submit(fn, *args).result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        except BrokenProcessPool:
+            # A worker died (killed, or could not start); start a fresh pool
+            # next time and do this one here rather than fail the login.
+            logger.exception('password hashing pool broke; hashing inline')
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            return fn(*args)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        result = self._run(generate_password_hash, password, self.method)
+        with self._lock:
+            self.hashed += 1
+        return result
+
+    def verify(self, password_hash, password):
+        result = self._run(check_password_hash, password_hash, password)
+        with self._lock:
+            self.verified += 1
+        return result
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'max_pending': self.max_pending, 'hashed': self.hashed, 'verified': self.verified, 'rejected': self.rejected}
+
+hasher = PasswordHasher()
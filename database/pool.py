@@ -0,0 +1,115 @@
+import os
+import queue
+import sqlite3
+import threading
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 16))
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    # Must precede the first write (journal_mode included) to take effect on
+    # a new file; existing files keep their mode, see database.retention.
+    'PRAGMA auto_vacuum = INCREMENTAL',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 134217728',
+)
+
+class PooledConnection(sqlite3.Connection):
+    # close() hands the connection back to its pool instead of closing it,
+    # so existing "conn.close()" call sites keep working unchanged.
+    pool = None
+    idle = False
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or (self.pool.cursor_factory if self.pool else sqlite3.Cursor))
+
+    # sqlite3's own shortcuts create their cursor without calling cursor(),
+    # so route them through it to honour the pool's cursor_factory.
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+class ConnectionPool:
+    def __init__(self, db_path, size=POOL_SIZE, timeout=30):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self.created = 0
+        self.reused = 0
+        self.on_connect = []
+        # Swapped for an instrumented cursor class by monitoring.init_app.
+        self.cursor_factory = sqlite3.Cursor
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False, factory=PooledConnection, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.pool = self
+        for hook in self.on_connect:
+            hook(conn)
+        self.created += 1
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        conn.idle = False
+        self.reused += 1
+        return conn
+
+    def release(self, conn):
+        if conn.idle:
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        if self._idle.qsize() >= self.size:
+            # Overflow connections opened under a burst are not kept around.
+            sqlite3.Connection.close(conn)
+            return
+        conn.idle = True
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            sqlite3.Connection.close(conn)
+
+    def stats(self):
+        return {'created': self.created, 'reused': self.reused, 'idle': self._idle.qsize(), 'size': self.size}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path):
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+def close_all_pools():
+    # SQLite connections must not cross a fork; pre-fork launchers call this
+    # before starting workers so each one opens its own.
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
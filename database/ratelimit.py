@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+class SlidingWindow:
+    # At most `limit` events per key within the last `window` seconds,
+    # remembered for up to `maxsize` keys (least recently used go first).
+    # It only holds what this process has seen, so callers treat "allowed"
+    # as a hint and keep the authoritative check in the database.
+    def __init__(self, limit=1, window=60, maxsize=65536):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _recent(self, key, now):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def allowed(self, key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            events = self._recent(key, now)
+            if events is not None and len(events) >= self.limit:
+                self.rejected += 1
+                return False
+            return True
+
+    def record(self, key, at=None):
+        at = time.time() if at is None else at
+        with self._lock:
+            events = self._recent(key, at)
+            if events is None:
+                events = self._events[key] = deque()
+            events.append(at)
+            while len(events) > self.limit:
+                events.popleft()
+            self._events.move_to_end(key)
+            while len(self._events) > self.maxsize:
+                self._events.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._events), 'maxsize': self.maxsize, 'limit': self.limit, 'window': self.window, 'rejected': self.rejected}
+
+class TokenBucket:
+    # `capacity` tokens per key, refilled at `rate` tokens per second; each
+    # take() spends one. Keys untouched long enough to be full again are
+    # the first to go when more than `maxsize` are tracked.
+    def __init__(self, rate=1.0, capacity=10, maxsize=65536):
+        self.rate = rate
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def take(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def retry_after(self, key, now=None):
+        # Seconds until take(key) would succeed.
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._buckets), 'maxsize': self.maxsize, 'rate': self.rate, 'capacity': self.capacity, 'rejected': self.rejected}
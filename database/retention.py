@@ -0,0 +1,171 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from database.models import DB_PATH, get_db
+
+logger = logging.getLogger(__name__)
+
+# Old rows are either deleted or moved into the archive database, in
+# batches of BATCH_SIZE rows per transaction with PAUSE seconds between
+# batches, so the write lock is never held for long.
+Policy = namedtuple('Policy', 'table days action condition')
+
+def policy(table, days, action, condition):
+    prefix = f'RETENTION_{table.upper()}'
+    return Policy(table, float(os.environ.get(f'{prefix}_DAYS', days)), os.environ.get(f'{prefix}_ACTION', action), condition)
+
+# Only notifications and messages already seen go: unread counts and
+# conversation badges never change under the user. Nothing marks a poke
+# read, so pokes go on age alone; poke_count is a lifetime total and is kept.
+POLICIES = [
+    policy('notifications', 90, 'delete', 'read = 1'),
+    policy('pokes', 180, 'archive', '1 = 1'),
+    policy('messages', 365, 'archive', 'read = 1'),
+]
+
+ARCHIVE_PATH = os.environ.get('RETENTION_ARCHIVE_PATH') or os.path.join(os.path.dirname(DB_PATH), 'archive.db')
+BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+PAUSE = float(os.environ.get('RETENTION_PAUSE_MS', 20)) / 1000
+# Free pages handed back per incremental_vacuum step.
+VACUUM_PAGES = int(os.environ.get('RETENTION_VACUUM_PAGES', 2000))
+# Seconds between background runs; 0 leaves it to the CLI / cron.
+INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 0))
+
+AUTO_VACUUM_INCREMENTAL = 2
+CREATE_TABLE = re.compile(r'^CREATE TABLE (?:IF NOT EXISTS )?"?(\w+)"?', re.I)
+
+def archive_table(conn, table):
+    # Same definition as the live table (so the same id primary key), plus
+    # any columns added to the live table since the archive was created.
+    sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    conn.execute(CREATE_TABLE.sub(f'CREATE TABLE IF NOT EXISTS archive.{table}', sql, count=1))
+    archived = {row[1] for row in conn.execute(f'PRAGMA archive.table_info({table})')}
+    columns = []
+    for row in conn.execute(f'PRAGMA main.table_info({table})'):
+        if row[1] not in archived:
+            conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {row[1]} {row[2]}')
+        columns.append(row[1])
+    conn.commit()
+    return ', '.join(columns)
+
+def apply_policy(conn, rule, cutoff, dry_run=False):
+    # Walks candidates in (created_at, id) order from the created_at index,
+    # one batch per transaction. Returns the number of rows removed.
+    columns = archive_table(conn, rule.table) if rule.action == 'archive' and not dry_run else None
+    removed = 0
+    last = ('', 0)
+    while True:
+        rows = conn.execute(f'SELECT id, created_at FROM main.{rule.table} WHERE created_at < ? AND (created_at, id) > (?, ?) AND {rule.condition} '
+                            f'ORDER BY created_at, id LIMIT ?', (cutoff, *last, BATCH_SIZE)).fetchall()
+        if not rows:
+            return removed
+        last = (rows[-1]['created_at'], rows[-1]['id'])
+        if dry_run:
+            removed += len(rows)
+            continue
+        ids = [row['id'] for row in rows]
+        marks = ','.join('?' * len(ids))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if columns:
+                conn.execute(f'INSERT OR IGNORE INTO archive.{rule.table} ({columns}) SELECT {columns} FROM main.{rule.table} WHERE id IN ({marks})', ids)
+            removed += conn.execute(f'DELETE FROM main.{rule.table} WHERE id IN ({marks})', ids).rowcount
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        time.sleep(PAUSE)
+
+def compact(conn, max_pages=None):
+    # Hands free pages back to the filesystem a step at a time. A database
+    # created before incremental auto_vacuum needs `flask retention-compact
+    # --full` once to switch over.
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return {'freed_pages': 0, 'free_pages': conn.execute('PRAGMA freelist_count').fetchone()[0], 'incremental': False}
+    freed = 0
+    while max_pages is None or freed < max_pages:
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not free:
+            break
+        step = min(free, VACUUM_PAGES, max_pages - freed if max_pages is not None else VACUUM_PAGES)
+        # Each step of this pragma frees one page and sqlite3's execute()
+        # only steps once; executescript() runs it to completion.
+        conn.executescript(f'PRAGMA incremental_vacuum({step})')
+        freed += free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+        time.sleep(PAUSE)
+    return {'freed_pages': freed, 'free_pages': conn.execute('PRAGMA freelist_count').fetchone()[0], 'incremental': True}
+
+def enable_incremental_vacuum(conn):
+    # Rewrites the whole file; run it during maintenance, not under traffic.
+    conn.execute(f'PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}')
+    conn.execute('VACUUM')
+
+def run(policies=None, dry_run=False, archive_path=ARCHIVE_PATH):
+    # One pass over every policy, then compaction. Returns a report of rows
+    # removed and seconds spent per table.
+    report = {'tables': {}}
+    conn = get_db().get_connection()
+    attached = False
+    try:
+        if not dry_run:
+            conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+            attached = True
+        for rule in policies or POLICIES:
+            started = time.perf_counter()
+            cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{rule.days} days',)).fetchone()[0]
+            rows = apply_policy(conn, rule, cutoff, dry_run)
+            report['tables'][rule.table] = {'action': rule.action, 'cutoff': cutoff, 'rows': rows, 'seconds': round(time.perf_counter() - started, 3)}
+        if not dry_run:
+            started = time.perf_counter()
+            report['compact'] = dict(compact(conn), seconds=round(time.perf_counter() - started, 3))
+    finally:
+        if attached:
+            conn.execute('DETACH DATABASE archive')
+        conn.close()
+    return report
+
+class RetentionScheduler:
+    # Background thread running retention.run() every `interval` seconds.
+    # Runs in several processes are safe: batches are idempotent and
+    # serialised by the write lock.
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.rows = 0
+        self.failures = 0
+        self.last_seconds = 0.0
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='retention', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            started = time.perf_counter()
+            try:
+                report = run()
+            except Exception:
+                self.failures += 1
+                logger.exception('retention run failed')
+                continue
+            self.runs += 1
+            self.rows += sum(stats['rows'] for stats in report['tables'].values())
+            self.last_seconds = round(time.perf_counter() - started, 3)
+            logger.info('retention: %s', report)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {'interval': self.interval, 'runs': self.runs, 'rows': self.rows, 'failures': self.failures, 'last_seconds': self.last_seconds}
+
+scheduler = RetentionScheduler()
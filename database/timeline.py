@@ -0,0 +1,138 @@
+import os
+from database.models import get_db, Post, FRIEND_IDS_CTE
+
+# Optional precomputed home timelines (fan-out on write). When enabled,
+# Post.create pushes the new post id into the timelines of the author's
+# friends, and reads become a slice of that table plus a batch hydrate.
+# Only users whose timeline has been built (timeline_state row) receive
+# pushes; anyone else is built lazily on their first read.
+FANOUT_ENABLED = os.environ.get('TIMELINE_FANOUT', '0') == '1'
+TIMELINE_SIZE = int(os.environ.get('TIMELINE_SIZE', 500))
+# Authors with more friends than this are not fanned out to; their posts
+# are pulled in at read time instead.
+FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT', 1000))
+
+def sort_key(entry):
+    return (entry['created_at'], entry['post_id'])
+
+class Timeline:
+    @staticmethod
+    def fan_out(cursor, post_id, user_id, wall_owner_id=None):
+        if not FANOUT_ENABLED:
+            return
+        cursor.execute('SELECT created_at FROM posts WHERE id = ?', (post_id,))
+        created_at = cursor.fetchone()['created_at']
+        cursor.execute("SELECT (SELECT COUNT(*) FROM friendships WHERE user_a = ? AND status = 'accepted') + (SELECT COUNT(*) FROM friendships WHERE user_b = ? AND status = 'accepted') as count", (user_id, user_id))
+        if cursor.fetchone()['count'] > FANOUT_LIMIT:
+            cursor.execute('INSERT OR IGNORE INTO timeline_pull_authors (user_id) VALUES (?)', (user_id,))
+            cursor.execute('SELECT user_id FROM timeline_state WHERE user_id IN (?, ?)', (user_id, wall_owner_id))
+        else:
+            cursor.execute(f'WITH {FRIEND_IDS_CTE} SELECT user_id FROM timeline_state WHERE user_id IN (SELECT id FROM friends UNION SELECT ?)', (user_id, user_id, user_id, wall_owner_id))
+        recipients = [row['user_id'] for row in cursor.fetchall()]
+        cursor.executemany('INSERT OR IGNORE INTO timelines (user_id, post_id, created_at) VALUES (?, ?, ?)', ((recipient, post_id, created_at) for recipient in recipients))
+        # Each push adds one entry, so a full timeline drops its oldest here,
+        # in the poster's transaction, rather than waiting for timelines-trim.
+        for recipient in recipients:
+            Timeline.trim_user(cursor, recipient)
+
+    @staticmethod
+    def rebuild_user(cursor, user_id):
+        cursor.execute('DELETE FROM timelines WHERE user_id = ?', (user_id,))
+        cursor.execute(f'INSERT INTO timelines (user_id, post_id, created_at) WITH {FRIEND_IDS_CTE} SELECT ?, p.id, p.created_at FROM posts p WHERE p.user_id IN friends OR p.wall_owner_id = ? ORDER BY p.created_at DESC, p.id DESC LIMIT ?', (user_id, user_id, user_id, user_id, user_id, TIMELINE_SIZE))
+        floor = None
+        if cursor.rowcount >= TIMELINE_SIZE:
+            cursor.execute('SELECT created_at, post_id FROM timelines WHERE user_id = ? ORDER BY created_at, post_id LIMIT 1', (user_id,))
+            floor = cursor.fetchone()
+        cursor.execute('INSERT OR REPLACE INTO timeline_state (user_id, floor_created_at, floor_post_id) VALUES (?, ?, ?)', (user_id, floor['created_at'] if floor else None, floor['post_id'] if floor else None))
+
+    @staticmethod
+    def rebuild(user_ids=None):
+        # From scratch: recompute the pull-author set and rebuild every built
+        # timeline (or just the given users), one transaction per user.
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM timeline_pull_authors')
+        cursor.execute("INSERT INTO timeline_pull_authors (user_id) SELECT id FROM (SELECT user_a as id FROM friendships WHERE status = 'accepted' UNION ALL SELECT user_b FROM friendships WHERE status = 'accepted') GROUP BY id HAVING COUNT(*) > ?", (FANOUT_LIMIT,))
+        conn.commit()
+        if user_ids is None:
+            cursor.execute('SELECT user_id FROM timeline_state')
+            user_ids = [row['user_id'] for row in cursor.fetchall()]
+        for user_id in user_ids:
+            Timeline.rebuild_user(cursor, user_id)
+            conn.commit()
+        conn.close()
+        return len(user_ids)
+
+    @staticmethod
+    def invalidate(*user_ids):
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        for user_id in user_ids:
+            cursor.execute('DELETE FROM timelines WHERE user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM timeline_state WHERE user_id = ?', (user_id,))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def trim_user(cursor, user_id):
+        # Keeps the timeline at TIMELINE_SIZE entries and records the floor
+        # below which reads fall back to the feed query.
+        cursor.execute('SELECT created_at, post_id FROM timelines WHERE user_id = ? ORDER BY created_at DESC, post_id DESC LIMIT 1 OFFSET ?', (user_id, TIMELINE_SIZE - 1))
+        floor = cursor.fetchone()
+        if floor is None:
+            return False
+        cursor.execute('DELETE FROM timelines WHERE user_id = ? AND (created_at, post_id) < (?, ?)', (user_id, floor['created_at'], floor['post_id']))
+        if not cursor.rowcount:
+            return False
+        cursor.execute('UPDATE timeline_state SET floor_created_at = ?, floor_post_id = ? WHERE user_id = ?', (floor['created_at'], floor['post_id'], user_id))
+        return True
+
+    @staticmethod
+    def trim():
+        # Fan-out keeps timelines bounded; this catches up after TIMELINE_SIZE
+        # is lowered.
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id FROM timelines GROUP BY user_id HAVING COUNT(*) > ?', (TIMELINE_SIZE,))
+        user_ids = [row['user_id'] for row in cursor.fetchall()]
+        for user_id in user_ids:
+            Timeline.trim_user(cursor, user_id)
+            conn.commit()
+        conn.close()
+        return len(user_ids)
+
+    @staticmethod
+    def get_feed(user_id, limit=20, before=None):
+        if not FANOUT_ENABLED:
+            return Post.get_feed(user_id, limit=limit, before=before)
+        conn = get_db().get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT floor_created_at, floor_post_id FROM timeline_state WHERE user_id = ?', (user_id,))
+        state = cursor.fetchone()
+        if state is None:
+            Timeline.rebuild_user(cursor, user_id)
+            conn.commit()
+            cursor.execute('SELECT floor_created_at, floor_post_id FROM timeline_state WHERE user_id = ?', (user_id,))
+            state = cursor.fetchone()
+        cursor_clause = ''
+        cursor_params = []
+        if before:
+            cursor_clause = ' AND (created_at, {}) < (?, ?)'
+            cursor_params = list(before)
+        cursor.execute('SELECT post_id, created_at FROM timelines WHERE user_id = ?' + cursor_clause.format('post_id') + ' ORDER BY created_at DESC, post_id DESC LIMIT ?', [user_id, *cursor_params, limit])
+        entries = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(f'WITH {FRIEND_IDS_CTE} SELECT id as post_id, created_at FROM posts WHERE user_id IN (SELECT a.user_id FROM timeline_pull_authors a JOIN friends f ON f.id = a.user_id)' + cursor_clause.format('id') + ' ORDER BY created_at DESC, id DESC LIMIT ?', [user_id, user_id, user_id, *cursor_params, limit])
+        seen = {entry['post_id'] for entry in entries}
+        entries.extend(dict(row) for row in cursor.fetchall() if row['post_id'] not in seen)
+        conn.close()
+        floor = None
+        if state['floor_created_at'] is not None:
+            floor = (state['floor_created_at'], state['floor_post_id'])
+            entries = [entry for entry in entries if sort_key(entry) >= floor]
+        entries = sorted(entries, key=sort_key, reverse=True)[:limit]
+        posts = Post.get_by_ids([entry['post_id'] for entry in entries], user_id)
+        if len(posts) < limit and floor:
+            # Past the retained window: continue with the fan-out-on-read query.
+            last = (posts[-1]['created_at'], posts[-1]['id']) if posts else before
+            posts.extend(Post.get_feed(user_id, limit=limit - len(posts), before=last or floor))
+        return posts
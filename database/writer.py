@@ -0,0 +1,127 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('WRITE_BEHIND', '1') == '1'
+QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 10000))
+BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 500))
+FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_MS', 50)) / 1000
+# How long a producer waits for queue space before writing the row itself.
+PUT_TIMEOUT = float(os.environ.get('WRITE_BEHIND_PUT_TIMEOUT_MS', 250)) / 1000
+
+_STOP = object()
+
+class WriteBehindQueue:
+    # Single background writer that group-commits queued INSERTs. Producers
+    # hand over (sql, params, on_commit); on_commit(lastrowid) runs on the
+    # writer thread once the row's batch has committed.
+    #
+    # Durability: a submitted row lives only in this process's memory until
+    # its batch commits, normally within WRITE_BEHIND_FLUSH_MS, and never
+    # more than WRITE_BEHIND_QUEUE_SIZE rows. stop() flushes them. Every
+    # server entry point calls it through app.shutdown(): gunicorn's
+    # worker_exit, the pre-fork workers' signal handler, and the single
+    # process dev server. atexit is only a fallback. A SIGKILL, an OOM kill
+    # or a crash loses whatever is queued, so only rows that can be lost
+    # (notifications, activity) go through here.
+    def __init__(self, connect, maxsize=QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.sync_writes = 0
+
+    def submit(self, sql, params, on_commit=None):
+        item = (sql, params, on_commit)
+        if not ENABLED or not self._ensure_started():
+            self._write([item])
+            return
+        try:
+            self._queue.put(item, timeout=PUT_TIMEOUT)
+        except queue.Full:
+            # Backpressure: the caller pays for its own write instead of growing the queue.
+            self.sync_writes += 1
+            self._write([item])
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return self._thread.is_alive()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+                # For scripts and CLI commands; servers call stop() themselves.
+                atexit.register(self.stop)
+        return True
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                running = False
+            items = [item for item in batch if item is not _STOP]
+            if items:
+                self._write(items)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, items):
+        conn = self.connect()
+        try:
+            rowids = [conn.execute(sql, params).lastrowid for sql, params, _ in items]
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            logger.exception('write-behind batch of %d failed, retrying row by row', len(items))
+            rowids = []
+            for sql, params, _ in items:
+                try:
+                    rowids.append(conn.execute(sql, params).lastrowid)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    logger.exception('write-behind dropped row: %s %r', sql, params)
+                    rowids.append(None)
+        finally:
+            conn.close()
+        self.written += sum(rowid is not None for rowid in rowids)
+        self.batches += 1
+        for (sql, params, on_commit), rowid in zip(items, rowids):
+            if on_commit and rowid is not None:
+                try:
+                    on_commit(rowid)
+                except Exception:
+                    logger.exception('write-behind on_commit callback failed')
+
+    def flush(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'maxsize': self._queue.maxsize, 'written': self.written, 'batches': self.batches,
+                'sync_writes': self.sync_writes, 'flush_interval_ms': self.flush_interval * 1000}
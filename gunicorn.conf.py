@@ -0,0 +1,36 @@
+# Production server settings, tunable from the environment:
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# gthread holds one thread per open websocket, so THREADS caps live sockets
+# per worker; the gevent worker handles thousands per worker instead.
+# Several workers share rooms through SOCKETIO_MESSAGE_QUEUE (see app.py).
+import os
+
+wsgi_app = 'wsgi:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+# app.py reads this to decide whether it needs the message queue.
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('THREADS', 32))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+# Recycle workers now and then so slow leaks can't build up; the jitter keeps
+# them from all restarting at once.
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('ACCESS_LOG') or None
+errorlog = '-'
+
+if worker_class == 'gevent':
+    os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'gevent')
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
@@ -0,0 +1,86 @@
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+TMP_DIR = os.environ.get('UPLOAD_TMP_DIR') or None
+
+# Output sizes match the Cloudinary transformations uploads used to request.
+PROFILES = {
+    'post': {'folder': 'posts', 'size': (1200, 1200), 'crop': False},
+    'profile': {'folder': 'profiles', 'size': (400, 400), 'crop': True},
+}
+
+def resize(path, profile):
+    # Returns (path, extension) of the processed image. Animated images are
+    # passed through untouched rather than flattened to one frame.
+    with Image.open(path) as image:
+        if getattr(image, 'is_animated', False):
+            return path, '.' + image.format.lower()
+        image = ImageOps.exif_transpose(image)
+        if profile['crop']:
+            image = ImageOps.fit(image, profile['size'])
+        else:
+            image.thumbnail(profile['size'])
+        if image.mode == 'P':
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if image.mode in ('RGBA', 'LA'):
+            output, options = path + '.png', {'format': 'PNG', 'optimize': True}
+        else:
+            output, options = path + '.jpg', {'format': 'JPEG', 'quality': 85, 'optimize': True}
+            image = image.convert('RGB')
+        image.save(output, **options)
+    return output, os.path.splitext(output)[1]
+
+class UploadPipeline:
+    # The request thread only streams the upload to a temp file; resizing and
+    # storing happen on a worker pool, then on_done(url) runs on the worker.
+    def __init__(self, storage, workers=WORKERS, tmp_dir=TMP_DIR):
+        self.storage = storage
+        self.tmp_dir = tmp_dir
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload')
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, file, kind, on_done, on_error=None):
+        fd, path = tempfile.mkstemp(prefix='upload-', dir=self.tmp_dir)
+        with os.fdopen(fd, 'wb') as out:
+            file.save(out)
+        with self._lock:
+            self.pending += 1
+        return self._executor.submit(self._process, path, PROFILES[kind], on_done, on_error)
+
+    def _process(self, path, profile, on_done, on_error):
+        output = path
+        try:
+            output, ext = resize(path, profile)
+            url = self.storage.save(output, f"{profile['folder']}/{uuid.uuid4().hex}{ext}")
+            on_done(url)
+            with self._lock:
+                self.completed += 1
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            logger.exception('upload processing failed')
+            if on_error:
+                on_error()
+        finally:
+            with self._lock:
+                self.pending -= 1
+            for leftover in {path, output}:
+                try:
+                    os.remove(leftover)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        return {'pending': self.pending, 'completed': self.completed, 'failed': self.failed}
@@ -0,0 +1,36 @@
+import os
+import shutil
+
+class LocalStorage:
+    # Files live under app.config['UPLOAD_FOLDER'] and are served by Flask's
+    # static route; lets the whole upload path run offline.
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    def save(self, path, key):
+        dest = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.move(path, dest)
+        return f'{self.base_url}/{key}'
+
+class CloudinaryStorage:
+    def __init__(self, cloud_name, api_key, api_secret, root_folder='socialhub'):
+        import cloudinary
+        import cloudinary.uploader
+        cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
+        self.uploader = cloudinary.uploader
+        self.root_folder = root_folder
+
+    def save(self, path, key):
+        folder, name = key.rsplit('/', 1)
+        result = self.uploader.upload(path, folder=f'{self.root_folder}/{folder}', public_id=os.path.splitext(name)[0])
+        return result['secure_url']
+
+def get_storage(config, root_path):
+    # UPLOAD_BACKEND is 'local' or 'cloudinary'.
+    if config['UPLOAD_BACKEND'] == 'cloudinary':
+        return CloudinaryStorage(os.environ.get('CLOUDINARY_CLOUD_NAME'), os.environ.get('CLOUDINARY_API_KEY'), os.environ.get('CLOUDINARY_API_SECRET'))
+    if config['UPLOAD_BACKEND'] == 'local':
+        return LocalStorage(os.path.join(root_path, config['UPLOAD_FOLDER']), config['UPLOAD_URL'])
+    raise ValueError(f"Unknown UPLOAD_BACKEND {config['UPLOAD_BACKEND']!r}")
@@ -0,0 +1,80 @@
+import cProfile
+import hmac
+import os
+import tempfile
+import time
+from time import perf_counter
+
+from flask import Response, abort, g, request
+
+from monitoring import sql
+from monitoring.metrics import COUNT_BUCKETS, Gauge, Histogram, registry
+
+ENABLED = os.environ.get('METRICS', '1') == '1'
+# /metrics is served on the public listener, so it answers 404 unless a
+# token is configured and the scraper sends it as a bearer token.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Profiling is off unless a token is configured; a request opts in by
+# sending it in the X-Profile header.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'socialhub-profiles'))
+
+REQUEST_LATENCY = registry.register(Histogram('http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method', 'status')))
+REQUEST_QUERIES = registry.register(Histogram('db_queries_per_request', 'SQL statements executed per request.', ('endpoint',), buckets=COUNT_BUCKETS))
+REQUEST_QUERY_TIME = registry.register(Histogram('db_query_seconds_per_request', 'Time spent in SQL per request.', ('endpoint',)))
+
+def _endpoint():
+    # Rule names rather than paths keep label cardinality bounded.
+    return request.endpoint or 'unmatched'
+
+def _start():
+    g.metrics_started = perf_counter()
+    g.query_stats, g.query_token = sql.start(_endpoint())
+    header = request.headers.get('X-Profile')
+    if PROFILE_TOKEN and header and hmac.compare_digest(header, PROFILE_TOKEN):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _finish(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f'{_endpoint()}-{time.time_ns()}.prof')
+        profiler.dump_stats(path)
+        response.headers['X-Profile-File'] = path
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        endpoint = _endpoint()
+        stats = g.query_stats
+        REQUEST_LATENCY.observe(perf_counter() - started, endpoint, request.method, str(response.status_code))
+        REQUEST_QUERIES.observe(stats.count, endpoint)
+        REQUEST_QUERY_TIME.observe(stats.seconds, endpoint)
+        response.headers['Server-Timing'] = f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"'
+    return response
+
+def _teardown(exc):
+    token = g.pop('query_token', None)
+    if token is not None:
+        sql.stop(token)
+
+def metrics():
+    header = request.headers.get('Authorization', '')
+    if not METRICS_TOKEN or not hmac.compare_digest(header, f'Bearer {METRICS_TOKEN}'):
+        abort(404)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app, pool, stats=None):
+    # stats() returns {component: {name: number}}, as served by
+    # /api/cache/stats, and is exported as one gauge per value.
+    if not ENABLED:
+        return
+    pool.cursor_factory = sql.TimedCursor
+    if stats is not None:
+        registry.register(Gauge('socialhub_component_stat', 'Counters reported by internal components.', ('component', 'stat'), collect=lambda: {
+            (component, name): value for component, values in stats().items() for name, value in values.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}))
+    app.before_request_funcs.setdefault(None, []).insert(0, _start)
+    app.after_request(_finish)
+    app.teardown_request(_teardown)
+    app.add_url_rule('/metrics', 'metrics', metrics)
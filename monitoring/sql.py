@@ -0,0 +1,81 @@
+import contextvars
+import logging
+import os
+import sqlite3
+from time import perf_counter
+
+from monitoring.metrics import Counter, registry
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_MS', 100)) / 1000
+
+SLOW_QUERIES = registry.register(Counter('db_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS.', ('endpoint',)))
+
+class QueryStats:
+    # SQL work attributed to one unit of work, normally a request.
+    def __init__(self, label=''):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+
+_current = contextvars.ContextVar('query_stats', default=None)
+
+def start(label=''):
+    # Returns a token for stop(); statements run until then count towards label.
+    stats = QueryStats(label)
+    return stats, _current.set(stats)
+
+def stop(token):
+    _current.reset(token)
+
+def current():
+    return _current.get()
+
+class TimedCursor(sqlite3.Cursor):
+    # Charges execute() and the fetches after it to the statement: SQLite
+    # steps a SELECT lazily, so a scan's cost mostly lands in fetchall().
+    _sql = None
+    _elapsed = 0.0
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql)
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql)
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed(super().fetchall)
+
+    def _begin(self, sql):
+        self._sql = sql
+        self._elapsed = 0.0
+        stats = _current.get()
+        if stats is not None:
+            stats.count += 1
+
+    def _timed(self, method, *args):
+        start = perf_counter()
+        try:
+            return method(*args)
+        finally:
+            elapsed = perf_counter() - start
+            before = self._elapsed
+            self._elapsed = before + elapsed
+            stats = _current.get()
+            if stats is not None:
+                stats.seconds += elapsed
+            if before < SLOW_QUERY_THRESHOLD <= self._elapsed:
+                # Logged once, when the statement crosses the threshold.
+                # Parameters are left out: they carry user data.
+                label = stats.label if stats is not None else ''
+                SLOW_QUERIES.inc(label)
+                logger.warning('slow query (%.1f ms) in %s: %s', self._elapsed * 1000, label or 'background', ' '.join(self._sql.split()))
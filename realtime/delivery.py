@@ -0,0 +1,178 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from database.models import Conversation, Message, get_db
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = int(os.environ.get('CHAT_QUEUE_SIZE', 5000))
+BATCH_SIZE = int(os.environ.get('CHAT_BATCH_SIZE', 200))
+# How long the writer lingers for more messages once it has one. Messages
+# that arrive while a batch is committing go in the next one regardless.
+FLUSH_INTERVAL = float(os.environ.get('CHAT_FLUSH_MS', 2)) / 1000
+# How long a sender waits for queue space, then for its batch to commit.
+TIMEOUT = float(os.environ.get('CHAT_TIMEOUT', 5))
+
+class ChatBusy(Exception):
+    pass
+
+class ChatFailed(Exception):
+    pass
+
+class ChatPipeline:
+    # Single writer that group-commits chat messages and read receipts.
+    # send() blocks the calling handler until its message's batch has
+    # committed and returns the stored row, so the client can be acked with
+    # the server id. mark_read() only queues; receipts for the same pair
+    # collapse into one update. Listeners are called on the writer thread
+    # after each commit with the batch's messages and (reader_id, other_id,
+    # marked) receipts.
+    def __init__(self, connect, maxsize=QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, timeout=TIMEOUT):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.message_listeners = []
+        self.read_listeners = []
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.receipts = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.rejected = 0
+        self.failed = 0
+        # The writer thread does not survive fork; each worker starts its own.
+        os.register_at_fork(after_in_child=self._forget_thread)
+
+    def _forget_thread(self):
+        self._queue = queue.Queue(self.maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def send(self, sender_id, receiver_id, content):
+        future = Future()
+        self._put(('message', (sender_id, receiver_id, content), future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Still queued: withdraw it, so the sender's retry is the only
+            # copy stored. Already claimed by the writer: it is committing
+            # now, so wait for it rather than report a message that lands.
+            if not future.cancel():
+                return future.result()
+            self.rejected += 1
+            raise ChatBusy()
+
+    def mark_read(self, user_id, other_id):
+        self._put(('read', (user_id, other_id), None))
+
+    def _put(self, item):
+        self._ensure_started()
+        try:
+            self._queue.put(item, timeout=self.timeout)
+        except queue.Full:
+            self.rejected += 1
+            raise ChatBusy()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception('chat batch of %d failed', len(batch))
+                for _, _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(ChatFailed())
+
+    def _write(self, batch):
+        # Claiming a future makes cancel() fail from here on; sends whose
+        # handler already gave up are dropped unwritten.
+        sends = [(payload, future) for kind, payload, future in batch if kind == 'message' and future.set_running_or_notify_cancel()]
+        # Later receipts for a pair add nothing to the first.
+        receipts = list(dict.fromkeys(payload for kind, payload, _ in batch if kind == 'read'))
+        if not sends and not receipts:
+            return
+        conn = self.connect()
+        try:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                messages = Message.write_batch(conn.cursor(), [payload for payload, _ in sends])
+                marked = Conversation.apply_reads(conn.cursor(), receipts)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                logger.exception('chat batch of %d failed, retrying one by one', len(batch))
+                messages, marked = self._write_each(conn, sends, receipts)
+        finally:
+            conn.close()
+        for (_, future), message in zip(sends, messages):
+            if message is None:
+                future.set_exception(ChatFailed())
+            else:
+                future.set_result(message)
+        messages = [message for message in messages if message is not None]
+        receipts = [(user_id, other_id, count) for (user_id, other_id), count in zip(receipts, marked) if count]
+        self.sent += len(messages)
+        self.receipts += len(receipts)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for listeners, items in ((self.message_listeners, messages), (self.read_listeners, receipts)):
+            if not items:
+                continue
+            for listener in listeners:
+                try:
+                    listener(items)
+                except Exception:
+                    logger.exception('chat listener failed')
+
+    def _write_each(self, conn, sends, receipts):
+        # One transaction per item, so a bad row only fails its own sender.
+        messages, marked = [], []
+        for write, items, results in ((Message.write_batch, [payload for payload, _ in sends], messages), (Conversation.apply_reads, receipts, marked)):
+            for item in items:
+                try:
+                    results.extend(write(conn.cursor(), [item]))
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    logger.exception('chat dropped %r', item)
+                    self.failed += 1
+                    results.append(None if write is Message.write_batch else 0)
+        return messages, marked
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'maxsize': self.maxsize, 'sent': self.sent, 'receipts': self.receipts, 'batches': self.batches,
+                'largest_batch': self.largest_batch, 'rejected': self.rejected, 'failed': self.failed, 'flush_interval_ms': self.flush_interval * 1000}
+
+pipeline = ChatPipeline(lambda: get_db().get_connection())
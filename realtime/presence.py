@@ -0,0 +1,204 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from database.models import get_db
+
+logger = logging.getLogger(__name__)
+
+# Pages send a heartbeat every HEARTBEAT seconds; a socket silent for
+# EXPIRY is counted offline even if its disconnect never arrived.
+HEARTBEAT = float(os.environ.get('PRESENCE_HEARTBEAT', 25))
+EXPIRY = float(os.environ.get('PRESENCE_EXPIRY', 75))
+# Changes are announced this long after they happen, and only if they still
+# hold: a reload or a reconnect within the window is never broadcast.
+DEBOUNCE = float(os.environ.get('PRESENCE_DEBOUNCE', 3))
+# With several workers, how often each one publishes its users to the
+# presence table and reads everyone else's.
+SYNC_INTERVAL = float(os.environ.get('PRESENCE_SYNC_INTERVAL', 2))
+
+class Presence:
+    # Who has a Socket.IO connection open. Each process counts its own
+    # sockets per user, so several tabs keep a user online until the last one
+    # closes. With shared=True (several workers) each process also mirrors
+    # its online users into the presence table and keeps the union of the
+    # other workers' as a frozenset. Listeners are called on the background
+    # thread with {user_id: online} for changes that survived the debounce.
+    def __init__(self, connect, expiry=EXPIRY, debounce=DEBOUNCE, sync_interval=SYNC_INTERVAL):
+        self.connect = connect
+        self.expiry = expiry
+        self.debounce = debounce
+        self.sync_interval = sync_interval
+        self.shared = False
+        self.listeners = []
+        self.announced = 0
+        self.suppressed = 0
+        self.expired = 0
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Also run in a forked worker: it has none of the parent's sockets.
+        self.worker = uuid.uuid4().hex
+        self._sockets = {}  # sid -> [user_id, last heartbeat]
+        self._counts = {}  # user_id -> open sockets in this process
+        self._remote = frozenset()
+        self._ready = False
+        self._synced = set()
+        self._changed = {}  # user_id -> (first unannounced change, online before it)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, shared=False):
+        self.shared = shared
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='presence', daemon=True)
+                self._thread.start()
+
+    def is_online(self, user_id):
+        if self.shared and not self._ready:
+            # Nothing read from the other workers yet; assume anyone might be.
+            self._ensure_started()
+            return True
+        return self._online(user_id)
+
+    def _online(self, user_id):
+        return user_id in self._counts or user_id in self._remote
+
+    def online_among(self, user_ids):
+        return [user_id for user_id in user_ids if self.is_online(user_id)]
+
+    def connect_socket(self, sid, user_id):
+        self._ensure_started()
+        with self._lock:
+            if sid in self._sockets:
+                return
+            self._sockets[sid] = [user_id, time.monotonic()]
+            self._mark_changed(user_id)
+            self._counts[user_id] = self._counts.get(user_id, 0) + 1
+
+    def disconnect_socket(self, sid):
+        with self._lock:
+            self._drop(sid)
+
+    def heartbeat(self, sid, user_id):
+        # A socket dropped by _expire (a stalled tab, a long GC pause) that is
+        # still talking to us is live after all: count it back in.
+        entry = self._sockets.get(sid)
+        if entry is None:
+            self.connect_socket(sid, user_id)
+        else:
+            entry[1] = time.monotonic()
+
+    def _drop(self, sid):
+        entry = self._sockets.pop(sid, None)
+        if entry is None:
+            return
+        user_id = entry[0]
+        self._mark_changed(user_id)
+        if self._counts[user_id] == 1:
+            del self._counts[user_id]
+        else:
+            self._counts[user_id] -= 1
+
+    def _mark_changed(self, user_id):
+        if user_id not in self._changed:
+            self._changed[user_id] = (time.monotonic(), self._online(user_id))
+
+    def _run(self):
+        synced = 0.0
+        while not self._stop.wait(min(1.0, self.debounce / 2 or 1.0)):
+            try:
+                self._expire()
+                if self.shared and time.monotonic() - synced >= self.sync_interval:
+                    self._sync()
+                    synced = time.monotonic()
+                self._announce()
+            except Exception:
+                logger.exception('presence update failed')
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.expiry
+        with self._lock:
+            stale = [sid for sid, (_, seen) in self._sockets.items() if seen < cutoff]
+            for sid in stale:
+                self._drop(sid)
+        self.expired += len(stale)
+
+    def _announce(self):
+        cutoff = time.monotonic() - self.debounce
+        with self._lock:
+            due = [(user_id, was_online) for user_id, (at, was_online) in self._changed.items() if at <= cutoff]
+            for user_id, _ in due:
+                del self._changed[user_id]
+        changes = {}
+        for user_id, was_online in due:
+            online = self._online(user_id)
+            if online == was_online:
+                self.suppressed += 1
+            else:
+                changes[user_id] = online
+        if not changes:
+            return
+        self.announced += len(changes)
+        for listener in self.listeners:
+            try:
+                listener(changes)
+            except Exception:
+                logger.exception('presence listener failed')
+
+    def _sync(self):
+        # Writes only what changed since the last sync, plus this worker's
+        # heartbeat row; rows of a worker that stopped heartbeating are
+        # ignored by the others and cleared by whoever notices.
+        now = time.time()
+        with self._lock:
+            local = set(self._counts)
+        added, removed = local - self._synced, self._synced - local
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT INTO presence_workers (worker, seen_at) VALUES (?, ?) ON CONFLICT (worker) DO UPDATE SET seen_at = excluded.seen_at', (self.worker, now))
+            conn.executemany('INSERT OR IGNORE INTO presence (worker, user_id) VALUES (?, ?)', [(self.worker, user_id) for user_id in added])
+            conn.executemany('DELETE FROM presence WHERE worker = ? AND user_id = ?', [(self.worker, user_id) for user_id in removed])
+            for (worker,) in conn.execute('SELECT worker FROM presence_workers WHERE seen_at < ?', (now - self.expiry,)).fetchall():
+                conn.execute('DELETE FROM presence WHERE worker = ?', (worker,))
+                conn.execute('DELETE FROM presence_workers WHERE worker = ?', (worker,))
+            conn.commit()
+            self._synced = local
+            self._remote = frozenset(row[0] for row in conn.execute(
+                'SELECT p.user_id FROM presence_workers w JOIN presence p ON p.worker = w.worker WHERE w.seen_at >= ? AND w.worker != ?', (now - self.expiry, self.worker)))
+            self._ready = True
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def stop(self):
+        # Takes this worker's users out of the shared table on shutdown.
+        self._stop.set()
+        if not self.shared:
+            return
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM presence WHERE worker = ?', (self.worker,))
+            conn.execute('DELETE FROM presence_workers WHERE worker = ?', (self.worker,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {'sockets': len(self._sockets), 'online': len(self._counts), 'remote_online': len(self._remote), 'pending': len(self._changed),
+                'announced': self.announced, 'suppressed': self.suppressed, 'expired': self.expired, 'shared': self.shared}
+
+presence = Presence(lambda: get_db().get_connection())
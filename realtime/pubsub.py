@@ -0,0 +1,53 @@
+import json
+import os
+import time
+
+import socketio
+
+from database.pool import get_pool
+
+POLL_INTERVAL = float(os.environ.get('SOCKETIO_QUEUE_POLL_MS', 20)) / 1000
+# Rows only have to outlive the slowest worker's poll; older ones are pruned.
+RETENTION = int(os.environ.get('SOCKETIO_QUEUE_RETENTION', 60))
+
+class SQLitePubSubManager(socketio.PubSubManager):
+    # Dependency-free message queue for Socket.IO workers on one host. Each
+    # publish is a row in a shared SQLite file and every worker polls for rows
+    # newer than the last one it has seen. Use Redis or AMQP across hosts.
+    name = 'sqlite'
+
+    def __init__(self, path, channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        conn = get_pool(path).acquire()
+        conn.execute('CREATE TABLE IF NOT EXISTS socketio_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)')
+        conn.commit()
+        conn.close()
+
+    def _publish(self, data):
+        conn = get_pool(self.path).acquire()
+        conn.execute('INSERT INTO socketio_queue (channel, payload, created) VALUES (?, ?, ?)', (self.channel, json.dumps(data, default=str), time.time()))
+        conn.commit()
+        conn.close()
+
+    def _listen(self):
+        conn = get_pool(self.path).acquire()
+        try:
+            # Writers are serialised and ids are AUTOINCREMENT, so "id > last"
+            # never skips a row committed after the previous poll.
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_queue').fetchone()[0]
+            pruned = time.monotonic()
+            while True:
+                rows = conn.execute('SELECT id, payload FROM socketio_queue WHERE id > ? AND channel = ? ORDER BY id', (last_id, self.channel)).fetchall()
+                conn.commit()
+                for row in rows:
+                    last_id = row['id']
+                    yield row['payload']
+                if time.monotonic() - pruned > RETENTION:
+                    conn.execute('DELETE FROM socketio_queue WHERE created < ?', (time.time() - RETENTION,))
+                    conn.commit()
+                    pruned = time.monotonic()
+                if not rows:
+                    self.server.sleep(POLL_INTERVAL)
+        finally:
+            conn.close()
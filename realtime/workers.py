@@ -0,0 +1,80 @@
+import os
+import signal
+import socket
+import threading
+import traceback
+import uuid
+
+from werkzeug.serving import make_server
+
+from database.pool import close_all_pools
+
+def reset_after_fork(app):
+    # Pub/sub managers skip queue messages carrying their own host_id; one
+    # inherited from the parent would make every worker ignore the others.
+    socketio = app.extensions.get('socketio')
+    manager = socketio.server.manager if socketio else None
+    if hasattr(manager, 'host_id'):
+        manager.host_id = uuid.uuid4().hex
+
+def serve(app, host, port, workers, on_exit=None):
+    # Pre-fork: the parent binds the port once and each worker accepts on the
+    # inherited socket, so the kernel spreads connections across processes.
+    # Workers share rooms through the Socket.IO message queue, and clients
+    # must use the websocket transport since there are no sticky sessions.
+    # On SIGTERM/SIGINT a worker stops accepting and runs on_exit before it
+    # exits.
+    listener = socket.create_server((host, port), backlog=1024)
+    close_all_pools()
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            reset_after_fork(app)
+            server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+
+            def leave(signum, frame):
+                # shutdown() waits for serve_forever to return, which it can't
+                # while this handler runs on the same thread.
+                threading.Thread(target=server.shutdown, daemon=True).start()
+
+            signal.signal(signal.SIGTERM, leave)
+            signal.signal(signal.SIGINT, leave)
+            status = 0
+            try:
+                server.serve_forever()
+            finally:
+                try:
+                    if on_exit:
+                        on_exit()
+                except Exception:
+                    traceback.print_exc()
+                    status = 1
+                os._exit(status)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f'Serving on {host}:{port} with {workers} workers')
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f'Worker {pid} exited with status {status}, restarting')
+            spawn()
+    listener.close()
@@ -40,7 +40,14 @@ document.addEventListener('DOMContentLoaded', function() {
 function escapeHtml(text) {
     const div = document.createElement('div');
     div.textContent = text;
-    return div.innerHTML;
+    // innerHTML leaves quotes alone; the result also goes into attributes
+    return div.innerHTML.replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+}
+
+// Mirrors the media_url template filter
+function mediaUrl(value, folder = '') {
+    if (!value || /^(https?:)?\//.test(value)) return value;
+    return `/static/uploads/${folder}${value}`;
 }
 
 // Notification sound
@@ -86,6 +93,45 @@ window.addEventListener('scroll', () => {
     }
 });
 
+// Search typeahead
+const navSearch = document.getElementById('navSearch');
+const searchSuggestions = document.getElementById('searchSuggestions');
+let suggestTimer = null;
+
+if (navSearch && searchSuggestions) {
+    navSearch.addEventListener('input', () => {
+        clearTimeout(suggestTimer);
+        const query = navSearch.value.trim();
+        if (!query) {
+            searchSuggestions.classList.remove('active');
+            return;
+        }
+        suggestTimer = setTimeout(async () => {
+            try {
+                const response = await fetch(`/api/search/suggest?q=${encodeURIComponent(query)}`);
+                const users = await response.json();
+                if (navSearch.value.trim() !== query) return;
+                searchSuggestions.innerHTML = users.map(u => `
+                    <a class="search-suggestion" href="/profile/${encodeURIComponent(u.username)}">
+                        <img src="${escapeHtml(u.profile_pic)}" alt="">
+                        <div>
+                            <div style="font-weight: 600;">${escapeHtml(u.full_name)}</div>
+                            <div style="font-size: 13px; color: var(--gray);">@${escapeHtml(u.username)}</div>
+                        </div>
+                    </a>
+                `).join('');
+                searchSuggestions.classList.toggle('active', users.length > 0);
+            } catch (error) {
+                console.error('Error loading suggestions:', error);
+            }
+        }, 150);
+    });
+
+    navSearch.addEventListener('blur', () => {
+        setTimeout(() => searchSuggestions.classList.remove('active'), 200);
+    });
+}
+
 // Copy to clipboard utility
 function copyToClipboard(text) {
     if (navigator.clipboard) {
@@ -1,130 +1,218 @@
 // Real-time Notifications System
-let socket = null; let notificationCount = 0;
+// The server pushes unread counts over Socket.IO; polling only runs as a
+// slow fallback while the socket is disconnected.
+const FALLBACK_POLL_INTERVAL = 120000;
+let notificationSocket = null;
+let notificationCount = 0;
+let fallbackPoll = null;
+const settledUploads = new Set();
+const uploadWaiters = {};
+
 // Initialize when DOM is ready
-document.addEventListener('DOMContentLoaded', function() { 
-    initializeNotifications(); updateNotificationBadge();
-    
-    // Update badge every 30 seconds
-    setInterval(updateNotificationBadge, 30000);
+document.addEventListener('DOMContentLoaded', function() {
+    if (!document.getElementById('notifBadge')) return;
+    initializeNotifications();
+    updateNotificationBadge();
 });
+
 function initializeNotifications() {
-    // Connect to Socket.IO if available
-    if (typeof io !== 'undefined') { socket = io();
-        
-        socket.on('connect', function() { console.log('✅ 
-            Notifications: Connected');
-        });
-        
-        socket.on('disconnect', function() { console.log('❌ 
-            Notifications: Disconnected');
-        });
-        
-        // Listen for new notifications
-        socket.on('new_notification', function(data) { 
-            console.log('🔔 New notification:', data); 
-            showNotificationPopup(data); 
-            updateNotificationBadge(); 
-            playNotificationSound();
-        });
-        
-        // Listen for new pokes
-        socket.on('new_poke', function(data) { console.log('👋 
-            New poke:', data); showPokeNotification(data); 
-            updateNotificationBadge(); 
-            playNotificationSound();
+    if (typeof io === 'undefined') {
+        startFallbackPolling();
+        return;
+    }
+    notificationSocket = io(SOCKET_OPTIONS);
+
+    notificationSocket.on('connect', function() {
+        console.log('✅ Notifications: Connected');
+        stopFallbackPolling();
+    });
+
+    // Keeps this tab counted as online
+    setInterval(() => notificationSocket.connected && notificationSocket.emit('heartbeat'), PRESENCE_HEARTBEAT_MS);
+
+    notificationSocket.on('disconnect', function() {
+        console.log('❌ Notifications: Disconnected');
+        startFallbackPolling();
+    });
+
+    // Sent by the server on connect
+    notificationSocket.on('notification_count', function(data) {
+        setNotificationBadge(data.count);
+    });
+
+    // Listen for new notifications
+    notificationSocket.on('new_notification', function(data) {
+        console.log('🔔 New notification:', data);
+        setNotificationBadge(data.count);
+        showNotificationPopup(data);
+        playNotificationSound();
+    });
+
+    // Listen for new pokes
+    notificationSocket.on('new_poke', function(data) {
+        console.log('👋 New poke:', data);
+        setNotificationBadge(data.count);
+        showPokeNotification(data);
+        playNotificationSound();
+    });
+
+    // Image uploads finish on the server after the request has returned
+    notificationSocket.on('upload_complete', function(data) {
+        applyUploadedImage(data);
+        settleUpload(data);
+        showToast(data.kind === 'post' ? 'Photo added to your post' : 'Profile picture updated');
+    });
+
+    notificationSocket.on('upload_failed', function(data) {
+        settleUpload(data);
+        showToast('Image upload failed', 'error');
+    });
+}
+
+function settleUpload(data) {
+    const key = `${data.kind}:${data.id}`;
+    settledUploads.add(key);
+    (uploadWaiters[key] || []).forEach(resolve => resolve());
+    delete uploadWaiters[key];
+}
+
+// Resolves once the server reports the upload finished (or failed); the
+// event can arrive before the request that started the upload returns.
+function waitForUpload(kind, id, timeout = 15000) {
+    const key = `${kind}:${id}`;
+    return new Promise(resolve => {
+        if (settledUploads.has(key) || !notificationSocket || !notificationSocket.connected) return resolve();
+        (uploadWaiters[key] = uploadWaiters[key] || []).push(resolve);
+        setTimeout(resolve, timeout);
+    });
+}
+
+function applyUploadedImage(data) {
+    if (data.kind === 'profile') {
+        document.querySelectorAll(`img[data-user-pic="${data.id}"]`).forEach(img => {
+            img.src = data.url;
         });
+        return;
     }
+    const card = document.querySelector(`.post-card[data-post-id="${data.id}"]`);
+    if (!card) return;
+    let img = card.querySelector('.post-image');
+    if (!img) {
+        img = document.createElement('img');
+        img.className = 'post-image';
+        img.alt = 'Post image';
+        card.querySelector('.post-content').after(img);
+    }
+    img.src = data.url;
 }
-async function updateNotificationBadge() { try { const 
-        response = await fetch('/api/notifications/count'); 
-        const data = await response.json(); notificationCount 
-        = data.count;
-        
-        const badge = document.getElementById('notifBadge'); 
-        if (badge) {
-            if (notificationCount > 0) { badge.textContent = 
-                notificationCount > 9 ? '9+' : 
-                notificationCount; badge.style.display = 
-                'flex';
-            } else {
-                badge.style.display = 'none';
-            }
-        }
+
+function startFallbackPolling() {
+    if (!fallbackPoll) {
+        fallbackPoll = setInterval(updateNotificationBadge, FALLBACK_POLL_INTERVAL);
+    }
+}
+
+function stopFallbackPolling() {
+    clearInterval(fallbackPoll);
+    fallbackPoll = null;
+}
+
+async function updateNotificationBadge() {
+    try {
+        const response = await fetch('/api/notifications/count');
+        const data = await response.json();
+        setNotificationBadge(data.count);
     } catch (error) {
-        console.error('Error fetching notification count:', 
-        error);
+        console.error('Error fetching notification count:', error);
     }
 }
-function showNotificationPopup(data) { const popup = 
-    document.createElement('div'); popup.className = 
-    'notification-popup'; popup.style.cssText = `
-        position: fixed; top: 90px; right: 20px; background: 
-        white; padding: 16px; border-radius: 12px; box-shadow: 
-        0 4px 12px rgba(0,0,0,0.15); max-width: 350px; 
-        z-index: 9999; animation: slideInRight 0.3s ease-out; 
+
+function setNotificationBadge(count) {
+    notificationCount = count;
+    const badge = document.getElementById('notifBadge');
+    if (!badge) return;
+    if (notificationCount > 0) {
+        badge.textContent = notificationCount > 9 ? '9+' : notificationCount;
+        badge.style.display = 'flex';
+    } else {
+        badge.style.display = 'none';
+    }
+}
+
+function showNotificationPopup(data) {
+    const popup = document.createElement('div');
+    popup.className = 'notification-popup';
+    popup.style.cssText = `
+        position: fixed; top: 90px; right: 20px; background: white;
+        padding: 16px; border-radius: 12px; box-shadow: 0 4px 12px rgba(0,0,0,0.15);
+        max-width: 350px; z-index: 9999; animation: slideInRight 0.3s ease-out;
         cursor: pointer;
     `;
-    
-    popup.innerHTML = ` <div style="display: flex; gap: 12px; 
-        align-items: start;">
-            <div style="font-size: 32px;">🔔</div> <div 
-            style="flex: 1;">
-                <div style="font-weight: 600; margin-bottom: 
-                4px;">New Notification</div> <div 
-                style="color: #65676b; font-size: 
-                14px;">${data.message || data.content}</div>
-            </div> <button 
-            onclick="this.parentElement.parentElement.remove()" 
-            style="
-                background: none; border: none; font-size: 
-                20px; cursor: pointer; color: #65676b;
-            ">×</button> </div> `;
-    
-    popup.addEventListener('click', function() { 
-        window.location.href = '/notifications';
+
+    const text = data.from_user ? `${data.from_user} ${data.content}` : (data.message || data.content);
+    popup.innerHTML = `
+        <div style="display: flex; gap: 12px; align-items: start;">
+            <div style="font-size: 32px;">🔔</div>
+            <div style="flex: 1;">
+                <div style="font-weight: 600; margin-bottom: 4px;">New Notification</div>
+                <div style="color: #65676b; font-size: 14px;">${escapeHtml(text)}</div>
+            </div>
+            <button onclick="event.stopPropagation(); this.parentElement.parentElement.remove()" style="
+                background: none; border: none; font-size: 20px; cursor: pointer; color: #65676b;
+            ">×</button>
+        </div>
+    `;
+
+    popup.addEventListener('click', function() {
+        window.location.href = data.type === 'message' ? '/messages' : '/notifications';
     });
-    
+
     document.body.appendChild(popup);
-    
-    setTimeout(() => { popup.style.opacity = '0'; 
-        popup.style.transform = 'translateX(400px)'; 
+
+    setTimeout(() => {
+        popup.style.opacity = '0';
+        popup.style.transform = 'translateX(400px)';
         setTimeout(() => popup.remove(), 300);
     }, 5000);
 }
-function showPokeNotification(data) { const popup = 
-    document.createElement('div'); popup.className = 
-    'notification-popup'; popup.style.cssText = `
-        position: fixed; top: 90px; right: 20px; background: 
-        linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-        color: white; padding: 16px; border-radius: 12px; 
-        box-shadow: 0 4px 12px rgba(0,0,0,0.15); max-width: 
-        350px; z-index: 9999; animation: slideInRight 0.3s 
-        ease-out; cursor: pointer;
+
+function showPokeNotification(data) {
+    const popup = document.createElement('div');
+    popup.className = 'notification-popup';
+    popup.style.cssText = `
+        position: fixed; top: 90px; right: 20px;
+        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white;
+        padding: 16px; border-radius: 12px; box-shadow: 0 4px 12px rgba(0,0,0,0.15);
+        max-width: 350px; z-index: 9999; animation: slideInRight 0.3s ease-out;
+        cursor: pointer;
     `;
-    
-    popup.innerHTML = ` <div style="display: flex; gap: 12px; 
-        align-items: center;">
-            <div style="font-size: 48px;">👋</div> <div 
-            style="flex: 1;">
-                <div style="font-weight: 600; margin-bottom: 
-                4px;">
-                    ${data.from_user} poked you! </div> <div 
-                style="font-size: 13px; opacity: 0.9;">
-                    Click to poke back </div> </div> </div> `;
-    
-    popup.addEventListener('click', function() { 
+
+    popup.innerHTML = `
+        <div style="display: flex; gap: 12px; align-items: center;">
+            <div style="font-size: 48px;">👋</div>
+            <div style="flex: 1;">
+                <div style="font-weight: 600; margin-bottom: 4px;">${escapeHtml(data.from_user || 'Someone')} poked you!</div>
+                <div style="font-size: 13px; opacity: 0.9;">Click to poke back</div>
+            </div>
+        </div>
+    `;
+
+    popup.addEventListener('click', function() {
         window.location.href = '/pokes';
     });
-    
+
     document.body.appendChild(popup);
-    
-    setTimeout(() => { popup.style.opacity = '0'; 
-        popup.style.transform = 'translateX(400px)'; 
+
+    setTimeout(() => {
+        popup.style.opacity = '0';
+        popup.style.transform = 'translateX(400px)';
         setTimeout(() => popup.remove(), 300);
     }, 5000);
 }
+
 // Request notification permission
-if ('Notification' in window && Notification.permission === 
-'default') {
+if ('Notification' in window && Notification.permission === 'default') {
     Notification.requestPermission().then(permission => {
-        console.log('Notification permission:', pe
+        console.log('Notification permission:', permission);
+    });
+}
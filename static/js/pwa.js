@@ -1,4 +1,11 @@
-Progressive Web App functionality
+// Progressive Web App functionality
+
+// The worker precaches the versioned CSS/JS; see sw.js.
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', () => {
+        navigator.serviceWorker.register('/sw.js').catch(err => console.log('Service worker registration failed:', err));
+    });
+}
 
 // Install button handler
 let deferredPrompt;
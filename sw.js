@@ -0,0 +1,50 @@
+// SocialHub service worker. Served by /sw.js, which prepends
+// BUILD = {version, assets}: the versioned URLs of the CSS/JS every page loads.
+
+const CACHE_PREFIX = 'socialhub-static-';
+const CACHE = CACHE_PREFIX + BUILD.version;
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then(cache => cache.addAll(BUILD.assets))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    // A new build means new asset URLs; the previous cache is dead weight.
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys.filter(key => key.startsWith(CACHE_PREFIX) && key !== CACHE).map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+function isVersionedAsset(request) {
+    const url = new URL(request.url);
+    return request.method === 'GET' && url.origin === self.location.origin &&
+        url.pathname.startsWith('/static/') && !url.pathname.startsWith('/static/uploads/') &&
+        url.searchParams.has('v');
+}
+
+self.addEventListener('fetch', (event) => {
+    // ?v= changes with the file's content, so a cached copy is never stale.
+    // Pages and API calls go to the network as before.
+    if (!isVersionedAsset(event.request)) return;
+    event.respondWith(
+        caches.open(CACHE).then(cache =>
+            cache.match(event.request).then(cached => cached || fetch(event.request).then(response => {
+                if (response.ok) cache.put(event.request, response.clone());
+                return response;
+            }))
+        )
+    );
+});
+
+self.addEventListener('message', (event) => {
+    if (event.data && event.data.type === 'ONLINE') {
+        // Nothing is queued while offline yet; just pick up a newer worker.
+        self.registration.update();
+    }
+});
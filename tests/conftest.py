@@ -0,0 +1,28 @@
+import itertools
+import os
+import tempfile
+
+import pytest
+
+# DATABASE_PATH is read when database.models is imported, so every test in
+# the run shares one scratch database; tests create their own users.
+_tmp = tempfile.mkdtemp(prefix='socialhub-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_tmp, 'test.db')
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+os.environ.setdefault('UPLOAD_BACKEND', 'local')
+
+_names = itertools.count(1)
+
+@pytest.fixture(scope='session')
+def app():
+    import app as app_module
+    return app_module.create_app({'TESTING': True})
+
+@pytest.fixture
+def make_user(app):
+    from database.models import User
+
+    def make(**fields):
+        name = fields.pop('username', None) or f'user{next(_names)}'
+        return User.create(name, f'{name}@example.com', 'secret', fields.pop('full_name', name.title()))
+    return make
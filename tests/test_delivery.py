@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+from database.models import get_db
+from realtime.delivery import ChatBusy, ChatPipeline
+
+def stored(content):
+    conn = get_db().get_connection()
+    try:
+        return conn.execute('SELECT COUNT(*) FROM messages WHERE content = ?', (content,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def test_timed_out_send_is_not_stored(app, make_user):
+    sender, receiver = make_user(), make_user()
+    writing, release = threading.Event(), threading.Event()
+
+    def connect():
+        # Holds the writer on its first batch until the test lets it go.
+        writing.set()
+        release.wait(5)
+        return get_db().get_connection()
+
+    pipeline = ChatPipeline(connect, timeout=0.2)
+    first = threading.Thread(target=pipeline.send, args=(sender, receiver, 'in flight'))
+    first.start()
+    assert writing.wait(5)
+    with pytest.raises(ChatBusy):
+        pipeline.send(sender, receiver, 'timed out')
+    release.set()
+    first.join()
+    pipeline.send(sender, receiver, 'after')
+
+    assert stored('in flight') == 1
+    assert stored('timed out') == 0
+    assert stored('after') == 1
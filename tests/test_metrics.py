@@ -0,0 +1,12 @@
+from monitoring import instrument
+
+def test_metrics_need_the_token(app, monkeypatch):
+    client = app.test_client()
+    monkeypatch.setattr(instrument, 'METRICS_TOKEN', '')
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setattr(instrument, 'METRICS_TOKEN', 'scrape-me')
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 404
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-me'})
+    assert response.status_code == 200
+    assert b'http_request_duration_seconds' in response.data
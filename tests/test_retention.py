@@ -0,0 +1,39 @@
+import sqlite3
+
+from database import retention
+from database.models import Poke, get_db
+
+def test_old_pokes_are_archived(app, make_user, tmp_path):
+    # Seeded through the app, so the rows carry only what it really writes.
+    poker, poked = make_user(), make_user()
+    assert Poke.send_poke(poker, poked)
+    conn = get_db().get_connection()
+    try:
+        conn.execute("UPDATE pokes SET created_at = datetime('now', '-200 days') WHERE poker_id = ?", (poker,))
+        conn.commit()
+    finally:
+        conn.close()
+    archive = str(tmp_path / 'archive.db')
+    report = retention.run([rule for rule in retention.POLICIES if rule.table == 'pokes'], archive_path=archive)
+
+    assert report['tables']['pokes']['rows'] >= 1
+    conn = get_db().get_connection()
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM pokes WHERE poker_id = ?', (poker,)).fetchone()[0] == 0
+    finally:
+        conn.close()
+    archived = sqlite3.connect(archive)
+    try:
+        assert archived.execute('SELECT COUNT(*) FROM pokes WHERE poker_id = ? AND poked_id = ?', (poker, poked)).fetchone()[0] == 1
+    finally:
+        archived.close()
+
+def test_recent_pokes_are_kept(app, make_user, tmp_path):
+    poker, poked = make_user(), make_user()
+    assert Poke.send_poke(poker, poked)
+    retention.run([rule for rule in retention.POLICIES if rule.table == 'pokes'], archive_path=str(tmp_path / 'archive.db'))
+    conn = get_db().get_connection()
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM pokes WHERE poker_id = ?', (poker,)).fetchone()[0] == 1
+    finally:
+        conn.close()
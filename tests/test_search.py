@@ -0,0 +1,19 @@
+import pytest
+
+from database.models import User, get_db
+
+def test_best_match_wins_over_many_weaker_ones(app, make_user):
+    if not get_db().fts:
+        pytest.skip('SQLite built without FTS5')
+    conn = get_db().get_connection()
+    try:
+        conn.executemany("INSERT INTO users (username, email, password_hash, full_name, bio) VALUES (?, ?, 'x', ?, 'Head of marketing')",
+                         ((f'staff{i}', f'staff{i}@example.com', f'Staff {i}') for i in range(3000)))
+        conn.commit()
+    finally:
+        conn.close()
+    mark = make_user(username='mark', full_name='Mark Twain')
+
+    results = User.search('mark')
+    assert len(results) == 20
+    assert results[0]['id'] == mark
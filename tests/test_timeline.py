@@ -0,0 +1,29 @@
+from database import timeline
+from database.models import Post, get_db
+from database.timeline import Timeline
+
+def test_fan_out_keeps_timelines_bounded(app, make_user, monkeypatch):
+    monkeypatch.setattr(timeline, 'FANOUT_ENABLED', True)
+    monkeypatch.setattr(timeline, 'TIMELINE_SIZE', 10)
+    author, follower = make_user(), make_user()
+    conn = get_db().get_connection()
+    try:
+        conn.execute("INSERT INTO friendships (user_a, user_b, requester_id, status) VALUES (?, ?, ?, 'accepted')", (author, follower, author))
+        conn.commit()
+    finally:
+        conn.close()
+    Timeline.get_feed(follower)  # builds the follower's timeline
+
+    post_ids = [Post.create(author, f'post {i}') for i in range(30)]
+
+    conn = get_db().get_connection()
+    try:
+        kept = [row['post_id'] for row in conn.execute('SELECT post_id FROM timelines WHERE user_id = ? ORDER BY created_at DESC, post_id DESC', (follower,))]
+        state = conn.execute('SELECT floor_created_at, floor_post_id FROM timeline_state WHERE user_id = ?', (follower,)).fetchone()
+    finally:
+        conn.close()
+    assert kept == post_ids[:-11:-1]
+    assert state['floor_post_id'] == kept[-1]
+    # Paging past the retained window still reaches the older posts.
+    feed = Timeline.get_feed(follower, limit=30)
+    assert [post['id'] for post in feed] == post_ids[::-1]
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import threading
+
+from flask import Response, current_app, jsonify, render_template, request, url_for
+from markupsafe import Markup, escape
+
+from database.cache import TTLCache
+
+# Rendered post cards. The key carries everything the markup depends on
+# (counters, image, author, age label, whether the viewer liked it, and the
+# previewed comments with their authors' names and pictures), so a changed
+# post or a renamed commenter simply misses; nothing needs invalidating.
+fragment_cache = TTLCache(maxsize=int(os.environ.get('FRAGMENT_CACHE_SIZE', 4096)), ttl=int(os.environ.get('FRAGMENT_CACHE_TTL', 300)))
+
+# Stands in for the viewer's avatar in a cached card, which is otherwise
+# the same for everyone.
+VIEWER_PIC = '__viewer_pic__'
+
+# Loaded by every page; the service worker precaches them.
+PRECACHE = ('css/style.css', 'js/main.js', 'js/notifications.js', 'js/pwa.js')
+ASSET_MAX_AGE = 365 * 86400
+
+def post_card(post, user):
+    age = current_app.jinja_env.filters['time_ago'](post['created_at'])
+    key = (post['id'], post['likes_count'], post['comments_count'], bool(post.get('user_liked')), age, post['image'],
+           post['full_name'], post['profile_pic'], post.get('wall_owner_name'),
+           tuple((comment['id'], comment['full_name'], comment['profile_pic']) for comment in post.get('comment_previews', ())))
+    html = fragment_cache.get(key)
+    if html is None:
+        html = render_template('post_card.html', post=post, viewer_pic=VIEWER_PIC)
+        fragment_cache.set(key, html)
+    viewer_pic = current_app.jinja_env.filters['media_url'](user['profile_pic'], 'profiles/')
+    return Markup(html.replace(VIEWER_PIC, str(escape(viewer_pic))))
+
+def conditional_json(payload):
+    # The ETag is a hash of the body: a client re-asking for data it already
+    # has gets an empty 304 instead of the same JSON again.
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+class AssetVersions:
+    # Content hashes of files under static/, appended to their URLs as ?v=
+    # so they can be cached for a year and still change on deploy.
+    def __init__(self, root):
+        self.root = root
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = os.path.join(self.root, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._versions.get(filename)
+        if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+        with open(path, 'rb') as f:
+            version = hashlib.md5(f.read()).hexdigest()[:10]
+        with self._lock:
+            self._versions[filename] = ((stat.st_mtime_ns, stat.st_size), version)
+        return version
+
+def service_worker():
+    # sw.js expects BUILD = {version, assets}; the version changes whenever
+    # a precached asset does, which makes the worker drop its old cache.
+    assets = [url_for('static', filename=filename) for filename in PRECACHE]
+    build = {'version': hashlib.md5(''.join(assets).encode()).hexdigest()[:10], 'assets': assets}
+    with open(os.path.join(current_app.root_path, 'sw.js')) as f:
+        source = f.read()
+    response = Response(f'const BUILD = {json.dumps(build)};\n{source}', mimetype='application/javascript')
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def manifest():
+    with open(os.path.join(current_app.root_path, 'manifest.json'), 'rb') as f:
+        response = Response(f.read(), mimetype='application/manifest+json')
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
+
+def init_app(app):
+    versions = AssetVersions(app.static_folder)
+    app.extensions['asset_versions'] = versions
+
+    @app.url_defaults
+    def static_version(endpoint, values):
+        # Uploads are named once and never rewritten; no need to hash them.
+        filename = values.get('filename', '')
+        if endpoint == 'static' and 'v' not in values and not filename.startswith('uploads/'):
+            version = versions.get(filename)
+            if version:
+                values['v'] = version
+
+    @app.after_request
+    def cache_static(response):
+        if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = ASSET_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    app.jinja_env.globals['post_card'] = post_card
+    app.add_url_rule('/sw.js', 'service_worker', service_worker)
+    app.add_url_rule('/manifest.json', 'manifest', manifest)